@@ -1,5 +1,10 @@
 #!/usr/bin/env ruby
 
+# the last epoch trained and the classifier accuracy of its last full evaluation are found by their
+# labels, since the lines printed after them (the stop reason, the saved models...) vary between runs
+EPOCH_PATTERN = /Epoch: (\d+)/
+ACCURACY_PATTERN = /Classifier accuracy for synthetic data: (\S+)/
+
 ["", "R", "C", "CR"].each do |c|
   total_epochs = 0.0
   total_accuracy = 0.0
@@ -9,8 +14,8 @@
     (0..n).each do |i|
       File.open("stdout/#{name}_#{i}#{c}.txt", 'r') do |file|
         lines = file.each_line.to_a
-        epoch = lines[-11][37..-32].to_i
-        acc = lines[-7][40..-2].to_f
+        epoch = lines.reverse.lazy.map { |line| line[EPOCH_PATTERN, 1] }.find { |value| value }.to_i
+        acc = lines.reverse.lazy.map { |line| line[ACCURACY_PATTERN, 1] }.find { |value| value }.to_f
 
         total_epochs += epoch
         total_accuracy += acc
@@ -19,4 +24,4 @@
   end
 
   puts "Configuration: #{c.inspect}, avg accuracy: #{total_accuracy / 23.0}, avg epochs: #{total_epochs / 23.0}"
-end
\ No newline at end of file
+end
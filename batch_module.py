@@ -0,0 +1,267 @@
+"""
+Contains the source of training batches: sampling of the real data and the input noise,
+prepared on a background thread while the current training step runs.
+"""
+
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from instrumentation_module import phase
+
+# where the latent noise of the training steps is sampled: on the host by numpy, or on-graph
+# by tf.random inside the compiled train step
+HOST_NOISE = 'host'
+GRAPH_NOISE = 'graph'
+NOISE_SOURCES = (HOST_NOISE, GRAPH_NOISE)
+
+
+@dataclass(frozen=True)
+class TrainingBatch:
+    """
+    Everything a training step needs besides the models. The first half of discriminator_input
+    holds the real data, the second half is left for the synthetic data of the current generator,
+    so no concatenation is needed on the critical path. The noise is None when it is sampled on-graph.
+    For a conditional GAN, discriminator_classes holds the class labels of the real data followed by
+    the class labels the synthetic data is generated for, and generator_classes the class labels of
+    the generator update, both of the shape (n, 1).
+    """
+    discriminator_input: np.ndarray
+    discriminator_labels: np.ndarray
+    discriminator_noise: Optional[np.ndarray]
+    generator_noise: Optional[np.ndarray]
+    generator_labels: np.ndarray
+    discriminator_classes: Optional[np.ndarray] = None
+    generator_classes: Optional[np.ndarray] = None
+
+    @property
+    def synthetic_classes(self) -> Optional[np.ndarray]:
+        """
+        The class labels the synthetic data of the discriminator update is generated for.
+        """
+        return None if self.discriminator_classes is None else self.discriminator_classes[self.batch_size:]
+
+    @property
+    def batch_size(self) -> int:
+        return len(self.generator_labels)
+
+    @property
+    def real_data(self) -> np.ndarray:
+        return self.discriminator_input[:self.batch_size]
+
+
+class NoiseGenerator:
+    """
+    Samples standard normal float32 noise of a fixed shape into a ring of preallocated buffers,
+    so no memory is allocated and nothing is cast per draw. A returned array is overwritten
+    num_buffers draws later, so num_buffers has to exceed the number of arrays in use at once.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], generator: np.random.Generator, num_buffers: int = 1):
+        """
+        :param shape: The shape of the noise, e.g. (batch_size, seq_length, latent_dim).
+        :param generator: The random generator the noise is drawn from.
+        :param num_buffers: The number of buffers the draws cycle through.
+        """
+        self.shape: Tuple[int, ...] = tuple(shape)
+        self.generator: np.random.Generator = generator
+        self.buffers: np.ndarray = np.empty((max(1, num_buffers),) + self.shape, dtype=np.float32)
+        self.position: int = 0
+
+    def next(self) -> np.ndarray:
+        """
+        :return: A buffer filled with fresh noise.
+        """
+        buffer: np.ndarray = self.buffers[self.position]
+        self.generator.standard_normal(dtype=np.float32, out=buffer)
+        self.position = (self.position + 1) % len(self.buffers)
+        return buffer
+
+
+class RealDataSampler:
+    """
+    Samples batches of distinct real segments with shuffled-epoch semantics: the data is
+    permuted once, consecutive slices of the permutation are handed out, and the data is
+    permuted again when fewer than batch_size segments are left. Each draw costs O(batch_size),
+    independently of the size of the dataset.
+    """
+
+    def __init__(self, num_segments: int, batch_size: int, generator: np.random.Generator):
+        """
+        :param num_segments: The number of real segments.
+        :param batch_size: The number of segments in a batch.
+        :param generator: The random generator used for the permutations.
+        """
+        if batch_size > num_segments:
+            raise ValueError(f'Cannot take batches of {batch_size} distinct segments '
+                             f'from a population of {num_segments}')
+        self.num_segments: int = num_segments
+        self.batch_size: int = batch_size
+        self.generator: np.random.Generator = generator
+        self.permutation: np.ndarray = generator.permutation(num_segments)
+        self.position: int = 0
+
+    def sample(self) -> np.ndarray:
+        """
+        Draws the indices of the next batch.
+
+        :return: A sorted numpy array of batch_size distinct indices.
+        """
+        if self.position + self.batch_size > self.num_segments:
+            self.permutation = self.generator.permutation(self.num_segments)
+            self.position = 0
+        indices: np.ndarray = self.permutation[self.position:self.position + self.batch_size]
+        self.position += self.batch_size
+        # sorted indices keep the copy of the rows (close to) sequential
+        return np.sort(indices)
+
+
+# put in the queue by the background thread when preparing a batch failed
+_PREFETCH_FAILED = object()
+
+
+class BatchSource:
+    """
+    Produces TrainingBatch objects. With prefetch_batches > 0 the next batches are prepared
+    on a background thread while the current training step runs.
+    """
+
+    def __init__(self,
+                 input_data: np.ndarray,
+                 batch_size: int,
+                 latent_dim: int,
+                 prefetch_batches: int = 2,
+                 seed: Optional[int] = None,
+                 noise_source: str = HOST_NOISE,
+                 class_labels: Optional[np.ndarray] = None):
+        """
+        :param input_data: The real data of the shape (num_segments, seq_length, num_channels).
+        :param batch_size: The batch size.
+        :param latent_dim: The latent dimension of the generator.
+        :param prefetch_batches: The number of batches prepared ahead of time, 0 prepares them on demand.
+        :param seed: The seed, by default it is drawn from the global numpy random state so
+        that np.random.seed still makes training reproducible.
+        :param noise_source: Either "host" or "graph", with "graph" the batches carry no noise.
+        :param class_labels: The class labels of the real data, which a conditional GAN needs. The class
+        labels of the synthetic data are drawn from the same distribution, so that the discriminator
+        cannot tell real from synthetic data by its class label.
+        """
+        if noise_source not in NOISE_SOURCES:
+            raise ValueError(f'Unknown noise source "{noise_source}", expected one of {NOISE_SOURCES}')
+        self.input_data: np.ndarray = input_data
+        self.batch_size: int = batch_size
+        self.latent_dim: int = latent_dim
+        self.seq_length: int = input_data.shape[1]
+        self.generator: np.random.Generator = np.random.default_rng(
+            np.random.randint(0, 2 ** 31) if seed is None else seed)
+        self.sampler: RealDataSampler = RealDataSampler(len(input_data), batch_size, self.generator)
+        self.class_labels: Optional[np.ndarray] = None
+        if class_labels is not None:
+            self.class_labels = np.asarray(class_labels, dtype=np.int32).reshape(-1)
+
+        # besides the batches in the queue, one batch is used by the training step and one is being
+        # prepared, and every batch holds the noise of the discriminator and of the generator
+        self.noise_generator: Optional[NoiseGenerator] = None
+        if noise_source == HOST_NOISE:
+            self.noise_generator = NoiseGenerator((batch_size, self.seq_length, latent_dim), self.generator,
+                                                  num_buffers=2 * (max(prefetch_batches, 0) + 2))
+
+        # the labels never change, so they are shared by every batch
+        self.discriminator_labels: np.ndarray = np.ones((2 * batch_size, 1))
+        self.discriminator_labels[batch_size:, :] = 0
+        self.generator_labels: np.ndarray = np.ones((batch_size, 1))
+
+        self.prefetch_batches: int = prefetch_batches
+        self._queue: Optional[queue.Queue] = None
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[Exception] = None
+        if prefetch_batches > 0:
+            self._queue = queue.Queue(maxsize=prefetch_batches)
+            self._thread = threading.Thread(target=self._prefetch, name='BatchSource', daemon=True)
+            self._thread.start()
+
+    def _make_batch(self) -> TrainingBatch:
+        """
+        Prepares a batch: the real rows, the noise of both updates and the labels.
+        """
+        discriminator_input: np.ndarray = np.empty((2 * self.batch_size,) + self.input_data.shape[1:],
+                                                   dtype=np.result_type(self.input_data.dtype, np.float32))
+        with phase('real_batch_sampling'):
+            rows: np.ndarray = self.sampler.sample()
+            np.take(self.input_data, rows, axis=0, out=discriminator_input[:self.batch_size])
+
+            discriminator_classes: Optional[np.ndarray] = None
+            generator_classes: Optional[np.ndarray] = None
+            if self.class_labels is not None:
+                num_segments: int = len(self.class_labels)
+                discriminator_classes = np.concatenate((
+                    self.class_labels[rows],
+                    self.class_labels[self.generator.integers(0, num_segments, self.batch_size)]))[:, np.newaxis]
+                generator_classes = self.class_labels[self.generator.integers(0, num_segments,
+                                                                              self.batch_size)][:, np.newaxis]
+
+        discriminator_noise: Optional[np.ndarray] = None
+        generator_noise: Optional[np.ndarray] = None
+        if self.noise_generator is not None:
+            with phase('noise_generation'):
+                discriminator_noise = self.noise_generator.next()
+                generator_noise = self.noise_generator.next()
+        return TrainingBatch(discriminator_input=discriminator_input,
+                             discriminator_labels=self.discriminator_labels,
+                             discriminator_noise=discriminator_noise,
+                             generator_noise=generator_noise,
+                             generator_labels=self.generator_labels,
+                             discriminator_classes=discriminator_classes,
+                             generator_classes=generator_classes)
+
+    def _put(self, item: object) -> None:
+        """
+        Puts an item in the queue, waiting for room in it unless stopped.
+        """
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+    def _prefetch(self) -> None:
+        """
+        The body of the background thread, which keeps the queue filled until stopped. An error
+        stops the thread, and is raised by next once the batches prepared before it are used.
+        """
+        while not self._stop_event.is_set():
+            try:
+                batch: TrainingBatch = self._make_batch()
+            except Exception as error:
+                self._error = error
+                self._put(_PREFETCH_FAILED)
+                return
+            self._put(batch)
+
+    def next(self) -> TrainingBatch:
+        """
+        :return: The next training batch.
+        :raises Exception: The error the background thread stopped on.
+        """
+        if self._queue is None:
+            return self._make_batch()
+        batch = self._queue.get()
+        if batch is _PREFETCH_FAILED:
+            # put back, so that a later call raises the error as well instead of waiting forever
+            self._queue.put_nowait(_PREFETCH_FAILED)
+            raise self._error
+        return batch
+
+    def close(self) -> None:
+        """
+        Stops the background thread.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
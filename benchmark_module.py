@@ -0,0 +1,463 @@
+"""
+Micro-benchmarks for the hot paths of training.
+Usage: python3 benchmark_module.py noise --shape 25,100,10 --shape 100,100,10
+       python3 benchmark_module.py suite --output benchmarks.json --baseline benchmark_baseline.json
+
+The suite times every numerical hot path (the noise, the similarity metrics, the statistical
+features and their distance, a training step and loading the data) for a few shapes, writes the
+results to a JSON file and compares them against the results of an earlier run, the baseline.
+benchmark_baseline.json holds the results of the default shapes. A benchmark whose modules cannot
+be imported, e.g. without tensorflow, is skipped and the rest of the suite still runs.
+"""
+
+import argparse as arg_parser
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from batch_module import NoiseGenerator
+
+# (batch_size, seq_length, latent_dim) of a training batch, an evaluation batch and a large generation batch
+DEFAULT_NOISE_SHAPES = ((25, 100, 10), (100, 100, 10), (1000, 100, 10))
+
+# the ratios, latent dimension and number of features of model.conf
+LATENT_DIM = 10
+REAL_SYNTHETIC_RATIO = 5
+SYNTHETIC_SYNTHETIC_RATIO = 10
+REAL_REAL_RATIO = 10
+NUM_FEATURES = 9
+NUM_CLASSES = 2
+DEFAULT_TOLERANCE = 0.2
+
+
+def time_function(function: Callable[[], object], repeats: int = 100, warmup: int = 5) -> float:
+    """
+    Times a function by calling it repeatedly.
+
+    :param function: A function without arguments.
+    :param repeats: The number of timed calls.
+    :param warmup: The number of calls made before timing, e.g. to trace tf.functions.
+    :return: The median duration of a call in seconds.
+    """
+    return float(np.median(time_calls(function, repeats, warmup)))
+
+
+def time_calls(function: Callable[[], object], repeats: int = 100, warmup: int = 5) -> List[float]:
+    """
+    Times every call of a function called repeatedly.
+
+    :param function: A function without arguments.
+    :param repeats: The number of timed calls.
+    :param warmup: The number of calls made before timing, e.g. to trace tf.functions.
+    :return: The duration of every timed call in seconds.
+    """
+    for _ in range(warmup):
+        function()
+    durations: List[float] = []
+    for _ in range(repeats):
+        start: float = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def legacy_noise(shape: Tuple[int, int, int]) -> np.ndarray:
+    """
+    The noise as it used to be generated: float64 from the legacy global random state, then
+    cast to float32 as Keras does when the noise is fed to the generator.
+    """
+    batch_size, time_steps, latent_dim = shape
+    return np.reshape(np.array(np.random.normal(0, 1, latent_dim * time_steps * batch_size)),
+                      (batch_size, time_steps, latent_dim)).astype(np.float32)
+
+
+def benchmark_noise(shapes: List[Tuple[int, int, int]], repeats: int = 100, include_graph: bool = True) -> List[Dict]:
+    """
+    Benchmarks the ways of generating the latent noise for each shape.
+
+    :param shapes: A list of (batch_size, seq_length, latent_dim) shapes.
+    :param repeats: The number of timed draws per method and shape.
+    :param include_graph: Whether to benchmark sampling with tf.random, which needs tensorflow.
+    :return: A list of dictionaries with the keys shape, method and seconds.
+    """
+    generator: np.random.Generator = np.random.default_rng(0)
+    methods: Dict[str, Callable[[Tuple[int, int, int]], Callable[[], object]]] = {
+        'legacy float64': lambda shape: lambda: legacy_noise(shape),
+        'generator float32': lambda shape: lambda: generator.standard_normal(shape, dtype=np.float32),
+        'buffered float32': lambda shape: NoiseGenerator(shape, generator, num_buffers=2).next,
+    }
+
+    if include_graph:
+        import tensorflow as tf
+        graph_generator = tf.random.Generator.from_seed(0)
+
+        def graph_noise(shape: Tuple[int, int, int]) -> Callable[[], object]:
+            sample = tf.function(lambda: graph_generator.normal(shape=shape))
+            # only the on-device sampling is measured, the noise is never copied to the host
+            return sample
+
+        methods['tf.random on-graph'] = graph_noise
+
+    results: List[Dict] = []
+    for shape in shapes:
+        for method, make_function in methods.items():
+            results.append({'shape': tuple(shape),
+                            'method': method,
+                            'seconds': time_function(make_function(tuple(shape)), repeats=repeats)})
+    return results
+
+
+@dataclass(frozen=True)
+class SuiteShape:
+    """
+    The shape a benchmark of the suite runs on: batch_size segments of seq_length steps of
+    num_channels channels, out of a dataset of dataset_size segments.
+    """
+    batch_size: int
+    seq_length: int
+    num_channels: int
+    dataset_size: int
+
+    @property
+    def label(self) -> str:
+        return f'b{self.batch_size}_t{self.seq_length}_c{self.num_channels}_n{self.dataset_size}'
+
+
+# a training batch of an accelerometer and a gyroscope dataset, and an evaluation batch of a larger dataset
+DEFAULT_SUITE_SHAPES = (SuiteShape(25, 100, 3, 1000), SuiteShape(25, 100, 6, 1000), SuiteShape(100, 100, 3, 10000))
+
+
+def _real_data(shape: SuiteShape, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((shape.dataset_size, shape.seq_length, shape.num_channels),
+                                                       dtype=np.float32)
+
+
+def _synthetic_data(shape: SuiteShape, seed: int = 1) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((shape.batch_size, shape.seq_length, shape.num_channels),
+                                                       dtype=np.float32)
+
+
+def setup_generate_input_noise(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    import training_module as train
+    return lambda: train.generate_input_noise(shape.batch_size, LATENT_DIM, shape.seq_length)
+
+
+def setup_real_to_syn_similarity(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    from compute_similarity_metrics import compute_real_to_syn_similarity
+    real_data: np.ndarray = _real_data(shape)
+    synthetic_data: np.ndarray = _synthetic_data(shape)
+    return lambda: compute_real_to_syn_similarity(real_data, synthetic_data, shape.batch_size, REAL_SYNTHETIC_RATIO)
+
+
+def setup_syn_to_syn_similarity(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    from compute_similarity_metrics import compute_syn_to_syn_similarity
+    synthetic_data: np.ndarray = _synthetic_data(shape)
+    return lambda: compute_syn_to_syn_similarity(synthetic_data, SYNTHETIC_SYNTHETIC_RATIO, shape.batch_size,
+                                                 shape.seq_length, shape.num_channels)
+
+
+def setup_real_to_real_similarity(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    from compute_similarity_metrics import compute_real_to_real_similarity
+    real_data: np.ndarray = _real_data(shape)
+    return lambda: compute_real_to_real_similarity(real_data, REAL_REAL_RATIO)
+
+
+def setup_statistical_feature_net(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    import models
+    feature_net = models.create_statistical_feature_net(shape.seq_length, shape.num_channels, NUM_FEATURES)
+    synthetic_data: np.ndarray = _synthetic_data(shape)
+    return lambda: feature_net.predict_on_batch(synthetic_data)
+
+
+def setup_statistical_features(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    import model_critique_functions as critique
+    synthetic_data: np.ndarray = _synthetic_data(shape)
+    return lambda: critique.compute_statistical_features(synthetic_data, NUM_FEATURES)
+
+
+def setup_statistical_feature_distance(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    import model_critique_functions as critique
+    real_features: np.ndarray = critique.compute_statistical_features(_real_data(shape), NUM_FEATURES).mean(axis=0)
+    synthetic_features: np.ndarray = critique.compute_statistical_features(_synthetic_data(shape), NUM_FEATURES)
+    return lambda: critique.compute_statistical_feature_distance(real_features, synthetic_features)
+
+
+def setup_train_step(shape: SuiteShape, _directory: str) -> Callable[[], object]:
+    """
+    A step of the legacy train step: the discriminator and then the GCD model, built like the
+    GanModel builds them, with the classifier of train_simple_lstm.py.
+    """
+    from keras.models import Model
+    from keras.utils import to_categorical
+
+    import model_critique_functions as critique
+    import models
+    import training_module as train
+    from batch_module import BatchSource
+    from train_simple_lstm import create_classifier_model
+
+    real_data: np.ndarray = _real_data(shape)
+    generator = models.create_generator(shape.seq_length, shape.num_channels, LATENT_DIM)
+    discriminator = models.create_discriminator(shape.seq_length, shape.num_channels)
+    discriminator_model = models.compile_discriminator_model(discriminator, 0.01)
+    classifier = create_classifier_model(NUM_CLASSES)
+    # the GCD model names its losses after the models, as the GanModel does
+    classifier._name = 'C'
+    feature_net = models.create_statistical_feature_net(shape.seq_length, shape.num_channels, NUM_FEATURES)
+    for layer in discriminator.layers:
+        layer.trainable = False
+    gcd_model = Model(inputs=generator.input,
+                      outputs=[discriminator(generator.output), classifier(generator.output),
+                               feature_net(generator.output)])
+    gcd_model.compile(loss={'D': 'binary_crossentropy', 'C': 'categorical_crossentropy', 'SFN': critique.euc_dist_loss},
+                      optimizer='adam', metrics={'D': 'accuracy', 'C': 'accuracy'})
+
+    batch_source: BatchSource = BatchSource(real_data, shape.batch_size, LATENT_DIM, prefetch_batches=0, seed=0)
+    class_targets: np.ndarray = to_categorical(np.zeros(shape.batch_size), num_classes=NUM_CLASSES)
+    feature_targets: np.ndarray = np.repeat(
+        critique.compute_statistical_features(real_data, NUM_FEATURES).mean(axis=0, keepdims=True),
+        shape.batch_size, axis=0)
+
+    def train_step() -> None:
+        batch = batch_source.next()
+        train.train_discriminator(batch, generator, discriminator_model)
+        train.train_generator(batch, class_targets, feature_targets, gcd_model)
+
+    return train_step
+
+
+def setup_load_data(shape: SuiteShape, directory: str) -> Callable[[], object]:
+    """
+    Loads a class of a dataset of dataset_size segments, written to the directory as an .h5 file
+    of NUM_CLASSES classes in turn, i.e. not sorted by class.
+    """
+    import h5py
+    from input_module import load_data
+
+    path: str = os.path.join(directory, f'load_data_{shape.label}.h5')
+    labels: np.ndarray = np.arange(shape.dataset_size) % NUM_CLASSES
+    with h5py.File(path, mode='w') as h5_file:
+        h5_file.create_dataset('X', data=_real_data(shape))
+        h5_file.create_dataset('y', data=labels.reshape(-1, 1))
+        h5_file.create_dataset('y_onehot', data=np.eye(NUM_CLASSES, dtype=np.float32)[labels])
+    return lambda: load_data(path, 0)
+
+
+# the benchmarks of the suite, each of which prepares its inputs for a shape and returns the timed function
+SUITE_BENCHMARKS: Dict[str, Callable[[SuiteShape, str], Callable[[], object]]] = {
+    'generate_input_noise': setup_generate_input_noise,
+    'compute_real_to_syn_similarity': setup_real_to_syn_similarity,
+    'compute_syn_to_syn_similarity': setup_syn_to_syn_similarity,
+    'compute_real_to_real_similarity': setup_real_to_real_similarity,
+    'statistical_feature_net': setup_statistical_feature_net,
+    'compute_statistical_features': setup_statistical_features,
+    'compute_statistical_feature_distance': setup_statistical_feature_distance,
+    'train_step': setup_train_step,
+    'load_data': setup_load_data,
+}
+
+
+def run_suite(shapes: List[SuiteShape],
+              benchmarks: Optional[List[str]] = None,
+              repeats: int = 50,
+              warmup: int = 5) -> Dict:
+    """
+    Runs the benchmarks of the suite for every shape.
+
+    :param shapes: The shapes.
+    :param benchmarks: The names of the benchmarks to run, all of SUITE_BENCHMARKS by default.
+    :param repeats: The number of timed calls per benchmark and shape.
+    :param warmup: The number of calls made before timing.
+    :return: The results, which are serializable to JSON, with the machine they were measured on
+    and the benchmarks skipped because a module they need cannot be imported.
+    """
+    results: List[Dict] = []
+    skipped: List[Dict] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in benchmarks or list(SUITE_BENCHMARKS):
+            for shape in shapes:
+                try:
+                    function: Callable[[], object] = SUITE_BENCHMARKS[name](shape, directory)
+                except ImportError as error:
+                    # the module is missing for every shape alike
+                    skipped.append({'benchmark': name, 'reason': str(error)})
+                    break
+                durations: np.ndarray = np.asarray(time_calls(function, repeats=repeats, warmup=warmup))
+                results.append({'name': f'{name}[{shape.label}]',
+                                'benchmark': name,
+                                'shape': {'batch_size': shape.batch_size,
+                                          'seq_length': shape.seq_length,
+                                          'num_channels': shape.num_channels,
+                                          'dataset_size': shape.dataset_size},
+                                'repeats': repeats,
+                                'median_seconds': float(np.median(durations)),
+                                'mean_seconds': float(np.mean(durations)),
+                                'min_seconds': float(np.min(durations)),
+                                'stddev_seconds': float(np.std(durations))})
+    versions: Dict[str, str] = {'python': platform.python_version(), 'numpy': np.__version__}
+    if 'tensorflow' in sys.modules:
+        versions['tensorflow'] = sys.modules['tensorflow'].__version__
+    return {'machine': {'node': platform.node(), 'processor': platform.processor() or platform.machine(),
+                        'cpu_count': os.cpu_count()},
+            'versions': versions,
+            'created_at': time.time(),
+            'results': results,
+            'skipped': skipped}
+
+
+@dataclass(frozen=True)
+class BenchmarkComparison:
+    """
+    The median time of a benchmark compared to its baseline: a ratio above 1 + tolerance is a regression.
+    """
+    name: str
+    baseline_seconds: float
+    seconds: float
+    ratio: float
+    regressed: bool
+
+
+def compare_results(results: Dict, baseline: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[BenchmarkComparison]:
+    """
+    Compares the results of a run of the suite to a baseline, by the median time of the benchmarks
+    both ran.
+
+    :param results: The results of run_suite.
+    :param baseline: Earlier results of run_suite.
+    :param tolerance: The fraction by which a benchmark may be slower than its baseline.
+    :return: A comparison per benchmark.
+    """
+    baseline_seconds: Dict[str, float] = {result['name']: result['median_seconds'] for result in baseline['results']}
+    comparisons: List[BenchmarkComparison] = []
+    for result in results['results']:
+        if result['name'] in baseline_seconds:
+            ratio: float = result['median_seconds'] / baseline_seconds[result['name']]
+            comparisons.append(BenchmarkComparison(name=result['name'],
+                                                   baseline_seconds=baseline_seconds[result['name']],
+                                                   seconds=result['median_seconds'],
+                                                   ratio=ratio,
+                                                   regressed=ratio > 1 + tolerance))
+    return comparisons
+
+
+def print_suite_results(results: Dict) -> None:
+    """
+    Prints the results of the suite as a table, in microseconds per call.
+
+    :param results: The results of run_suite.
+    """
+    print(f'{"benchmark":<64}{"median us":>12}{"mean us":>12}{"stddev us":>12}')
+    for result in results['results']:
+        print(f'{result["name"]:<64}{result["median_seconds"] * 1e6:>12.1f}{result["mean_seconds"] * 1e6:>12.1f}'
+              f'{result["stddev_seconds"] * 1e6:>12.1f}')
+    for skipped in results.get('skipped', []):
+        print(f'{skipped["benchmark"]:<64}skipped: {skipped["reason"]}')
+
+
+def print_comparisons(comparisons: List[BenchmarkComparison]) -> None:
+    """
+    Prints the comparisons to a baseline as a table.
+
+    :param comparisons: The comparisons.
+    """
+    print(f'{"benchmark":<64}{"baseline us":>12}{"median us":>12}{"ratio":>8}')
+    for comparison in comparisons:
+        print(f'{comparison.name:<64}{comparison.baseline_seconds * 1e6:>12.1f}{comparison.seconds * 1e6:>12.1f}'
+              f'{comparison.ratio:>8.2f}{"  REGRESSED" if comparison.regressed else ""}')
+
+
+def print_results(results: List[Dict]) -> None:
+    """
+    Prints the benchmark results as a table, in microseconds per call.
+
+    :param results: The results of a benchmark.
+    """
+    print(f'{"shape":<20}{"method":<24}{"us per call":>12}')
+    for result in results:
+        print(f'{str(result["shape"]):<20}{result["method"]:<24}{result["seconds"] * 1e6:>12.1f}')
+
+
+def parse_shape(text: str) -> Tuple[int, int, int]:
+    """
+    Parses a shape given as batch_size,seq_length,latent_dim.
+    """
+    dimensions: List[int] = [int(dimension) for dimension in text.split(',')]
+    if len(dimensions) != 3:
+        raise arg_parser.ArgumentTypeError(f'"{text}" is not of the form batch_size,seq_length,latent_dim')
+    return dimensions[0], dimensions[1], dimensions[2]
+
+
+def parse_suite_shape(text: str) -> SuiteShape:
+    """
+    Parses a shape given as batch_size,seq_length,num_channels,dataset_size.
+    """
+    dimensions: List[int] = [int(dimension) for dimension in text.split(',')]
+    if len(dimensions) != 4:
+        raise arg_parser.ArgumentTypeError(f'"{text}" is not of the form '
+                                           f'batch_size,seq_length,num_channels,dataset_size')
+    return SuiteShape(*dimensions)
+
+
+def parse_cli_arguments() -> Namespace:
+    """
+    Utility function that parses command line arguments
+    """
+    parser = arg_parser.ArgumentParser(description='Runs micro-benchmarks of the SuperGAN training hot paths')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    noise_parser = subparsers.add_parser('noise', help='The cost of generating the latent noise')
+    noise_parser.add_argument('--shape', type=parse_shape, action='append', default=None,
+                              help='A batch_size,seq_length,latent_dim shape, can be given multiple times')
+    noise_parser.add_argument('--repeats', type=int, default=100,
+                              help='The number of timed draws per method and shape')
+    noise_parser.add_argument('--no-graph', action='store_true',
+                              help='Skip the tf.random benchmark')
+
+    suite_parser = subparsers.add_parser('suite', help='Every numerical hot path, compared against a baseline')
+    suite_parser.add_argument('--shape', type=parse_suite_shape, action='append', default=None,
+                              help='A batch_size,seq_length,num_channels,dataset_size shape, '
+                                   'can be given multiple times')
+    suite_parser.add_argument('--benchmark', dest='benchmarks', type=str, action='append', default=None,
+                              choices=list(SUITE_BENCHMARKS),
+                              help='A benchmark to run, can be given multiple times, all by default')
+    suite_parser.add_argument('--repeats', type=int, default=50,
+                              help='The number of timed calls per benchmark and shape')
+    suite_parser.add_argument('--output', type=str, default=None,
+                              help='Write the results to this JSON file, which can serve as a baseline')
+    suite_parser.add_argument('--baseline', type=str, default=None,
+                              help='Compare the results to those of this JSON file, and exit with 1 on a regression')
+    suite_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                              help='The fraction by which a benchmark may be slower than its baseline')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cli_args: Namespace = parse_cli_arguments()
+    if cli_args.benchmark == 'noise':
+        print_results(benchmark_noise(cli_args.shape or list(DEFAULT_NOISE_SHAPES),
+                                      repeats=cli_args.repeats,
+                                      include_graph=not cli_args.no_graph))
+    elif cli_args.benchmark == 'suite':
+        suite_results: Dict = run_suite(cli_args.shape or list(DEFAULT_SUITE_SHAPES),
+                                        benchmarks=cli_args.benchmarks,
+                                        repeats=cli_args.repeats)
+        print_suite_results(suite_results)
+        if cli_args.output is not None:
+            with open(cli_args.output, mode='w', encoding='utf-8') as output_file:
+                json.dump(suite_results, output_file, indent=2)
+        if cli_args.baseline is not None:
+            with open(cli_args.baseline, mode='r', encoding='utf-8') as baseline_file:
+                suite_comparisons: List[BenchmarkComparison] = compare_results(suite_results, json.load(baseline_file),
+                                                                               cli_args.tolerance)
+            print()
+            print_comparisons(suite_comparisons)
+            if any(comparison.regressed for comparison in suite_comparisons):
+                sys.exit(1)
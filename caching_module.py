@@ -0,0 +1,142 @@
+"""
+Contains an on-disk cache for arrays derived from a dataset, e.g. the mean statistical
+feature vector of the real data of a class, so they are computed once per dataset rather
+than once per run.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+from typing import Callable, Optional
+
+import numpy as np
+
+from input_module import file_fingerprint
+
+FINGERPRINTS_FILENAME = 'fingerprints.json'
+
+
+def function_fingerprint(function: Callable) -> str:
+    """
+    Fingerprints the definition of a function by hashing its source code, so that
+    cached results are invalidated when the function changes.
+
+    :param function: A python function.
+    :return: A sha256 hex digest.
+    """
+    return hashlib.sha256(inspect.getsource(function).encode('utf-8')).hexdigest()
+
+
+class ArrayCache:
+    """
+    A directory of .npy files keyed by a hash of whatever determines their content.
+    When the total size exceeds max_size_bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int):
+        """
+        :param directory: The directory the cached arrays are stored in.
+        :param max_size_bytes: The maximum total size of the cached arrays.
+        """
+        self.directory: str = directory
+        self.max_size_bytes: int = max_size_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(**components) -> str:
+        """
+        Combines the given components into a single cache key.
+
+        :param components: Anything JSON serializable that identifies the cached array.
+        :return: A sha256 hex digest.
+        """
+        return hashlib.sha256(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def dataset_fingerprint(self, file_path: str) -> str:
+        """
+        Fingerprints a dataset by its content. Hashing a large file is not free, so the
+        digest is remembered for as long as the path, size and modification time match.
+
+        :param file_path: The path of the dataset.
+        :return: A string combining the sha256 digest and the size of the file.
+        """
+        fingerprints_path: str = os.path.join(self.directory, FINGERPRINTS_FILENAME)
+        status = os.stat(file_path)
+        file_key: str = f'{os.path.realpath(file_path)}:{status.st_size}:{status.st_mtime_ns}'
+
+        fingerprints: dict = {}
+        if os.path.exists(fingerprints_path):
+            try:
+                with open(fingerprints_path, mode='r', encoding='utf-8') as fingerprints_file:
+                    fingerprints = json.load(fingerprints_file)
+            except (OSError, ValueError):
+                fingerprints = {}
+
+        if file_key not in fingerprints:
+            digest, size = file_fingerprint(file_path)
+            fingerprints[file_key] = f'{digest}:{size}'
+            temporary_path: str = f'{fingerprints_path}.{os.getpid()}.tmp'
+            with open(temporary_path, mode='w', encoding='utf-8') as fingerprints_file:
+                json.dump(fingerprints, fingerprints_file)
+            os.replace(temporary_path, fingerprints_path)
+
+        return fingerprints[file_key]
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """
+        Loads a cached array.
+
+        :param key: The key of the array.
+        :return: The array, or None if it is not cached.
+        """
+        path: str = self._path(key)
+        try:
+            array: np.ndarray = np.load(path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+        # mark the entry as recently used
+        os.utime(path)
+        return array
+
+    def store(self, key: str, array: np.ndarray) -> None:
+        """
+        Stores an array, then evicts the least recently used entries if the cache is too large.
+        The array is written to a temporary file first, so concurrent runs never see a partial file.
+
+        :param key: The key of the array.
+        :param array: The array to cache.
+        """
+        temporary_path: str = os.path.join(self.directory, f'.{key}.{os.getpid()}.tmp.npy')
+        np.save(temporary_path, array, allow_pickle=False)
+        os.replace(temporary_path, self._path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used arrays until the cache fits in max_size_bytes.
+        """
+        entries: list = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.npy') or filename.startswith('.'):
+                continue
+            path: str = os.path.join(self.directory, filename)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+
+        total_size: int = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
@@ -0,0 +1,350 @@
+"""
+Contains the periodic checkpoints of training: the state captured after a training step, the writer
+saving it on a background thread and the retention of the best checkpoints.
+
+A checkpoint is made of three files named after the epoch, the class label and the classifier accuracy,
+like the models saved by saving_module: the generator (G_...h5) and the discriminator (D_...h5) as Keras
+models and the rest of the training state (state_...h5), i.e. the classifier weights, the optimizer
+weights and the state of the random generators. Every file is written to a temporary file which is
+then renamed, and the state file is written last, so a checkpoint whose state file exists is complete.
+"""
+
+import glob
+import json
+import os
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import h5py
+import numpy as np
+import tensorflow as tf
+from keras.engine.functional import Functional
+
+import saving_module
+from evaluation_module import EvaluationResult
+
+GENERATOR_PREFIX = 'G'
+DISCRIMINATOR_PREFIX = 'D'
+STATE_PREFIX = 'state'
+
+# the metrics the best checkpoints can be chosen by, and whether higher is better
+CHECKPOINT_METRICS: Dict[str, bool] = {
+    'classifier_accuracy': True,
+    'mean_rts_similarity': True,
+    'statistical_feature_distance': False
+}
+
+
+class ExistingCheckpointsError(Exception):
+    """
+    Exception raised when a new run would replace the checkpoints of an earlier run of the class label
+    """
+
+    def __init__(self,
+                 message: str = 'The checkpoint directory holds the checkpoints of an earlier run'):
+        super().__init__(message)
+
+
+@dataclass(frozen=True)
+class TrainingState:
+    """
+    What training needs besides the generator and the discriminator to go on where it stopped.
+    """
+    classifier_weights: List[np.ndarray]
+    discriminator_optimizer_weights: List[np.ndarray]
+    generator_optimizer_weights: List[np.ndarray]
+    rng_state: dict
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """
+    A copy of the state of training after a given training step.
+    """
+    step: int
+    generator_weights: List[np.ndarray]
+    discriminator_weights: List[np.ndarray]
+    training_state: TrainingState
+
+
+@dataclass(frozen=True)
+class StoredCheckpoint:
+    """
+    A checkpoint written to disk.
+    """
+    step: int
+    metrics: Dict[str, float]
+    state_path: str
+    generator_path: str
+    discriminator_path: str
+
+
+def evaluation_metrics(evaluation: EvaluationResult) -> Dict[str, float]:
+    """
+    :param evaluation: The evaluation of the step of a checkpoint.
+    :return: The metrics the checkpoint is ranked by.
+    """
+    return {'classifier_accuracy': float(evaluation.classifier_accuracy),
+            'mean_rts_similarity': float(np.mean(evaluation.mean_rts_similarity)),
+            'statistical_feature_distance': float(np.mean(evaluation.statistical_feature_distance))}
+
+
+def _optimizer_variables(optimizer) -> list:
+    # variables is a method of the Keras optimizers, but a property of some versions
+    variables = optimizer.variables
+    return list(variables() if callable(variables) else variables)
+
+
+def get_optimizer_weights(optimizer) -> List[np.ndarray]:
+    """
+    :param optimizer: A Keras optimizer.
+    :return: A copy of the weights of the optimizer, e.g. the iteration count and the moments of Adam.
+    """
+    return [np.array(variable.numpy()) for variable in _optimizer_variables(optimizer)]
+
+
+def set_optimizer_weights(optimizer, variables: list, weights: List[np.ndarray]) -> None:
+    """
+    Restores the weights of an optimizer.
+
+    :param optimizer: A Keras optimizer.
+    :param variables: The variables the optimizer updates, in the order training passes them.
+    :param weights: The weights returned by get_optimizer_weights.
+    """
+    if len(_optimizer_variables(optimizer)) != len(weights):
+        # the optimizer creates its weights on its first update, and a first update with zero
+        # gradients leaves the variables unchanged (Adam's first step is scaled by the gradient)
+        optimizer.apply_gradients([(tf.zeros_like(variable), variable) for variable in variables])
+    optimizer_variables: list = _optimizer_variables(optimizer)
+    if len(optimizer_variables) != len(weights):
+        raise ValueError(f'The optimizer has {len(optimizer_variables)} weights, the checkpoint {len(weights)}')
+    for variable, weight in zip(optimizer_variables, weights):
+        variable.assign(weight)
+
+
+def _write_weights(group: h5py.Group, weights: List[np.ndarray]) -> None:
+    for index, weight in enumerate(weights):
+        group.create_dataset(str(index), data=weight)
+
+
+def _read_weights(group: h5py.Group) -> List[np.ndarray]:
+    return [np.asarray(group[str(index)]) for index in range(len(group))]
+
+
+def write_state_file(path: str,
+                     checkpoint: Checkpoint,
+                     metrics: Dict[str, float],
+                     generator_filename: str,
+                     discriminator_filename: str) -> None:
+    """
+    Writes the training state of a checkpoint, atomically.
+
+    :param path: The path of the state file.
+    :param checkpoint: The checkpoint.
+    :param metrics: The metrics of the checkpoint.
+    :param generator_filename: The name of the generator file of the checkpoint.
+    :param discriminator_filename: The name of the discriminator file of the checkpoint.
+    """
+    temporary_path: str = f'{path}.tmp'
+    with h5py.File(temporary_path, mode='w') as state_file:
+        state_file.attrs['step'] = checkpoint.step
+        state_file.attrs['metrics'] = json.dumps(metrics)
+        state_file.attrs['rng_state'] = json.dumps(checkpoint.training_state.rng_state)
+        state_file.attrs['generator_filename'] = generator_filename
+        state_file.attrs['discriminator_filename'] = discriminator_filename
+        _write_weights(state_file.create_group('classifier'), checkpoint.training_state.classifier_weights)
+        _write_weights(state_file.create_group('discriminator_optimizer'),
+                       checkpoint.training_state.discriminator_optimizer_weights)
+        _write_weights(state_file.create_group('generator_optimizer'),
+                       checkpoint.training_state.generator_optimizer_weights)
+    os.replace(temporary_path, path)
+
+
+def read_stored_checkpoint(path: str) -> StoredCheckpoint:
+    """
+    :param path: The path of a state file.
+    :return: The checkpoint the state file belongs to.
+    """
+    directory: str = os.path.dirname(path)
+    with h5py.File(path, mode='r') as state_file:
+        return StoredCheckpoint(step=int(state_file.attrs['step']),
+                                metrics=json.loads(state_file.attrs['metrics']),
+                                state_path=path,
+                                generator_path=os.path.join(directory, state_file.attrs['generator_filename']),
+                                discriminator_path=os.path.join(directory,
+                                                                state_file.attrs['discriminator_filename']))
+
+
+def read_training_state(stored: StoredCheckpoint) -> TrainingState:
+    """
+    :param stored: A checkpoint written to disk.
+    :return: The training state of the checkpoint.
+    """
+    with h5py.File(stored.state_path, mode='r') as state_file:
+        return TrainingState(classifier_weights=_read_weights(state_file['classifier']),
+                             discriminator_optimizer_weights=_read_weights(state_file['discriminator_optimizer']),
+                             generator_optimizer_weights=_read_weights(state_file['generator_optimizer']),
+                             rng_state=json.loads(state_file.attrs['rng_state']))
+
+
+def list_checkpoints(directory: str, class_label: int) -> List[StoredCheckpoint]:
+    """
+    :param directory: The checkpoint directory.
+    :param class_label: The class label of the run.
+    :return: The complete checkpoints of the class label, in step order.
+    """
+    pattern: str = os.path.join(directory, f'{STATE_PREFIX}_epoch*_label_class{class_label}_acc*.h5')
+    return sorted((read_stored_checkpoint(path) for path in glob.glob(pattern)), key=lambda stored: stored.step)
+
+
+def latest_checkpoint(directory: str, class_label: int) -> Optional[StoredCheckpoint]:
+    """
+    :param directory: The checkpoint directory.
+    :param class_label: The class label of the run.
+    :return: The checkpoint of the latest step, None if there is none.
+    """
+    checkpoints: List[StoredCheckpoint] = list_checkpoints(directory, class_label)
+    return checkpoints[-1] if checkpoints else None
+
+
+def remove_checkpoint(stored: StoredCheckpoint) -> None:
+    """
+    Deletes the files of a checkpoint, the state file first so that it is never listed half deleted.
+
+    :param stored: A checkpoint written to disk.
+    """
+    for path in (stored.state_path, stored.generator_path, stored.discriminator_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread, one at a time and in the order they were submitted,
+    so that training never waits on the disk. After every write, only the keep_best best checkpoints
+    by the chosen metric are kept, along with the latest one, which a resumed run starts from.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 class_label: int,
+                 generator: Functional,
+                 discriminator: Functional,
+                 keep_best: int = 3,
+                 metric: str = 'classifier_accuracy',
+                 resume: bool = False,
+                 overwrite: bool = False):
+        """
+        :param directory: The checkpoint directory.
+        :param class_label: The class label of the run.
+        :param generator: A private copy of the generator, which the weights are saved through.
+        :param discriminator: A private copy of the discriminator, which the weights are saved through.
+        :param keep_best: The number of best checkpoints kept.
+        :param metric: The metric the checkpoints are ranked by, one of CHECKPOINT_METRICS.
+        :param resume: Whether the run resumes from the checkpoints of the directory.
+        :param overwrite: Whether a run which does not resume removes the checkpoints of the class label
+        left in the directory by an earlier run, otherwise they are kept and ExistingCheckpointsError is raised.
+        """
+        if metric not in CHECKPOINT_METRICS:
+            raise ValueError(f'Unknown checkpoint metric "{metric}", expected one of {list(CHECKPOINT_METRICS)}')
+        self.directory: str = directory
+        self.class_label: int = class_label
+        self.generator: Functional = generator
+        self.discriminator: Functional = discriminator
+        self.keep_best: int = keep_best
+        self.metric: str = metric
+
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoints: List[StoredCheckpoint] = list_checkpoints(directory, class_label)
+        if not resume and self.checkpoints:
+            if not overwrite:
+                latest_step: int = max(stored.step for stored in self.checkpoints)
+                raise ExistingCheckpointsError(f'{directory} holds the checkpoints of an earlier run of class label '
+                                               f'{class_label} (up to epoch {latest_step}), resume from them or '
+                                               f'overwrite them explicitly')
+            for stored in self.checkpoints:
+                remove_checkpoint(stored)
+            self.checkpoints = []
+
+        self._checkpoints: queue.Queue = queue.Queue()
+        self._error: Optional[BaseException] = None
+        self._thread: threading.Thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """
+        The body of the writer thread, which writes checkpoints until it receives None.
+        """
+        while True:
+            item = self._checkpoints.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+            except BaseException as error:
+                self._error = error
+                return
+
+    def _write(self, checkpoint: Checkpoint, metrics: Dict[str, float]) -> None:
+        """
+        Writes a checkpoint and removes the checkpoints which are not kept anymore.
+        """
+        accuracy: float = metrics['classifier_accuracy']
+        generator_filename: str = saving_module.model_filename(GENERATOR_PREFIX, checkpoint.step,
+                                                               self.class_label, accuracy)
+        discriminator_filename: str = saving_module.model_filename(DISCRIMINATOR_PREFIX, checkpoint.step,
+                                                                   self.class_label, accuracy)
+        self.generator.set_weights(checkpoint.generator_weights)
+        self.discriminator.set_weights(checkpoint.discriminator_weights)
+        saving_module.save_keras_model(self.generator, self.directory, generator_filename, atomic=True)
+        saving_module.save_keras_model(self.discriminator, self.directory, discriminator_filename, atomic=True)
+
+        state_path: str = os.path.join(self.directory, saving_module.model_filename(STATE_PREFIX, checkpoint.step,
+                                                                                    self.class_label, accuracy))
+        write_state_file(state_path, checkpoint, metrics, generator_filename, discriminator_filename)
+        self.checkpoints.append(StoredCheckpoint(step=checkpoint.step,
+                                                 metrics=metrics,
+                                                 state_path=state_path,
+                                                 generator_path=os.path.join(self.directory, generator_filename),
+                                                 discriminator_path=os.path.join(self.directory,
+                                                                                 discriminator_filename)))
+        self._apply_retention()
+
+    def _apply_retention(self) -> None:
+        """
+        Removes every checkpoint which is neither one of the keep_best best nor the latest.
+        """
+        higher_is_better: bool = CHECKPOINT_METRICS[self.metric]
+        ranked: List[StoredCheckpoint] = sorted(self.checkpoints,
+                                                key=lambda stored: stored.metrics[self.metric],
+                                                reverse=higher_is_better)
+        latest: StoredCheckpoint = max(self.checkpoints, key=lambda stored: stored.step)
+        kept: List[StoredCheckpoint] = ranked[:max(self.keep_best, 0)]
+        for stored in self.checkpoints:
+            if stored is not latest and stored not in kept:
+                remove_checkpoint(stored)
+        self.checkpoints = [stored for stored in self.checkpoints if stored is latest or stored in kept]
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError('The checkpoint writer failed') from self._error
+
+    def submit(self, checkpoint: Checkpoint, metrics: Dict[str, float]) -> None:
+        """
+        Queues a checkpoint for writing.
+
+        :param checkpoint: The checkpoint.
+        :param metrics: The metrics of the evaluation of its step, see evaluation_metrics.
+        """
+        self._raise_error()
+        self._checkpoints.put((checkpoint, metrics))
+
+    def close(self) -> None:
+        """
+        Stops the writer thread once the checkpoints already submitted are written.
+        """
+        self._checkpoints.put(None)
+        self._thread.join()
+        self._raise_error()
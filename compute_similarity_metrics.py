@@ -3,13 +3,38 @@ Utility program that computes the rtr similarity of a given dataset from a .h5 f
 """
 
 import argparse as arg_parser
+import json
 import h5py as h5reader
 import numpy as np
 import os
 from argparse import Namespace
-from itertools import combinations
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Tuple, Union
 from sklearn.metrics.pairwise import cosine_similarity
 
+from input_module import file_fingerprint, read_class_index
+
+
+SAMPLED_MODE = 'sampled'
+EXHAUSTIVE_MODE = 'exhaustive'
+SIMILARITY_MODES = (SAMPLED_MODE, EXHAUSTIVE_MODE)
+
+# number of rows handled by a single matrix product, keeps memory bounded
+DEFAULT_CHUNK_SIZE = 256
+
+# rtr results are cached next to the dataset in a file with this suffix
+RTR_CACHE_SUFFIX = '.rtr_cache.json'
+
+# the memory the exhaustive rtr may use for its second moment matrices or its block of rows
+DEFAULT_RTR_MEMORY_LIMIT = 512 * 2 ** 20
+
+# pairwise similarity distribution settings
+DEFAULT_NUM_BINS = 2000
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DEFAULT_COLLAPSE_QUANTILE = 0.05
+
+RandomState = Union[None, int, np.random.Generator, np.random.RandomState]
+
 
 class InvalidH5FileError(Exception):
     """
@@ -21,6 +46,183 @@ class InvalidH5FileError(Exception):
         super().__init__(message)
 
 
+def resolve_random_state(random_state: RandomState):
+    """
+    Turns the given seed or generator into something that can draw random numbers.
+
+    :param random_state: None for the global numpy state, an integer seed, or a numpy
+    Generator / RandomState which is used as is.
+    :return: A numpy Generator, RandomState or the numpy.random module itself.
+    """
+    if random_state is None:
+        return np.random
+    if isinstance(random_state, (np.random.Generator, np.random.RandomState)):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def _random_integers(generator, high: int, size: Tuple[int, int]) -> np.ndarray:
+    """
+    Draws integers in [0, high) from either a Generator or a RandomState-like object.
+    """
+    if isinstance(generator, np.random.Generator):
+        return generator.integers(0, high, size=size)
+    return generator.randint(0, high, size=size)
+
+
+def draw_comparison_indices(num_candidates: int,
+                            num_draws: int,
+                            count: int,
+                            random_state: RandomState = None,
+                            legacy_sampling: bool = False) -> np.ndarray:
+    """
+    Draws, in bulk, `count` rows of `num_draws` distinct indices in [0, num_candidates).
+    This is the vectorized equivalent of calling
+    np.random.choice(num_candidates, num_draws, replace=False) `count` times, but the
+    cost is proportional to count * num_draws instead of count * num_candidates.
+
+    :param num_candidates: The number of candidates to draw from.
+    :param num_draws: The number of distinct indices in each row.
+    :param count: The number of rows.
+    :param random_state: A seed, numpy Generator or RandomState, defaults to the global numpy state.
+    :param legacy_sampling: Draw every row with its own choice(..., replace=False) call, which
+    consumes the random state exactly like the original per-segment loop, so that a seeded run
+    reproduces the draws of earlier versions.
+    :return: An integer numpy array of shape (count, num_draws).
+    """
+    if num_draws > num_candidates:
+        raise ValueError(f'Cannot take {num_draws} distinct samples '
+                         f'from a population of {num_candidates}')
+
+    generator = resolve_random_state(random_state)
+
+    if legacy_sampling:
+        indices: np.ndarray = np.empty((count, num_draws), dtype=np.int64)
+        for row in range(count):
+            indices[row] = generator.choice(num_candidates, num_draws, replace=False)
+        return indices
+
+    # when the population is small compared to the draws, duplicates are likely,
+    # so take the first entries of a random permutation of every row instead
+    if num_candidates < 2 * num_draws * num_draws:
+        keys: np.ndarray = generator.random((count, num_candidates))
+        return np.argsort(keys, axis=1)[:, :num_draws]
+
+    # otherwise draw with replacement and redraw the (rare) rows containing a duplicate
+    indices: np.ndarray = _random_integers(generator, num_candidates, (count, num_draws))
+    while True:
+        sorted_indices: np.ndarray = np.sort(indices, axis=1)
+        duplicate_rows: np.ndarray = np.any(sorted_indices[:, 1:] == sorted_indices[:, :-1], axis=1)
+        num_duplicate_rows: int = int(np.count_nonzero(duplicate_rows))
+        if num_duplicate_rows == 0:
+            return indices
+        indices[duplicate_rows] = _random_integers(generator, num_candidates,
+                                                   (num_duplicate_rows, num_draws))
+
+
+def normalize_segments(segments: np.ndarray) -> np.ndarray:
+    """
+    Flattens each segment into a vector and scales it to unit L2 norm, so that the dot
+    product of two rows is their cosine similarity. Zero vectors are left as zeros,
+    which matches sklearn's cosine_similarity.
+
+    :param segments: Data of the shape (num_segments, seq_length, num_channels).
+    :return: A 2D numpy array of shape (num_segments, seq_length * num_channels).
+    """
+    dtype = np.result_type(segments.dtype, np.float32)
+    flat: np.ndarray = np.asarray(segments, dtype=dtype).reshape(len(segments), -1)
+    norms: np.ndarray = np.linalg.norm(flat, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return flat / norms
+
+
+class RealSimilarityEngine:
+    """
+    Matrix based similarity computations against a fixed set of real segments.
+    The real data is normalized once, so repeated calls (e.g. once per epoch)
+    only pay for the synthetic side.
+
+    Two modes are supported:
+    * sampled: every synthetic segment is compared to `ratio` distinct random real
+      segments, like the original per-pair loop, but with the indices drawn in bulk
+      and the dot products done one chunk of synthetic segments at a time.
+    * exhaustive: every synthetic segment is compared to every real segment.
+    """
+
+    def __init__(self, real_input_data: np.ndarray, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        :param real_input_data: Real data of the shape (num_segments, seq_length, num_channels).
+        :param chunk_size: The number of synthetic segments scored per matrix product.
+        """
+        self.chunk_size: int = max(1, chunk_size)
+        self.normalized_real: np.ndarray = normalize_segments(real_input_data)
+        self.num_segments: int = self.normalized_real.shape[0]
+        self._real_sum: Optional[np.ndarray] = None
+
+    @property
+    def real_sum(self) -> np.ndarray:
+        """
+        The sum of all normalized real segments, computed on first use.
+        """
+        if self._real_sum is None:
+            self._real_sum = np.sum(self.normalized_real, axis=0, dtype=np.float64)
+        return self._real_sum
+
+    def score_synthetic_samples(self, synthetic_input_data: np.ndarray) -> np.ndarray:
+        """
+        Computes, for every synthetic segment, its mean cosine similarity to every real segment.
+        Since the mean of dot products is the dot product with the mean, this is a single
+        matrix-vector product per chunk rather than a (num_synthetic, num_segments) matrix.
+
+        :param synthetic_input_data: Synthetic data of the shape (num_synthetic, seq_length, num_channels).
+        :return: A numpy array of shape (num_synthetic,).
+        """
+        normalized_synthetic: np.ndarray = normalize_segments(synthetic_input_data)
+        scores: np.ndarray = np.empty(len(normalized_synthetic), dtype=np.float64)
+        for start in range(0, len(normalized_synthetic), self.chunk_size):
+            stop = start + self.chunk_size
+            scores[start:stop] = normalized_synthetic[start:stop] @ self.real_sum
+        return scores / self.num_segments
+
+    def real_to_syn_similarity(self,
+                               synthetic_input_data: np.ndarray,
+                               real_synthetic_ratio: int,
+                               mode: str = SAMPLED_MODE,
+                               random_state: RandomState = None,
+                               legacy_sampling: bool = False) -> float:
+        """
+        Computes the mean real to synthetic (RTS) cosine similarity.
+
+        :param synthetic_input_data: Synthetic data of the shape (num_synthetic, seq_length, num_channels).
+        :param real_synthetic_ratio: The number of real segments compared to each synthetic
+        segment in sampled mode, ignored in exhaustive mode.
+        :param mode: Either "sampled" or "exhaustive".
+        :param random_state: A seed, numpy Generator or RandomState, defaults to the global numpy state.
+        :param legacy_sampling: Draw the real segments like the original loop, see draw_comparison_indices.
+        :return: The real to synthetic similarity as a float.
+        """
+        if mode == EXHAUSTIVE_MODE:
+            return float(np.mean(self.score_synthetic_samples(synthetic_input_data)))
+        if mode != SAMPLED_MODE:
+            raise ValueError(f'Unknown similarity mode "{mode}", expected one of {SIMILARITY_MODES}')
+
+        normalized_synthetic: np.ndarray = normalize_segments(synthetic_input_data)
+        num_synthetic: int = len(normalized_synthetic)
+        indices: np.ndarray = draw_comparison_indices(self.num_segments,
+                                                      real_synthetic_ratio,
+                                                      num_synthetic,
+                                                      random_state,
+                                                      legacy_sampling=legacy_sampling)
+        total: float = 0.0
+        for start in range(0, num_synthetic, self.chunk_size):
+            stop = start + self.chunk_size
+            # (chunk, ratio, features) x (chunk, features) -> (chunk, ratio)
+            compared: np.ndarray = self.normalized_real[indices[start:stop]]
+            total += float(np.einsum('crf,cf->', compared, normalized_synthetic[start:stop]))
+
+        return total / (num_synthetic * real_synthetic_ratio)
+
+
 def compute_real_to_real_similarity(real_input_data: np.ndarray,
                                     real_real_ratio: int) -> float:
     """
@@ -32,6 +234,8 @@ def compute_real_to_real_similarity(real_input_data: np.ndarray,
 
     :return: The real to real similarity as a float.
     """
+    # flatten the segments, cosine_similarity only accepts two dimensions
+    real_input_data = real_input_data.reshape(len(real_input_data), -1)
     index: np.ndarray = np.random.choice(len(real_input_data), 1)
 
     # computes the similarity between the user defined number
@@ -59,7 +263,11 @@ def compute_real_to_real_similarity(real_input_data: np.ndarray,
 def compute_real_to_syn_similarity(real_input_data: np.ndarray,
                                    synthetic_input_data: np.ndarray,
                                    batch_size: int,
-                                   real_synthetic_ratio: int) -> float:
+                                   real_synthetic_ratio: int,
+                                   mode: str = SAMPLED_MODE,
+                                   chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                   random_state: RandomState = None,
+                                   legacy_sampling: bool = False) -> float:
     """
     Computes metrics regarding the real to synthetic similarity, or the average
     cosine similarity between chosen pairs of real and synthetic segments.
@@ -68,44 +276,27 @@ def compute_real_to_syn_similarity(real_input_data: np.ndarray,
     :param synthetic_input_data: Synthetic data to compute RTS similarity.
     :param batch_size: The size of the batch.
     :param real_synthetic_ratio: The real to synthetic ratio.
+    :param mode: Either "sampled" or "exhaustive", see RealSimilarityEngine.
+    :param chunk_size: The number of synthetic segments scored per matrix product.
+    :param random_state: A seed, numpy Generator or RandomState, defaults to the global numpy state.
+    :param legacy_sampling: Draw the real segments like the original loop, see draw_comparison_indices.
 
     :return: The real to synthetic similarity as a float.
     """
-    num_segments: int = len(real_input_data)
-    seq_length: int = real_input_data.shape[1]
-    num_channels: int = real_input_data.shape[2]
-
-    # reshape the data into two dimensions
-    real_input_data: np.ndarray \
-        = real_input_data.reshape(num_segments, seq_length * num_channels)
-    synthetic_input_data: np.ndarray \
-        = synthetic_input_data.reshape(batch_size, seq_length * num_channels)
-
-    # Generate all pairwise cosine similarities.
-    rts_sims: list = []
-
-    # for each fake segment, calculate its similarity
-    # to a user defined number of real segments
-    for i in range(batch_size):
-        indices_to_compare: np.ndarray = np.random.choice(num_segments,
-                                                          real_synthetic_ratio,
-                                                          replace=False)
-        for j in indices_to_compare:
-            sim: np.ndarray = cosine_similarity(
-                real_input_data[j].reshape(1, -1),
-                synthetic_input_data[i].reshape(1, -1))
-            sim: np.float = sim[0, 0]
-            rts_sims.append(sim)
-
-    # return the mean
-    return np.mean(np.array(rts_sims))
+    engine = RealSimilarityEngine(real_input_data, chunk_size=chunk_size)
+    return engine.real_to_syn_similarity(synthetic_input_data[:batch_size],
+                                         real_synthetic_ratio,
+                                         mode=mode,
+                                         random_state=random_state,
+                                         legacy_sampling=legacy_sampling)
 
 
 def compute_syn_to_syn_similarity(synthetic_input_data: np.ndarray,
                                   synthetic_synthetic_ratio: float,
                                   batch_size,
                                   seq_length,
-                                  num_channels) -> float:
+                                  num_channels,
+                                  mode: str = SAMPLED_MODE) -> float:
     """
     Computes metrics regarding the synthetic to synthetic similarity,
     or the average cosine similarity between all pairs of synthetic segments.
@@ -115,14 +306,22 @@ def compute_syn_to_syn_similarity(synthetic_input_data: np.ndarray,
     :param batch_size: The size of the batch.
     :param seq_length: The real data y length.
     :param num_channels: The real data z length.
+    :param mode: Either "sampled", which compares one random synthetic segment against
+    synthetic_synthetic_ratio others, or "exhaustive", which averages over all pairs.
 
     :return: The synthetic to synthetic similarity as a float.
     """
-    # Generate all pairwise cosine similarities.
-    sts_sims: list = []
     synthetic_input_data: np.ndarray \
         = synthetic_input_data.reshape(batch_size, seq_length * num_channels)
 
+    if mode == EXHAUSTIVE_MODE:
+        return mean_pairwise_similarity(normalize_segments(synthetic_input_data))
+    if mode != SAMPLED_MODE:
+        raise ValueError(f'Unknown similarity mode "{mode}", expected one of {SIMILARITY_MODES}')
+
+    # Generate all pairwise cosine similarities.
+    sts_sims: list = []
+
     # gets the index of one random fake sample
     index: np.ndarray = np.random.choice(len(synthetic_input_data), 1)
 
@@ -145,6 +344,109 @@ def compute_syn_to_syn_similarity(synthetic_input_data: np.ndarray,
     return np.mean(np.array(sts_sims))
 
 
+def mean_pairwise_similarity(normalized_segments: np.ndarray) -> float:
+    """
+    Computes the mean cosine similarity over all distinct pairs of (already normalized) segments.
+    The sum over pairs i < j of u_i . u_j equals (|sum u|^2 - sum |u_i|^2) / 2, so this is
+    exact but only needs a single pass over the data instead of the full Gram matrix.
+
+    :param normalized_segments: A 2D numpy array with unit (or zero) norm rows.
+    :return: The mean pairwise similarity as a float.
+    """
+    num_segments: int = len(normalized_segments)
+    if num_segments < 2:
+        raise ValueError('At least two segments are required to compare pairs')
+
+    segment_sum: np.ndarray = np.sum(normalized_segments, axis=0, dtype=np.float64)
+    squared_norms: float = float(np.sum(np.square(normalized_segments, dtype=np.float64)))
+    pair_sum: float = (float(segment_sum @ segment_sum) - squared_norms) / 2
+    return pair_sum / (num_segments * (num_segments - 1) / 2)
+
+
+@dataclass(frozen=True)
+class SimilarityDistribution:
+    """
+    Summary of the cosine similarities over all distinct pairs of a set of segments.
+    """
+    mean: float
+    std: float
+    num_pairs: int
+    quantiles: Dict[float, float]
+    collapse_quantile: float
+    collapse_score: float
+    histogram: np.ndarray
+    bin_edges: np.ndarray
+
+
+def compute_pairwise_similarity_distribution(segments: np.ndarray,
+                                             chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                             collapse_quantile: float = DEFAULT_COLLAPSE_QUANTILE,
+                                             quantiles: Sequence[float] = DEFAULT_QUANTILES,
+                                             num_bins: int = DEFAULT_NUM_BINS) -> SimilarityDistribution:
+    """
+    Computes the distribution of the cosine similarity over all distinct pairs of segments.
+    The upper triangle of the Gram matrix is visited one (chunk_size, chunk_size) block at a
+    time and folded into a fixed size histogram, so memory stays bounded for any number of
+    segments. Quantiles are read off the histogram, so their resolution is 2 / num_bins.
+
+    The collapse score is the collapse_quantile-th quantile of the pairwise similarity: when
+    even the least similar pairs are nearly identical the generator has collapsed, so a
+    value close to 1 indicates mode collapse.
+
+    :param segments: Data of the shape (num_segments, seq_length, num_channels).
+    :param chunk_size: The number of rows in a Gram matrix block.
+    :param collapse_quantile: The quantile reported as the collapse score.
+    :param quantiles: The quantiles to report.
+    :param num_bins: The number of histogram bins over [-1, 1].
+    :return: A SimilarityDistribution.
+    """
+    normalized: np.ndarray = normalize_segments(segments).astype(np.float32)
+    num_segments: int = len(normalized)
+    if num_segments < 2:
+        raise ValueError('At least two segments are required to compare pairs')
+
+    chunk_size = max(1, chunk_size)
+    histogram: np.ndarray = np.zeros(num_bins, dtype=np.int64)
+    total: float = 0.0
+    total_of_squares: float = 0.0
+
+    for row_start in range(0, num_segments, chunk_size):
+        row_block: np.ndarray = normalized[row_start:row_start + chunk_size]
+        for column_start in range(row_start, num_segments, chunk_size):
+            block: np.ndarray = row_block @ normalized[column_start:column_start + chunk_size].T
+            if column_start == row_start:
+                # diagonal block, only keep the strict upper triangle
+                block = block[np.triu_indices(len(row_block), k=1)]
+            block = np.clip(block.ravel(), -1, 1)
+
+            total += float(np.sum(block, dtype=np.float64))
+            total_of_squares += float(np.sum(np.square(block, dtype=np.float64)))
+            bins: np.ndarray = np.minimum(((block + 1) * (num_bins / 2)).astype(np.int64), num_bins - 1)
+            histogram += np.bincount(bins, minlength=num_bins)
+
+    num_pairs: int = num_segments * (num_segments - 1) // 2
+    mean: float = total / num_pairs
+    std: float = float(np.sqrt(max(total_of_squares / num_pairs - mean * mean, 0.0)))
+    bin_edges: np.ndarray = np.linspace(-1, 1, num_bins + 1)
+
+    def histogram_quantile(quantile: float) -> float:
+        """
+        Reads a quantile from the cumulative histogram, using the upper edge of its bin.
+        """
+        cumulative: np.ndarray = np.cumsum(histogram)
+        position: int = int(np.searchsorted(cumulative, quantile * num_pairs, side='left'))
+        return float(bin_edges[min(position, num_bins - 1) + 1])
+
+    return SimilarityDistribution(mean=mean,
+                                  std=std,
+                                  num_pairs=num_pairs,
+                                  quantiles={quantile: histogram_quantile(quantile) for quantile in quantiles},
+                                  collapse_quantile=collapse_quantile,
+                                  collapse_score=histogram_quantile(collapse_quantile),
+                                  histogram=histogram,
+                                  bin_edges=bin_edges)
+
+
 def file_exists(path: str) -> bool:
     """
     Determine whether or not the file exists
@@ -152,6 +454,22 @@ def file_exists(path: str) -> bool:
     return os.path.exists(path)
 
 
+def verify_h5_file(file_name: str) -> None:
+    """
+    Verifies that the given file is an existing .h5 file.
+    """
+    # verify that the file extension is indeed .h5
+    if not file_name.endswith('.h5'):
+        raise InvalidH5FileError(
+            'Invalid file extension, the file must be of type (.h5)')
+
+    # verify that the file actually exists
+    if not file_exists(file_name):
+        raise FileNotFoundError(
+            f'Could not find the file "{file_name}"'
+            f', please verify that it is present!')
+
+
 def parse_cli_arguments() -> Namespace:
     """
     Utility function that parses command line arguments
@@ -165,6 +483,21 @@ def parse_cli_arguments() -> Namespace:
                         help='The name of the .h5 dataset')
     parser.add_argument('--class-label', '-c', default=0, type=int,
                         help='The class label')
+    parser.add_argument('--all-classes', '-a', action='store_true',
+                        help='Compute the RTR statistics of every class in a single pass over the file')
+    parser.add_argument('--mode', '-m', default=SAMPLED_MODE, choices=SIMILARITY_MODES,
+                        help='Compare random pairs or all pairs of segments (with --all-classes)')
+    parser.add_argument('--ratio', '-r', default=10, type=int,
+                        help='The number of segments compared in sampled mode (with --all-classes)')
+    parser.add_argument('--chunk-size', default=1024, type=int,
+                        help='The number of rows read from the file at a time (with --all-classes)')
+    parser.add_argument('--memory-limit', default=DEFAULT_RTR_MEMORY_LIMIT // 2 ** 20, type=int,
+                        help='The memory in MiB exhaustive mode may use, a dataset of many long segments '
+                             'is read once per block of rows that fits (with --all-classes)')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='The seed for sampled mode, sampled results are only cached when it is set')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ignore and do not update the cached results')
 
     return parser.parse_args()
 
@@ -175,16 +508,7 @@ def read_h5_file(file_name: str, class_label: int) -> float:
 
     :return: The RTR similarity
     """
-    # verify that the file extension is indeed .h5
-    if not file_name.endswith('.h5'):
-        raise InvalidH5FileError(
-            'Invalid file extension, the file must be of type (.h5)')
-
-    # verify that the file actually exists
-    if not file_exists(file_name):
-        raise FileNotFoundError(
-            f'Could not find the file "{file_name}"'
-            f', please verify that it is present!')
+    verify_h5_file(file_name)
 
     with h5reader.File(file_name, mode='r') as h5_file:
         h5_file_keys = h5_file.keys()
@@ -193,16 +517,278 @@ def read_h5_file(file_name: str, class_label: int) -> float:
         if 'X' not in h5_file_keys or 'y' not in h5_file_keys:
             raise InvalidH5FileError('The keys of this .h5 file are invalid!')
 
-        # get the output data and the indices to keep
-        output_data = np.array(h5_file.get('y'))
-        indices_to_keep = np.where(output_data == class_label)
-
-        # get the input data
-        input_data = np.array(h5_file.get('X'))[indices_to_keep]
+        class_index = read_class_index(h5_file)
+        if class_index is not None:
+            # a class sorted file stores the class as one contiguous slice
+            offset, length = class_index.get(class_label, (0, 0))
+            input_data = np.array(h5_file['X'][offset:offset + length])
+        else:
+            # get the output data and the indices to keep
+            output_data = np.array(h5_file.get('y'))
+            indices_to_keep = np.where(output_data == class_label)
+
+            # get the input data
+            input_data = np.array(h5_file.get('X'))[indices_to_keep]
         real_to_real_ratio = 10
         return compute_real_to_real_similarity(input_data, real_to_real_ratio)
 
 
+def _rtr_cache_key(mode: str, real_real_ratio: int, seed: Optional[int]) -> Optional[str]:
+    """
+    The key of a set of rtr results within the cache, or None when they should not be cached.
+    """
+    if mode == EXHAUSTIVE_MODE:
+        return mode
+    if seed is None:
+        # an unseeded sample is not reproducible, so there is nothing to cache
+        return None
+    return f'{mode},ratio={real_real_ratio},seed={seed}'
+
+
+def _load_rtr_cache(cache_path: str, digest: str, size: int) -> dict:
+    """
+    Loads the rtr cache, discarding it when it belongs to a different version of the dataset.
+    """
+    empty_cache = {'sha256': digest, 'size': size, 'results': {}}
+    if not file_exists(cache_path):
+        return empty_cache
+    try:
+        with open(cache_path, mode='r', encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return empty_cache
+    if cache.get('sha256') != digest or cache.get('size') != size:
+        return empty_cache
+    return cache
+
+
+def _save_rtr_cache(cache_path: str, cache: dict) -> None:
+    """
+    Writes the rtr cache, going through a temporary file so a partial write never replaces it.
+    """
+    temporary_path = f'{cache_path}.tmp'
+    with open(temporary_path, mode='w', encoding='utf-8') as cache_file:
+        json.dump(cache, cache_file, indent=2)
+    os.replace(temporary_path, cache_path)
+
+
+def _add_class_squared_similarities(left: np.ndarray,
+                                    left_labels: np.ndarray,
+                                    right: np.ndarray,
+                                    right_labels: np.ndarray,
+                                    weight: int,
+                                    accumulators: Dict[int, dict]) -> None:
+    """
+    Adds, for every class, weight times the sum of the squared dot products between its rows of left
+    and its rows of right.
+    """
+    for class_label, accumulator in accumulators.items():
+        left_rows: np.ndarray = left[left_labels == class_label]
+        right_rows: np.ndarray = right[right_labels == class_label]
+        if len(left_rows) == 0 or len(right_rows) == 0:
+            continue
+        accumulator['squared_similarities'] += weight * float(np.sum(np.square(left_rows @ right_rows.T)))
+
+
+def _stream_squared_similarities(x_data: h5reader.Dataset,
+                                 labels: np.ndarray,
+                                 chunk_size: int,
+                                 memory_limit: int,
+                                 accumulators: Dict[int, dict]) -> None:
+    """
+    Sums, for every class, the squared similarities over all ordered pairs of its segments without
+    a num_features^2 matrix: X is read in blocks of as many normalized rows as fit in memory_limit,
+    and every chunk of a block is compared with the chunks from itself on, so that each pair of
+    chunks is multiplied once and X is read once per block.
+    """
+    num_features: int = int(np.prod(x_data.shape[1:]))
+    # a whole number of chunks, so that the chunks of a block are the chunks streamed from the file
+    block_size: int = max(1, memory_limit // (num_features * 8 * chunk_size)) * chunk_size
+    for block_start in range(0, len(labels), block_size):
+        block: np.ndarray = normalize_segments(x_data[block_start:block_start + block_size]).astype(np.float64)
+        block_labels: np.ndarray = labels[block_start:block_start + block_size]
+        block_stop: int = block_start + len(block)
+        for start in range(block_start, len(labels), chunk_size):
+            if start < block_stop:
+                chunk: np.ndarray = block[start - block_start:start - block_start + chunk_size]
+            else:
+                chunk = normalize_segments(x_data[start:start + chunk_size]).astype(np.float64)
+            chunk_labels: np.ndarray = labels[start:start + chunk_size]
+            for block_chunk_start in range(block_start, min(start, block_stop - 1) + 1, chunk_size):
+                offset: int = block_chunk_start - block_start
+                # the pairs of two different chunks stand for both of their orders
+                _add_class_squared_similarities(block[offset:offset + chunk_size],
+                                                block_labels[offset:offset + chunk_size],
+                                                chunk, chunk_labels,
+                                                1 if block_chunk_start == start else 2,
+                                                accumulators)
+
+
+def _stream_exhaustive_rtr(x_data: h5reader.Dataset,
+                           labels: np.ndarray,
+                           chunk_size: int,
+                           memory_limit: int = DEFAULT_RTR_MEMORY_LIMIT) -> Dict[int, dict]:
+    """
+    Computes the exact mean and standard deviation of the similarity over all pairs of
+    segments within each class, from the sum of the normalized segments of each class and
+    the sum of the squared similarities over its ordered pairs, since
+        sum_{i<j} u_i.u_j = (|sum u|^2 - sum |u_i|^2) / 2
+        sum_{i<j} (u_i.u_j)^2 = (sum_{i,j} (u_i.u_j)^2 - sum |u_i|^4) / 2
+        sum_{i,j} (u_i.u_j)^2 = |sum u u^T|_F^2
+    When the second moment matrices (num_features^2 each) of all classes fit in memory_limit,
+    everything is accumulated in one sequential pass over X. Otherwise the squared similarities
+    are summed block by block by _stream_squared_similarities, in memory_limit.
+    """
+    num_features: int = int(np.prod(x_data.shape[1:]))
+    class_labels: np.ndarray = np.unique(labels)
+    use_second_moments: bool = len(class_labels) * num_features * num_features * 8 <= memory_limit
+    accumulators: Dict[int, dict] = {}
+    second_moments: Dict[int, np.ndarray] = {}
+    for class_label in class_labels:
+        accumulators[int(class_label)] = {'count': 0,
+                                          'sum': np.zeros(num_features),
+                                          'squared_norms': 0.0,
+                                          'fourth_powers': 0.0,
+                                          'squared_similarities': 0.0}
+        if use_second_moments:
+            second_moments[int(class_label)] = np.zeros((num_features, num_features))
+
+    for start in range(0, len(labels), chunk_size):
+        normalized: np.ndarray = normalize_segments(x_data[start:start + chunk_size]).astype(np.float64)
+        chunk_labels: np.ndarray = labels[start:start + chunk_size]
+        for class_label, accumulator in accumulators.items():
+            class_rows: np.ndarray = normalized[chunk_labels == class_label]
+            if len(class_rows) == 0:
+                continue
+            squared_norms: np.ndarray = np.sum(np.square(class_rows), axis=1)
+            accumulator['count'] += len(class_rows)
+            accumulator['sum'] += np.sum(class_rows, axis=0)
+            accumulator['squared_norms'] += float(np.sum(squared_norms))
+            accumulator['fourth_powers'] += float(np.sum(np.square(squared_norms)))
+            if use_second_moments:
+                second_moments[class_label] += class_rows.T @ class_rows
+
+    if use_second_moments:
+        for class_label, second_moment in second_moments.items():
+            accumulators[class_label]['squared_similarities'] = float(np.sum(np.square(second_moment)))
+    else:
+        _stream_squared_similarities(x_data, labels, chunk_size, memory_limit, accumulators)
+
+    results: Dict[int, dict] = {}
+    for class_label, accumulator in accumulators.items():
+        count: int = accumulator['count']
+        num_pairs: int = count * (count - 1) // 2
+        if num_pairs == 0:
+            continue
+        pair_sum: float = (float(accumulator['sum'] @ accumulator['sum']) - accumulator['squared_norms']) / 2
+        pair_sum_of_squares: float = (accumulator['squared_similarities'] - accumulator['fourth_powers']) / 2
+        mean: float = pair_sum / num_pairs
+        results[class_label] = {'mean': mean,
+                                'std': float(np.sqrt(max(pair_sum_of_squares / num_pairs - mean * mean, 0.0))),
+                                'num_segments': count,
+                                'num_pairs': num_pairs}
+    return results
+
+
+def _stream_sampled_rtr(x_data: h5reader.Dataset,
+                        labels: np.ndarray,
+                        real_real_ratio: int,
+                        chunk_size: int,
+                        random_state: RandomState) -> Dict[int, dict]:
+    """
+    Computes the sampled rtr similarity of every class, as compute_real_to_real_similarity
+    does for a single one: a random segment of the class is compared against real_real_ratio
+    other segments of that class. All indices are drawn up front, so the rows that are needed
+    are collected during one sequential pass over X.
+    """
+    generator = resolve_random_state(random_state)
+    chosen_rows: Dict[int, Tuple[int, np.ndarray]] = {}
+    for class_label in np.unique(labels):
+        class_rows: np.ndarray = np.flatnonzero(labels == class_label)
+        if len(class_rows) < 2:
+            continue
+        anchor: int = int(_random_integers(generator, len(class_rows), (1, 1))[0, 0])
+        others: np.ndarray = np.delete(class_rows, anchor)
+        compared: np.ndarray = others[_random_integers(generator, len(others), (1, real_real_ratio))[0]]
+        chosen_rows[int(class_label)] = (int(class_rows[anchor]), compared)
+    if not chosen_rows:
+        # no class has a pair of segments, as in exhaustive mode such classes have no result
+        return {}
+
+    needed_rows: np.ndarray = np.unique(np.concatenate(
+        [np.append(compared, anchor) for anchor, compared in chosen_rows.values()]))
+    collected: Dict[int, np.ndarray] = {}
+    for start in range(0, len(labels), chunk_size):
+        rows_in_chunk: np.ndarray = needed_rows[(needed_rows >= start) & (needed_rows < start + chunk_size)]
+        if len(rows_in_chunk) == 0:
+            continue
+        normalized: np.ndarray = normalize_segments(x_data[start:start + chunk_size][rows_in_chunk - start])
+        collected.update(zip(rows_in_chunk.tolist(), normalized))
+
+    results: Dict[int, dict] = {}
+    for class_label, (anchor, compared) in chosen_rows.items():
+        similarities: np.ndarray = np.array([collected[row] for row in compared.tolist()]) @ collected[anchor]
+        results[class_label] = {'mean': float(np.mean(similarities)),
+                                'std': float(np.std(similarities)),
+                                'num_segments': int(np.count_nonzero(labels == class_label)),
+                                'num_pairs': len(similarities)}
+    return results
+
+
+def compute_all_classes_rtr_similarity(file_name: str,
+                                       mode: str = SAMPLED_MODE,
+                                       real_real_ratio: int = 10,
+                                       chunk_size: int = 1024,
+                                       seed: Optional[int] = None,
+                                       use_cache: bool = True,
+                                       memory_limit: int = DEFAULT_RTR_MEMORY_LIMIT) -> Dict[int, dict]:
+    """
+    Computes the RTR similarity statistics of every class of a .h5 dataset, streaming X
+    and y from the file in chunks of rows rather than loading the whole dataset.
+    Results are cached in a sidecar file next to the dataset, keyed by the hash and size
+    of the dataset, so repeated runs get them without reading X again.
+
+    :param file_name: The path of the .h5 dataset.
+    :param mode: Either "sampled" or "exhaustive" (all pairs within a class).
+    :param real_real_ratio: The number of segments compared in sampled mode.
+    :param chunk_size: The number of rows read from the file at a time.
+    :param seed: The seed for sampled mode, sampled results are only cached when it is set.
+    :param use_cache: Whether to read and update the cache.
+    :param memory_limit: The number of bytes exhaustive mode may hold besides a chunk of rows, which
+    decides whether it makes one pass over X or one pass per block of rows that fits.
+    :return: A dictionary mapping every class label to a dictionary of the form
+    {'mean': float, 'std': float, 'num_segments': int, 'num_pairs': int}.
+    """
+    verify_h5_file(file_name)
+    if mode not in SIMILARITY_MODES:
+        raise ValueError(f'Unknown similarity mode "{mode}", expected one of {SIMILARITY_MODES}')
+
+    cache_key: Optional[str] = _rtr_cache_key(mode, real_real_ratio, seed) if use_cache else None
+    cache_path: str = file_name + RTR_CACHE_SUFFIX
+    cache: Optional[dict] = None
+    if cache_key is not None:
+        cache = _load_rtr_cache(cache_path, *file_fingerprint(file_name))
+        if cache_key in cache['results']:
+            return {int(label): stats for label, stats in cache['results'][cache_key].items()}
+
+    with h5reader.File(file_name, mode='r') as h5_file:
+        # verify the correctness of the keys
+        if 'X' not in h5_file.keys() or 'y' not in h5_file.keys():
+            raise InvalidH5FileError('The keys of this .h5 file are invalid!')
+
+        labels: np.ndarray = np.asarray(h5_file['y']).reshape(-1)
+        if mode == EXHAUSTIVE_MODE:
+            results = _stream_exhaustive_rtr(h5_file['X'], labels, max(1, chunk_size), memory_limit)
+        else:
+            results = _stream_sampled_rtr(h5_file['X'], labels, real_real_ratio, max(1, chunk_size), seed)
+
+    if cache is not None:
+        cache['results'][cache_key] = {str(label): stats for label, stats in results.items()}
+        _save_rtr_cache(cache_path, cache)
+
+    return results
+
+
 def main() -> None:
     """
     De-facto main method, created to better organize code.
@@ -210,6 +796,19 @@ def main() -> None:
     cli_args: Namespace = parse_cli_arguments()
     file_name: str = cli_args.filename
 
+    if cli_args.all_classes:
+        results = compute_all_classes_rtr_similarity(file_name,
+                                                     mode=cli_args.mode,
+                                                     real_real_ratio=cli_args.ratio,
+                                                     chunk_size=cli_args.chunk_size,
+                                                     seed=cli_args.seed,
+                                                     use_cache=not cli_args.no_cache,
+                                                     memory_limit=cli_args.memory_limit * 2 ** 20)
+        for class_label, stats in sorted(results.items()):
+            print(f'Class {class_label}: RTR similarity (real-to-real similarity): {stats["mean"]} '
+                  f'(std {stats["std"]}, {stats["num_pairs"]} pairs of {stats["num_segments"]} segments)')
+        return
+
     rtr_similarity = read_h5_file(file_name, cli_args.class_label)
     print(f'RTR similarity (real-to-real similarity): {rtr_similarity}')
 
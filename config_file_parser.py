@@ -6,7 +6,7 @@ import configparser
 import os
 
 from data.model_data_storage import Weights, \
-    TrainingParameters, Names, ModelData, Empty
+    TrainingParameters, Names, ModelData, Empty, CacheSettings
 
 
 class ModelConfigParser:
@@ -40,7 +40,32 @@ class ModelConfigParser:
             'synthetic_synthetic_ratio': '10',
             'discriminator_learning_rate': '0.01',
             'accuracy_threshold': '0.8',
-            'num_features': '9'
+            'num_features': '9',
+            'rts_mode': 'sampled',
+            'rts_legacy_sampling': 'False',
+            'sts_mode': 'sampled',
+            'sts_collapse_quantile': '0.05',
+            'similarity_chunk_size': '256',
+            'train_step': 'legacy',
+            'jit_compile': 'False',
+            'prefetch_batches': '2',
+            'noise_source': 'host',
+            'evaluation_interval_steps': '1',
+            'evaluation_interval_seconds': '0',
+            'probe_size': '25',
+            'max_evaluation_lag': '0',
+            'conditional': 'False',
+            'class_embedding_dim': '8',
+            'checkpoint_interval_steps': '0',
+            'checkpoint_keep_best': '3',
+            'checkpoint_metric': 'classifier_accuracy',
+            'accuracy_window': '1',
+            'patience': '0',
+            'patience_metric': 'classifier_accuracy',
+            'patience_min_delta': '0',
+            'collapse_sts_threshold': '0',
+            'collapse_patience': '3',
+            'nan_check': 'True'
         }
         model_maker['WEIGHTS'] = {
             'discriminator_loss_weight': '1',
@@ -50,6 +75,11 @@ class ModelConfigParser:
         model_maker['NAMES'] = {
             'classifier_name': 'C'
         }
+        model_maker['CACHE'] = {
+            'enabled': 'True',
+            'directory': '.supergan_cache',
+            'max_size_mb': '256'
+        }
         with open('model.conf', 'w') as configfile:
             model_maker.write(configfile)
 
@@ -66,7 +96,7 @@ class ModelConfigParser:
         return os.path.exists(os.path.join(filepath, 'model.conf'))
 
     @staticmethod
-    def parse_config() -> (TrainingParameters, Weights, Names, ModelData):
+    def parse_config() -> (TrainingParameters, Weights, Names, ModelData, CacheSettings):
         """
         Parses the configuration file, and gets the relevant data.
 
@@ -90,6 +120,31 @@ class ModelConfigParser:
             discriminator_learning_rate: float = float(key.get('discriminator_learning_rate', '0.01'))
             accuracy_threshold: float = float(key.get('accuracy_threshold', '0.8'))
             num_features: int = int(key.get('num_features', '9'))
+            rts_mode: str = key.get('rts_mode', 'sampled')
+            rts_legacy_sampling: bool = key.get('rts_legacy_sampling', 'False') == 'True'
+            sts_mode: str = key.get('sts_mode', 'sampled')
+            sts_collapse_quantile: float = float(key.get('sts_collapse_quantile', '0.05'))
+            similarity_chunk_size: int = int(key.get('similarity_chunk_size', '256'))
+            train_step: str = key.get('train_step', 'legacy')
+            jit_compile: bool = key.get('jit_compile', 'False') == 'True'
+            prefetch_batches: int = int(key.get('prefetch_batches', '2'))
+            noise_source: str = key.get('noise_source', 'host')
+            evaluation_interval_steps: int = int(key.get('evaluation_interval_steps', '1'))
+            evaluation_interval_seconds: float = float(key.get('evaluation_interval_seconds', '0'))
+            probe_size: int = int(key.get('probe_size', '25'))
+            max_evaluation_lag: int = int(key.get('max_evaluation_lag', '0'))
+            conditional: bool = key.get('conditional', 'False') == 'True'
+            class_embedding_dim: int = int(key.get('class_embedding_dim', '8'))
+            checkpoint_interval_steps: int = int(key.get('checkpoint_interval_steps', '0'))
+            checkpoint_keep_best: int = int(key.get('checkpoint_keep_best', '3'))
+            checkpoint_metric: str = key.get('checkpoint_metric', 'classifier_accuracy')
+            accuracy_window: int = int(key.get('accuracy_window', '1'))
+            patience: int = int(key.get('patience', '0'))
+            patience_metric: str = key.get('patience_metric', 'classifier_accuracy')
+            patience_min_delta: float = float(key.get('patience_min_delta', '0'))
+            collapse_sts_threshold: float = float(key.get('collapse_sts_threshold', '0'))
+            collapse_patience: int = int(key.get('collapse_patience', '3'))
+            nan_check: bool = key.get('nan_check', 'True') == 'True'
             return TrainingParameters(latent_dimension=latent_dimension,
                                       epochs=epochs,
                                       batch_size=batch_size,
@@ -98,7 +153,32 @@ class ModelConfigParser:
                                       real_real_ratio=real_real_ratio,
                                       synthetic_synthetic_ratio=synthetic_synthetic_ratio,
                                       discriminator_learning_rate=discriminator_learning_rate,
-                                      accuracy_threshold=accuracy_threshold, num_features=num_features)
+                                      accuracy_threshold=accuracy_threshold, num_features=num_features,
+                                      rts_mode=rts_mode,
+                                      rts_legacy_sampling=rts_legacy_sampling,
+                                      sts_mode=sts_mode,
+                                      sts_collapse_quantile=sts_collapse_quantile,
+                                      similarity_chunk_size=similarity_chunk_size,
+                                      train_step=train_step,
+                                      jit_compile=jit_compile,
+                                      prefetch_batches=prefetch_batches,
+                                      noise_source=noise_source,
+                                      evaluation_interval_steps=evaluation_interval_steps,
+                                      evaluation_interval_seconds=evaluation_interval_seconds,
+                                      probe_size=probe_size,
+                                      max_evaluation_lag=max_evaluation_lag,
+                                      conditional=conditional,
+                                      class_embedding_dim=class_embedding_dim,
+                                      checkpoint_interval_steps=checkpoint_interval_steps,
+                                      checkpoint_keep_best=checkpoint_keep_best,
+                                      checkpoint_metric=checkpoint_metric,
+                                      accuracy_window=accuracy_window,
+                                      patience=patience,
+                                      patience_metric=patience_metric,
+                                      patience_min_delta=patience_min_delta,
+                                      collapse_sts_threshold=collapse_sts_threshold,
+                                      collapse_patience=collapse_patience,
+                                      nan_check=nan_check)
 
         def parse_weights(key: configparser.SectionProxy) -> Weights:
             """
@@ -150,6 +230,18 @@ class ModelConfigParser:
                                  directory=directory,
                                  exists=exists)
 
+        def parse_cache(key: configparser.SectionProxy) -> CacheSettings:
+            """
+            Parses the cache settings in the provided key.
+
+            :param key: A key that represents a map of cache settings.
+            :return: A dataclass of parsed cache settings.
+            """
+            enabled: bool = key.get('enabled', 'True') == 'True'
+            directory: str = key.get('directory', '.supergan_cache')
+            max_size_mb: int = int(key.get('max_size_mb', '256'))
+            return CacheSettings(enabled=enabled, directory=directory, max_size_mb=max_size_mb)
+
         model_parser = configparser.ConfigParser()
         model_parser.read('model.conf')
         training_parameters: TrainingParameters \
@@ -157,4 +249,8 @@ class ModelConfigParser:
         weights: Weights = parse_weights(model_parser['WEIGHTS'])
         names: Names = parse_names(model_parser['NAMES'])
         model_data: ModelData = parse_models(model_parser['MODELS'])
-        return training_parameters, weights, names, model_data
+
+        # the section is optional, older configuration files do not have it
+        cache_settings: CacheSettings = parse_cache(model_parser['CACHE']) \
+            if model_parser.has_section('CACHE') else CacheSettings()
+        return training_parameters, weights, names, model_data, cache_settings
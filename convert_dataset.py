@@ -0,0 +1,123 @@
+"""
+Rewrites a SuperGAN input .h5 file (X, y, y_onehot) into a layout optimized for training:
+the rows are sorted by class label and X is stored as float32, chunked along the rows.
+The file also holds a per class (offset, length) index and per channel summary statistics,
+which lets input_module.load_data read a class as one contiguous slice.
+Usage: python3 convert_dataset.py dataset_name.h5 converted_dataset_name.h5
+"""
+
+import argparse as arg_parser
+from argparse import Namespace
+from typing import Optional, Tuple
+
+import h5py
+import numpy as np
+
+from input_module import CLASS_INDEX_KEY, CHANNEL_STATS_KEY, read_rows
+
+# rows are chunked so that one chunk of X holds roughly this many bytes
+TARGET_CHUNK_BYTES = 1 << 20
+
+CHANNEL_STATS_ROWS = ('mean', 'std', 'min', 'max')
+
+
+def compute_chunk_shape(num_rows: int, segment_shape: Tuple[int, ...], itemsize: int) -> Tuple[int, ...]:
+    """
+    Computes a chunk shape holding whole segments, about TARGET_CHUNK_BYTES in size.
+
+    :param num_rows: The number of rows (segments) in the dataset.
+    :param segment_shape: The shape of a single segment, e.g. (seq_length, num_channels).
+    :param itemsize: The size of a single value in bytes.
+    :return: The chunk shape.
+    """
+    segment_bytes: int = int(np.prod(segment_shape)) * itemsize
+    rows_per_chunk: int = max(1, min(num_rows, TARGET_CHUNK_BYTES // max(1, segment_bytes)))
+    return (rows_per_chunk,) + tuple(segment_shape)
+
+
+def convert_dataset(input_path: str,
+                    output_path: str,
+                    contiguous: bool = False,
+                    compression: Optional[str] = None) -> None:
+    """
+    Converts a dataset to the class sorted layout. Only one class is held in memory at a time.
+
+    :param input_path: The path of the original .h5 dataset.
+    :param output_path: The path of the converted .h5 dataset.
+    :param contiguous: Whether to store X unchunked, which allows it to be memory mapped.
+    :param compression: An optional HDF5 compression filter for X, e.g. "gzip" or "lzf".
+    """
+    with h5py.File(input_path, mode='r') as input_file:
+        if 'X' not in input_file.keys() or 'y' not in input_file.keys() or 'y_onehot' not in input_file.keys():
+            raise IOError(f'"{input_path}" must contain the datasets X, y and y_onehot')
+
+        x_data: h5py.Dataset = input_file['X']
+        labels: np.ndarray = np.asarray(input_file['y']).reshape(-1)
+        order: np.ndarray = np.argsort(labels, kind='stable')
+        class_labels, class_offsets, class_lengths = np.unique(labels[order], return_index=True, return_counts=True)
+        num_channels: int = x_data.shape[-1]
+
+        if contiguous and compression is not None:
+            raise ValueError('A contiguous dataset cannot be compressed')
+
+        with h5py.File(output_path, mode='w') as output_file:
+            chunks = None if contiguous else compute_chunk_shape(x_data.shape[0], x_data.shape[1:],
+                                                                 np.dtype(np.float32).itemsize)
+            x_output: h5py.Dataset = output_file.create_dataset('X', shape=x_data.shape, dtype=np.float32,
+                                                                chunks=chunks, compression=compression)
+            output_file.create_dataset('y', data=np.asarray(input_file['y'])[order])
+            output_file.create_dataset('y_onehot', data=np.asarray(input_file['y_onehot'])[order])
+
+            channel_sum: np.ndarray = np.zeros(num_channels)
+            channel_sum_of_squares: np.ndarray = np.zeros(num_channels)
+            channel_min: np.ndarray = np.full(num_channels, np.inf)
+            channel_max: np.ndarray = np.full(num_channels, -np.inf)
+
+            for offset, length in zip(class_offsets.tolist(), class_lengths.tolist()):
+                # the sort is stable, so the rows of a class are still in ascending order
+                class_data: np.ndarray = read_rows(x_data, order[offset:offset + length]).astype(np.float32)
+                x_output[offset:offset + length] = class_data
+
+                channel_values: np.ndarray = class_data.reshape(-1, num_channels).astype(np.float64)
+                channel_sum += np.sum(channel_values, axis=0)
+                channel_sum_of_squares += np.sum(np.square(channel_values), axis=0)
+                channel_min = np.minimum(channel_min, np.min(channel_values, axis=0))
+                channel_max = np.maximum(channel_max, np.max(channel_values, axis=0))
+
+            num_values: int = int(np.prod(x_data.shape[:-1]))
+            channel_mean: np.ndarray = channel_sum / num_values
+            channel_std: np.ndarray = np.sqrt(np.maximum(channel_sum_of_squares / num_values
+                                                         - np.square(channel_mean), 0))
+
+            output_file.create_dataset(CLASS_INDEX_KEY,
+                                       data=np.stack((class_labels, class_offsets, class_lengths),
+                                                     axis=1).astype(np.int64))
+            channel_stats: h5py.Dataset = output_file.create_dataset(
+                CHANNEL_STATS_KEY, data=np.stack((channel_mean, channel_std, channel_min, channel_max)))
+            channel_stats.attrs['rows'] = ','.join(CHANNEL_STATS_ROWS)
+
+
+def parse_cli_arguments() -> Namespace:
+    """
+    Utility function that parses command line arguments
+    """
+    parser = arg_parser.ArgumentParser(description='''
+                                                   Rewrites a SuperGAN dataset into a class sorted,
+                                                   chunked float32 layout with a per class index
+                                                   ''')
+    parser.add_argument('input', type=str,
+                        help='The .h5 dataset to convert')
+    parser.add_argument('output', type=str,
+                        help='The path of the converted .h5 dataset')
+    parser.add_argument('--contiguous', action='store_true',
+                        help='Store X unchunked, so that a class can be memory mapped')
+    parser.add_argument('--compression', type=str, default=None, choices=('gzip', 'lzf'),
+                        help='Compress X with the given filter')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cli_args: Namespace = parse_cli_arguments()
+    convert_dataset(cli_args.input, cli_args.output,
+                    contiguous=cli_args.contiguous,
+                    compression=cli_args.compression)
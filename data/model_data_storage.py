@@ -20,6 +20,31 @@ class TrainingParameters:
     discriminator_learning_rate: float
     accuracy_threshold: float
     num_features: int
+    rts_mode: str = 'sampled'
+    rts_legacy_sampling: bool = False
+    sts_mode: str = 'sampled'
+    sts_collapse_quantile: float = 0.05
+    similarity_chunk_size: int = 256
+    train_step: str = 'legacy'
+    jit_compile: bool = False
+    prefetch_batches: int = 2
+    noise_source: str = 'host'
+    evaluation_interval_steps: int = 1
+    evaluation_interval_seconds: float = 0.0
+    probe_size: int = 25
+    max_evaluation_lag: int = 0
+    conditional: bool = False
+    class_embedding_dim: int = 8
+    checkpoint_interval_steps: int = 0
+    checkpoint_keep_best: int = 3
+    checkpoint_metric: str = 'classifier_accuracy'
+    accuracy_window: int = 1
+    patience: int = 0
+    patience_metric: str = 'classifier_accuracy'
+    patience_min_delta: float = 0.0
+    collapse_sts_threshold: float = 0.0
+    collapse_patience: int = 3
+    nan_check: bool = True
 
 
 @dataclass(frozen=True)
@@ -29,7 +54,7 @@ class Weights:
     """
     discriminator_loss_weight: int
     classifier_loss_weight: int
-    sfd_loss_weight: int4
+    sfd_loss_weight: int
 
 
 @dataclass(frozen=True)
@@ -40,6 +65,16 @@ class Names:
     classifier_name: str
 
 
+@dataclass(frozen=True)
+class CacheSettings:
+    """
+    Class for keeping track of the on-disk cache of values derived from the dataset.
+    """
+    enabled: bool = True
+    directory: str = '.supergan_cache'
+    max_size_mb: int = 256
+
+
 @dataclass(frozen=True)
 class ModelData:
     discriminator_filename: str
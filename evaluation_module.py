@@ -0,0 +1,164 @@
+"""
+Contains the results of evaluating the generator during training, the schedule deciding
+when the full (and expensive) evaluation runs and a worker running it in the background.
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from compute_similarity_metrics import SimilarityDistribution
+
+
+@dataclass(frozen=True)
+class EvaluationResult:
+    """
+    The metrics of the generator after a given training step.
+    """
+    step: int
+    synthetic_data: np.ndarray
+    classifier_accuracy: float
+    mean_rts_similarity: np.ndarray
+    mean_sts_similarity: np.ndarray
+    statistical_feature_distance: np.ndarray
+    sts_distribution: Optional[SimilarityDistribution] = None
+    seconds: Optional[float] = None
+
+
+class EvaluationSchedule:
+    """
+    Decides whether the full evaluation is due, every interval_steps training steps and/or
+    every interval_seconds seconds, whichever comes first.
+    """
+
+    def __init__(self,
+                 interval_steps: int = 1,
+                 interval_seconds: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param interval_steps: The number of steps between evaluations, 0 disables the step based cadence.
+        :param interval_seconds: The number of seconds between evaluations, 0 disables the time based cadence.
+        :param clock: The clock the seconds are measured with.
+        """
+        if interval_steps <= 0 and interval_seconds <= 0:
+            raise ValueError('At least one of the evaluation intervals has to be positive')
+        self.interval_steps: int = interval_steps
+        self.interval_seconds: float = interval_seconds
+        self.clock: Callable[[], float] = clock
+        self.last_step: int = 0
+        self.last_time: float = clock()
+
+    def is_due(self, step: int) -> bool:
+        """
+        :param step: The current training step, counting from 1.
+        :return: Whether the full evaluation should run after this step.
+        """
+        if 0 < self.interval_steps <= step - self.last_step:
+            return True
+        return 0 < self.interval_seconds <= self.clock() - self.last_time
+
+    def record(self, step: int) -> None:
+        """
+        Records that the full evaluation ran after the given step.
+
+        :param step: The training step.
+        """
+        self.last_step = step
+        self.last_time = self.clock()
+
+
+@dataclass(frozen=True)
+class WeightsSnapshot:
+    """
+    A copy of the weights evaluated for a given training step.
+    """
+    step: int
+    generator_weights: List[np.ndarray]
+    classifier_weights: List[np.ndarray]
+
+
+class EvaluationWorker:
+    """
+    Evaluates weight snapshots on a background thread, one at a time and in the order they were
+    submitted, so that the results come back in step order while training goes on.
+    """
+
+    def __init__(self, evaluate: Callable[[WeightsSnapshot], EvaluationResult]):
+        """
+        :param evaluate: The function evaluating a snapshot, called on the worker thread.
+        """
+        self.evaluate: Callable[[WeightsSnapshot], EvaluationResult] = evaluate
+        self._snapshots: queue.Queue = queue.Queue()
+        self._condition: threading.Condition = threading.Condition()
+        self._pending_steps: List[int] = []
+        self._results: List[EvaluationResult] = []
+        self._error: Optional[BaseException] = None
+        self._thread: threading.Thread = threading.Thread(target=self._run, name='EvaluationWorker', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        """
+        The body of the worker thread, which evaluates snapshots until it receives None.
+        """
+        while True:
+            snapshot: Optional[WeightsSnapshot] = self._snapshots.get()
+            if snapshot is None:
+                return
+            try:
+                result: EvaluationResult = self.evaluate(snapshot)
+            except BaseException as error:
+                with self._condition:
+                    self._error = error
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._results.append(result)
+                self._pending_steps.pop(0)
+                self._condition.notify_all()
+
+    def submit(self, snapshot: WeightsSnapshot) -> None:
+        """
+        Queues a snapshot for evaluation.
+
+        :param snapshot: The snapshot of the weights.
+        """
+        with self._condition:
+            self._pending_steps.append(snapshot.step)
+        self._snapshots.put(snapshot)
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether some submitted snapshots are not evaluated yet.
+        """
+        with self._condition:
+            return len(self._pending_steps) > 0
+
+    def collect(self, wait_until_step: Optional[int] = None) -> List[EvaluationResult]:
+        """
+        Takes the results finished so far.
+
+        :param wait_until_step: If given, first waits until every snapshot of a step up to
+        and including this one is evaluated.
+        :return: The results in step order.
+        """
+        with self._condition:
+            while self._error is None and wait_until_step is not None \
+                    and self._pending_steps and self._pending_steps[0] <= wait_until_step:
+                self._condition.wait()
+            if self._error is not None:
+                raise RuntimeError('The evaluation worker failed') from self._error
+            results: List[EvaluationResult] = self._results
+            self._results = []
+        return results
+
+    def close(self) -> None:
+        """
+        Stops the worker thread once the snapshots already submitted are evaluated.
+        """
+        self._snapshots.put(None)
+        self._thread.join()
@@ -0,0 +1,258 @@
+"""
+Contains the bulk export of synthetic data: the generator is run on large batches and every batch
+is streamed into a single file, an .h5 file laid out like the input datasets (X, y and y_onehot) or
+a set of .npy files, so that only one batch is held in memory however many segments are exported.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import h5py
+import numpy as np
+
+from batch_module import NoiseGenerator
+from convert_dataset import compute_chunk_shape
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+NPY_EXTENSION = '.npy'
+
+
+@dataclass(frozen=True)
+class ExportSummary:
+    """
+    What an export wrote.
+    """
+    path: str
+    num_segments: int
+    classifier_accuracy: Optional[float] = None
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class Hdf5SampleWriter:
+    """
+    Appends batches of synthetic data to the resizable, chunked datasets X, y and y_onehot of an .h5
+    file, and y_pred, the labels the classifier predicts, if the classifier is run.
+    """
+
+    def __init__(self,
+                 path: str,
+                 num_segments: int,
+                 segment_shape: Sequence[int],
+                 num_classes: int,
+                 with_predictions: bool,
+                 compression: Optional[str] = None):
+        """
+        :param path: The path of the .h5 file, which is overwritten.
+        :param num_segments: The number of segments expected, which only sizes the chunks.
+        :param segment_shape: The shape of a segment, (seq_length, num_channels).
+        :param num_classes: The number of classes, the width of y_onehot.
+        :param with_predictions: Whether batches come with the labels predicted by the classifier.
+        :param compression: An optional HDF5 compression filter for X, e.g. "gzip" or "lzf".
+        """
+        self.paths: List[str] = [path]
+        self.h5_file: h5py.File = h5py.File(path, mode='w')
+        self.num_rows: int = 0
+        # the chunks hold whole segments, the dataset grows by any number of rows
+        chunks: tuple = compute_chunk_shape(max(1, num_segments), tuple(segment_shape),
+                                            np.dtype(np.float32).itemsize)
+        self.x_data: h5py.Dataset = self.h5_file.create_dataset('X', shape=(0,) + tuple(segment_shape),
+                                                                maxshape=(None,) + tuple(segment_shape),
+                                                                dtype=np.float32, chunks=chunks,
+                                                                compression=compression)
+        self.y_data: h5py.Dataset = self.h5_file.create_dataset('y', shape=(0,), maxshape=(None,),
+                                                                dtype=np.int64, chunks=(chunks[0],))
+        self.y_onehot_data: h5py.Dataset = self.h5_file.create_dataset('y_onehot', shape=(0, num_classes),
+                                                                       maxshape=(None, num_classes),
+                                                                       dtype=np.float32,
+                                                                       chunks=(chunks[0], num_classes))
+        self.y_pred_data: Optional[h5py.Dataset] = None
+        if with_predictions:
+            self.y_pred_data = self.h5_file.create_dataset('y_pred', shape=(0,), maxshape=(None,),
+                                                           dtype=np.int64, chunks=(chunks[0],))
+
+    def write(self, x_batch: np.ndarray, y_batch: np.ndarray, y_pred_batch: Optional[np.ndarray] = None) -> None:
+        """
+        Appends a batch.
+
+        :param x_batch: The synthetic segments.
+        :param y_batch: The class labels they were generated for.
+        :param y_pred_batch: The class labels the classifier predicts for them.
+        """
+        start: int = self.num_rows
+        self.num_rows += len(x_batch)
+        datasets: List[h5py.Dataset] = [self.x_data, self.y_data, self.y_onehot_data]
+        if self.y_pred_data is not None:
+            datasets.append(self.y_pred_data)
+        for dataset in datasets:
+            dataset.resize(self.num_rows, axis=0)
+
+        self.x_data[start:self.num_rows] = x_batch
+        self.y_data[start:self.num_rows] = y_batch
+        self.y_onehot_data[start:self.num_rows] = np.eye(self.y_onehot_data.shape[1], dtype=np.float32)[y_batch]
+        if self.y_pred_data is not None:
+            self.y_pred_data[start:self.num_rows] = y_pred_batch
+
+    def close(self, classifier_accuracy: Optional[float] = None) -> None:
+        """
+        Closes the file.
+
+        :param classifier_accuracy: The classifier accuracy over every segment, stored as an attribute.
+        """
+        if classifier_accuracy is not None:
+            self.h5_file.attrs['classifier_accuracy'] = classifier_accuracy
+        self.h5_file.close()
+
+    def abort(self) -> None:
+        """
+        Closes and deletes the incomplete file of an export that failed.
+        """
+        self.h5_file.close()
+        _remove_files(self.paths)
+
+
+class NpySampleWriter:
+    """
+    Writes batches of synthetic data into memory mapped .npy files of a known number of segments:
+    the segments to the given path and the labels next to it, to <name>_y.npy, <name>_y_onehot.npy
+    and <name>_y_pred.npy.
+    """
+
+    def __init__(self,
+                 path: str,
+                 num_segments: int,
+                 segment_shape: Sequence[int],
+                 num_classes: int,
+                 with_predictions: bool):
+        """
+        :param path: The path of the .npy file of the segments, which is overwritten.
+        :param num_segments: The number of segments exported.
+        :param segment_shape: The shape of a segment, (seq_length, num_channels).
+        :param num_classes: The number of classes, the width of y_onehot.
+        :param with_predictions: Whether batches come with the labels predicted by the classifier.
+        """
+        stem: str = path[:-len(NPY_EXTENSION)]
+        self.paths: List[str] = [path, f'{stem}_y{NPY_EXTENSION}', f'{stem}_y_onehot{NPY_EXTENSION}']
+        if with_predictions:
+            self.paths.append(f'{stem}_y_pred{NPY_EXTENSION}')
+        self.num_rows: int = 0
+        self.x_data: np.ndarray = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                                            shape=(num_segments,) + tuple(segment_shape))
+        self.y_data: np.ndarray = np.lib.format.open_memmap(f'{stem}_y{NPY_EXTENSION}', mode='w+',
+                                                            dtype=np.int64, shape=(num_segments,))
+        self.y_onehot_data: np.ndarray = np.lib.format.open_memmap(f'{stem}_y_onehot{NPY_EXTENSION}', mode='w+',
+                                                                   dtype=np.float32,
+                                                                   shape=(num_segments, num_classes))
+        self.y_pred_data: Optional[np.ndarray] = None
+        if with_predictions:
+            self.y_pred_data = np.lib.format.open_memmap(f'{stem}_y_pred{NPY_EXTENSION}', mode='w+',
+                                                         dtype=np.int64, shape=(num_segments,))
+
+    def write(self, x_batch: np.ndarray, y_batch: np.ndarray, y_pred_batch: Optional[np.ndarray] = None) -> None:
+        """
+        Writes the next batch.
+
+        :param x_batch: The synthetic segments.
+        :param y_batch: The class labels they were generated for.
+        :param y_pred_batch: The class labels the classifier predicts for them.
+        """
+        start: int = self.num_rows
+        self.num_rows += len(x_batch)
+        self.x_data[start:self.num_rows] = x_batch
+        self.y_data[start:self.num_rows] = y_batch
+        self.y_onehot_data[start:self.num_rows] = 0
+        self.y_onehot_data[np.arange(start, self.num_rows), y_batch] = 1
+        if self.y_pred_data is not None:
+            self.y_pred_data[start:self.num_rows] = y_pred_batch
+
+    def close(self, classifier_accuracy: Optional[float] = None) -> None:
+        """
+        Flushes the files. The .npy format has no room for the classifier accuracy, which is only returned.
+        """
+        for data in (self.x_data, self.y_data, self.y_onehot_data, self.y_pred_data):
+            if data is not None:
+                data.flush()
+
+    def abort(self) -> None:
+        """
+        Deletes the incomplete files of an export that failed, which are sized for every segment and
+        would otherwise look complete.
+        """
+        _remove_files(self.paths)
+
+
+def export_synthetic_data(generator,
+                          path: str,
+                          num_segments: int,
+                          class_labels: Sequence[int],
+                          num_classes: int,
+                          latent_dim: int,
+                          conditional: bool = False,
+                          classifier=None,
+                          batch_size: int = 1024,
+                          compression: Optional[str] = None,
+                          seed: Optional[int] = None) -> ExportSummary:
+    """
+    Generates synthetic segments batch by batch and streams them into a single file.
+
+    :param generator: The generator.
+    :param path: The path of the exported file, an .h5 file or an .npy file.
+    :param num_segments: The number of segments to export.
+    :param class_labels: The class labels of the segments, which are spread evenly over them. Only a
+    conditional generator can generate more than one class.
+    :param num_classes: The number of classes of the dataset.
+    :param latent_dim: The latent dimension of the generator.
+    :param conditional: Whether the generator is conditioned on the class label.
+    :param classifier: If given, the classifier is run on every batch, and its predictions and
+    accuracy are exported as well.
+    :param batch_size: The number of segments generated at once, which bounds the memory used.
+    :param compression: An optional HDF5 compression filter for X, e.g. "gzip" or "lzf".
+    :param seed: The seed of the noise, by default it is drawn from the global numpy random state.
+    :return: A summary of the export.
+    """
+    extension: str = os.path.splitext(path)[1].lower()
+    if extension not in HDF5_EXTENSIONS + (NPY_EXTENSION,):
+        raise ValueError(f'Cannot export to "{path}", expected one of {HDF5_EXTENSIONS + (NPY_EXTENSION,)}')
+    if not conditional and len(class_labels) != 1:
+        raise ValueError('Only a conditional generator can generate more than one class')
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    seq_length: int = generator.output_shape[1]
+    segment_shape: tuple = tuple(generator.output_shape[1:])
+    batch_size = max(1, min(batch_size, num_segments))
+    noise_generator: NoiseGenerator = NoiseGenerator((batch_size, seq_length, latent_dim), np.random.default_rng(
+        np.random.randint(0, 2 ** 31) if seed is None else seed))
+    labels: np.ndarray = np.asarray(class_labels, dtype=np.int64)
+
+    writer = Hdf5SampleWriter(path, num_segments, segment_shape, num_classes, classifier is not None, compression) \
+        if extension in HDF5_EXTENSIONS \
+        else NpySampleWriter(path, num_segments, segment_shape, num_classes, classifier is not None)
+    num_correct: int = 0
+    try:
+        for start in range(0, num_segments, batch_size):
+            size: int = min(batch_size, num_segments - start)
+            noise: np.ndarray = noise_generator.next()[:size]
+            y_batch: np.ndarray = labels[np.arange(start, start + size) % len(labels)]
+            x_batch: np.ndarray = np.asarray(generator.predict_on_batch(
+                [noise, y_batch.astype(np.int32)[:, np.newaxis]] if conditional else noise))
+
+            y_pred_batch: Optional[np.ndarray] = None
+            if classifier is not None:
+                y_pred_batch = np.argmax(classifier.predict_on_batch(x_batch), axis=-1)
+                num_correct += int(np.sum(y_pred_batch == y_batch))
+            writer.write(x_batch, y_batch, y_pred_batch)
+    except BaseException:
+        # an incomplete export is not left behind, nor stamped with the accuracy of the segments written so far
+        writer.abort()
+        raise
+
+    classifier_accuracy: Optional[float] = num_correct / num_segments if classifier is not None else None
+    writer.close(classifier_accuracy)
+
+    return ExportSummary(path=path, num_segments=num_segments, classifier_accuracy=classifier_accuracy)
@@ -1,118 +1,419 @@
 import os
-from typing import Tuple
+import time
+from dataclasses import asdict
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
+import tensorflow as tf
 from keras.engine.functional import Functional
-from keras.models import Model, load_model, Functional
+from keras.models import Model, load_model, clone_model, Functional
+from keras.utils.np_utils import to_categorical
 from numpy import ndarray
 from sklearn.metrics import accuracy_score
 
+import checkpoint_module
 import input_module
 import models
 import saving_module as save
-import train_simple_lstm
 import training_module
 import training_module as train
 import model_critique_functions as critique
-import plotting_module
-from data.model_data_storage import TrainingParameters, Weights, Names, ModelData, Empty
+from batch_module import BatchSource, NoiseGenerator, TrainingBatch, GRAPH_NOISE, NOISE_SOURCES
+from caching_module import ArrayCache, function_fingerprint
+from checkpoint_module import Checkpoint, CheckpointWriter, StoredCheckpoint, TrainingState, CHECKPOINT_METRICS
+from compute_similarity_metrics import RealSimilarityEngine, SimilarityDistribution, \
+    compute_pairwise_similarity_distribution, EXHAUSTIVE_MODE
+from data.model_data_storage import TrainingParameters, Weights, Names, ModelData, Empty, CacheSettings
+from evaluation_module import EvaluationResult, EvaluationWorker, WeightsSnapshot
+from export_module import ExportSummary, export_synthetic_data
 from input_module import InputModuleConfiguration
+from instrumentation_module import phase
+from metrics_module import MetricsRow, MetricsSink, config_hash, latest_unfinished_run
+from stopping_module import StopDecision
 from training_module import train_tstr_classifier
 
 
 class GanModel:
-    feature_net: Functional
-    discriminator_model: Functional
-    discriminator: Functional
     generator: Functional
-    num_classes: int
     input_shape: Tuple[int, int]
     num_channels: int
     seq_length: int
-    num_seqs: int
-    classifier: Functional
     write_train_results: bool
     request_save: bool
     model_save_directory: str
     class_label: int
-    input_data: ndarray
     training_parameters: TrainingParameters
 
     def __init__(self, training_param: TrainingParameters,
                  weight: Weights,
                  name: Names,
                  model_data: ModelData,
-                 config: str,
+                 config: Union[str, InputModuleConfiguration],
                  load_pretrained: bool = False,
                  ignore_classifier: bool = False,
-                 ignore_sfd: bool = False):
+                 ignore_sfd: bool = False,
+                 cache_settings: CacheSettings = CacheSettings(),
+                 input_data: Optional[ndarray] = None,
+                 num_classes: Optional[int] = None,
+                 classifier: Optional[Functional] = None,
+                 class_labels: Optional[ndarray] = None):
         """
         Constructs a new GAN model from the given training parameters, weights, and names.
+        Only the generator is built right away: the dataset, the classifier, the discriminator and
+        the training architecture are loaded and built on first use, so a model that only generates
+        data from a pre-trained generator reads nothing but the generator file.
 
         :param training_param: The training parameters.
         :param weight: The weights.
         :param name: The name.
-        :param config: The configuration file.
+        :param config: The .toml configuration file, or the configuration it holds.
         :param load_pretrained: Whether to use a pretrained GAN
         :param ignore_classifier: Whether to ignore the effect of the classifier in training the GAN
         :param ignore_sfd: Whether to ignore the effect of SFD regularization in training the GAN
+        :param cache_settings: Where and whether to cache values derived from the dataset.
+        :param input_data: The data of the class, if it is already loaded, in which case num_classes
+        has to be given as well.
+        :param num_classes: The number of classes of the dataset.
+        :param classifier: The classifier, if it is already loaded. The GCD model trains it, so it
+        must not be shared with another GAN model.
+        :param class_labels: The class labels of input_data, which a conditional GAN is trained on
+        every class of, if the data is already loaded.
         """
         self.training_parameters = training_param
         self.weights: Weights = weight
         self.names: Names = name
         self.ignore_classifier: bool = ignore_classifier
         self.ignore_sfd: bool = ignore_sfd
+        self.cache_settings: CacheSettings = cache_settings
+        self.model_data: ModelData = model_data
 
         # grab the file data and relevant information
-        input_file_config: InputModuleConfiguration = input_module.parse_input_file(config)
+        input_file_config: InputModuleConfiguration = config if isinstance(config, InputModuleConfiguration) \
+            else input_module.parse_input_file(config)
         self.class_label = input_file_config.class_label
+        self.data_file_path = input_file_config.data_file_path
+        self.classifier_path = input_file_config.classifier_path
+        self.memory_map: bool = input_file_config.memory_map
         self.model_save_directory = input_file_config.save_directory
         self.request_save = input_file_config.request_save
         self.write_train_results = input_file_config.write_train_results
+        self.results_directory = input_file_config.results_directory
+        self.checkpoint_directory = input_file_config.checkpoint_directory
+        self.metrics_database: str = os.path.join(self.results_directory, input_file_config.metrics_database)
+        self._metrics_sink: Optional[MetricsSink] = None
+        self._resumed: bool = False
         self.generator_save_location = model_data.generator_filename
         self.discriminator_save_location = model_data.discriminator_filename
 
-        y: ndarray
-        y_onehot: ndarray
-        self.input_data, y, y_onehot = input_module.load_data(input_file_config.data_file_path, self.class_label)
+        if training_param.train_step not in train.TRAIN_STEPS:
+            raise ValueError(f'Unknown train step "{training_param.train_step}", expected one of {train.TRAIN_STEPS}')
+        if training_param.noise_source not in NOISE_SOURCES:
+            raise ValueError(f'Unknown noise source "{training_param.noise_source}", expected one of {NOISE_SOURCES}')
+        if training_param.noise_source == GRAPH_NOISE and training_param.train_step != train.COMPILED_TRAIN_STEP:
+            raise ValueError(f'The noise can only be sampled on-graph by the '
+                             f'"{train.COMPILED_TRAIN_STEP}" train step')
+        if training_param.checkpoint_interval_steps > 0 and training_param.checkpoint_metric not in CHECKPOINT_METRICS:
+            raise ValueError(f'Unknown checkpoint metric "{training_param.checkpoint_metric}", '
+                             f'expected one of {list(CHECKPOINT_METRICS)}')
 
-        # load the pre-trained classifier (note that we are not preparing it for training by compiling it)
-        self.classifier = load_model(input_file_config.classifier_path,
-                                     compile=False)
-        self.classifier._name = self.names.classifier_name
+        # a conditional GAN is trained on every class at once, and the class label of the
+        # .toml file only selects the class of the generated samples
+        self.conditional: bool = training_param.conditional
 
-        # set variables regarding the data shape
-        self.num_seqs = self.input_data.shape[0]
-        self.seq_length = self.input_data.shape[1]
-        self.num_channels = self.input_data.shape[2]
+        # the components below are built on first use by the properties of the same name
+        self._input_data: Optional[ndarray] = input_data
+        self._labels: Optional[ndarray] = None
+        if input_data is not None and self.conditional:
+            self._labels = np.asarray(class_labels).reshape(-1)
+        self._num_classes: Optional[int] = num_classes
+        self._present_classes: Optional[ndarray] = None
+        self._classifier: Optional[Functional] = None
+        if classifier is not None:
+            # the GCD model refers to the classifier by its name
+            self._classifier = classifier
+            self._classifier._name = self.names.classifier_name
+        self._metric_classifier: Optional[Functional] = None
+        self._discriminator: Optional[Functional] = None
+        self._feature_net: Optional[Functional] = None
+        self._real_feature_mean: Optional[ndarray] = None
+        self._synthetic_data_train: Optional[ndarray] = None
+        self._similarity_engine: Optional[RealSimilarityEngine] = None
+        self._class_similarity_engines: Optional[Dict[int, RealSimilarityEngine]] = None
+        self._evaluation_classes: Optional[ndarray] = None
+        self._probe_classes: Optional[ndarray] = None
+        self._training_architecture_built: bool = False
+        self._batch_source: Optional[BatchSource] = None
+
+        # check whether or not there is a pre-trained generator requested in the config file,
+        # the shape of the data is then that of its output, otherwise that of the dataset
+        self.pretrained: bool = load_pretrained and not isinstance(model_data, Empty) and model_data.exists
+        if self.pretrained:
+            with phase('GanModel.generator'):
+                self.generator = load_model(os.path.join(model_data.directory, model_data.generator_filename),
+                                            compile=False)
+            self.seq_length, self.num_channels = self.generator.output_shape[1:]
+        else:
+            self.seq_length, self.num_channels = self.input_data.shape[1:]
+            with phase('GanModel.generator'):
+                self.generator = self._create_generator()
         self.input_shape = (self.seq_length, self.num_channels)
-        self.num_classes = y_onehot.shape[1]
-
-        self.metric_classifier = train_simple_lstm.\
-            create_classifier_model(self.num_classes)
-        self.metric_classifier._name = "TSTR Classifier"
-
-        # check whether or not there are models requested in the config file
-        if isinstance(model_data, Empty) or not model_data.exists:
-            # create the generator
-            self.generator = self._create_generator()
-            self.discriminator = self._create_discriminator()
-        elif load_pretrained:
-            self.generator, self.discriminator = self._load_pretrained_model(
-                generator_path=model_data.generator_filename,
-                discriminator_path=model_data.discriminator_filename,
-                directory=model_data.directory)
-
-        self.discriminator_model = models \
-            .compile_discriminator_model(discriminator=self.discriminator,
-                                         learning_rate=training_param.discriminator_learning_rate)
-
-        # create the statistical feature network and compute the feature vector for the real data
-        # this is used in the loss function
-        self.feature_net = self._create_feature_net()
-        self.synthetic_data_train = self._train_synthetic_data()
-        self.synthetic_data_test = self._test_generated_data()
-        self._create_architecture(discriminator_to_freeze=self.discriminator)
+
+        # the noise of the evaluation batches, drawn either into a reused host buffer or on-graph
+        self.evaluation_noise: Optional[NoiseGenerator] = None
+        self.probe_noise: Optional[NoiseGenerator] = None
+        self.graph_synthetic_data = None
+        self.graph_noise_generator: Optional[tf.random.Generator] = None
+        if training_param.noise_source == GRAPH_NOISE:
+            self.graph_noise_generator = tf.random.Generator.from_seed(np.random.randint(0, 2 ** 31))
+            self.graph_synthetic_data = train.create_graph_synthetic_data_function(
+                generator=self.generator,
+                latent_dim=training_param.latent_dimension,
+                time_steps=self.seq_length,
+                noise_generator=self.graph_noise_generator)
+        else:
+            self.evaluation_noise = NoiseGenerator((training_param.test_size, self.seq_length,
+                                                    training_param.latent_dimension),
+                                                   np.random.default_rng(np.random.randint(0, 2 ** 31)))
+            if training_param.probe_size > 0:
+                self.probe_noise = NoiseGenerator((training_param.probe_size, self.seq_length,
+                                                   training_param.latent_dimension),
+                                                  np.random.default_rng(np.random.randint(0, 2 ** 31)))
+
+    def _load_data(self) -> None:
+        """
+        Loads the real data of the class, or of every class for a conditional GAN.
+        """
+        with phase('input_module.load_data'):
+            if self.conditional:
+                self._input_data, self._labels, self._num_classes = \
+                    input_module.load_labelled_data(self.data_file_path)
+            else:
+                self._input_data, _, self._num_classes = input_module.load_data(self.data_file_path,
+                                                                                self.class_label,
+                                                                                memory_map=self.memory_map)
+
+    @property
+    def input_data(self) -> ndarray:
+        """
+        The real data, loaded on first use.
+        """
+        if self._input_data is None:
+            self._load_data()
+        return self._input_data
+
+    @property
+    def labels(self) -> Optional[ndarray]:
+        """
+        The class labels of the real data of a conditional GAN, None otherwise.
+        """
+        if self.conditional and self._labels is None:
+            self._load_data()
+        return self._labels
+
+    @property
+    def num_classes(self) -> int:
+        """
+        The number of classes of the dataset, which is read without loading the data.
+        """
+        if self._num_classes is None:
+            self._num_classes = input_module.read_num_classes(self.data_file_path)
+        return self._num_classes
+
+    @property
+    def num_seqs(self) -> int:
+        return self.input_data.shape[0]
+
+    @property
+    def present_classes(self) -> ndarray:
+        """
+        The classes a conditional GAN has real data of.
+        """
+        if self._present_classes is None:
+            self._present_classes = np.unique(self.labels)
+        return self._present_classes
+
+    @property
+    def classifier(self) -> Functional:
+        """
+        The pre-trained classifier, loaded on first use (note that we are not preparing it for training by compiling it).
+        """
+        if self._classifier is None:
+            with phase('GanModel.classifier'):
+                self._classifier = load_model(self.classifier_path, compile=False)
+            self._classifier._name = self.names.classifier_name
+        return self._classifier
+
+    @property
+    def metric_classifier(self) -> Functional:
+        """
+        The classifier trained on synthetic data to compute the TSTR metric.
+        """
+        if self._metric_classifier is None:
+            import train_simple_lstm
+
+            self._metric_classifier = train_simple_lstm.create_classifier_model(self.num_classes)
+            self._metric_classifier._name = "TSTR Classifier"
+        return self._metric_classifier
+
+    @property
+    def discriminator(self) -> Functional:
+        """
+        The discriminator, the pre-trained one if the generator is pre-trained.
+        """
+        if self._discriminator is None:
+            with phase('GanModel.discriminator'):
+                if self.pretrained:
+                    self._discriminator = load_model(os.path.join(self.model_data.directory,
+                                                                  self.model_data.discriminator_filename))
+                else:
+                    self._discriminator = self._create_discriminator()
+        return self._discriminator
+
+    @property
+    def similarity_engine(self) -> Optional[RealSimilarityEngine]:
+        """
+        The normalized real data for all of the rts computations, None for a conditional GAN.
+        """
+        if self._similarity_engine is None and not self.conditional:
+            with phase('GanModel.similarity_engine'):
+                self._similarity_engine = RealSimilarityEngine(
+                    self.input_data, chunk_size=self.training_parameters.similarity_chunk_size)
+        return self._similarity_engine
+
+    @property
+    def class_similarity_engines(self) -> Dict[int, RealSimilarityEngine]:
+        """
+        For a conditional GAN, the normalized real data of every class, as the synthetic data of
+        a class is compared to the real data of the same class.
+        """
+        if self._class_similarity_engines is None:
+            self._class_similarity_engines = {}
+            if self.conditional:
+                for label in self.present_classes.tolist():
+                    self._class_similarity_engines[label] = RealSimilarityEngine(
+                        input_module.select_class(self.input_data, self.labels, label)[0],
+                        chunk_size=self.training_parameters.similarity_chunk_size)
+        return self._class_similarity_engines
+
+    @property
+    def feature_net(self) -> Functional:
+        """
+        The statistical feature network, which is used in the loss function.
+        """
+        if self._feature_net is None:
+            self._feature_net = self._create_feature_net()
+        return self._feature_net
+
+    @property
+    def real_feature_mean(self) -> ndarray:
+        """
+        The mean statistical feature vector of the real data, see _compute_real_feature_mean.
+        """
+        if self._real_feature_mean is None:
+            with phase('GanModel.real_feature_mean'):
+                self._real_feature_mean = self._compute_real_feature_mean()
+        return self._real_feature_mean
+
+    @property
+    def synthetic_data_train(self) -> Optional[ndarray]:
+        """
+        The SFN targets of a training batch, None for a conditional GAN, whose targets depend on the batch.
+        """
+        if self._synthetic_data_train is None and not self.conditional:
+            with phase('GanModel.synthetic_data_train'):
+                self._synthetic_data_train = self._train_synthetic_data()
+        return self._synthetic_data_train
+
+    @property
+    def evaluation_classes(self) -> Optional[ndarray]:
+        """
+        The classes of the test_size segments a conditional GAN is evaluated on, spread evenly over the classes.
+        """
+        if self._evaluation_classes is None and self.conditional:
+            self._evaluation_classes = self.present_classes[np.arange(self.training_parameters.test_size)
+                                                            % len(self.present_classes)].astype(np.int32)[:, np.newaxis]
+        return self._evaluation_classes
+
+    @property
+    def probe_classes(self) -> Optional[ndarray]:
+        """
+        The classes of the probe_size segments of the probe of a conditional GAN.
+        """
+        if self._probe_classes is None and self.conditional:
+            self._probe_classes = self.present_classes[np.arange(self.training_parameters.probe_size)
+                                                       % len(self.present_classes)].astype(np.int32)[:, np.newaxis]
+        return self._probe_classes
+
+    def _build_training_architecture(self) -> None:
+        """
+        Builds what only training needs: the compiled discriminator, the GCD model and the compiled train step.
+        """
+        if self._training_architecture_built:
+            return
+        with phase('GanModel.training_architecture'):
+            self._discriminator_model: Functional = models \
+                .compile_discriminator_model(discriminator=self.discriminator,
+                                             learning_rate=self.training_parameters.discriminator_learning_rate)
+
+            # the discriminator variables have to be captured before the discriminator is frozen
+            self._discriminator_variables: list = list(self.discriminator.trainable_variables)
+            self._create_architecture(discriminator_to_freeze=self.discriminator)
+            self._class_targets: ndarray = to_categorical([self.class_label] * self.training_parameters.batch_size,
+                                                          num_classes=self.num_classes)
+
+            self._compiled_train_step = None
+            if self.training_parameters.train_step == train.COMPILED_TRAIN_STEP:
+                self._compiled_train_step = train.create_compiled_train_step(
+                    generator=self.generator,
+                    discriminator_model=self._discriminator_model,
+                    discriminator_variables=self._discriminator_variables,
+                    gcd_model=self._GCD,
+                    weights=self.weights,
+                    ignore_classifier=self.ignore_classifier,
+                    ignore_sfd=self.ignore_sfd,
+                    jit_compile=self.training_parameters.jit_compile,
+                    noise_generator=self.graph_noise_generator)
+        self._training_architecture_built = True
+
+    @property
+    def discriminator_model(self) -> Functional:
+        """
+        The compiled discriminator, built with the rest of the training architecture on first use.
+        """
+        self._build_training_architecture()
+        return self._discriminator_model
+
+    @property
+    def discriminator_variables(self) -> list:
+        """
+        The trainable variables of the discriminator, as they were before it was frozen in the GCD model.
+        """
+        self._build_training_architecture()
+        return self._discriminator_variables
+
+    @property
+    def GCD(self) -> Functional:
+        """
+        The generator feeding the discriminator, the classifier and the statistical feature network.
+        """
+        self._build_training_architecture()
+        return self._GCD
+
+    @property
+    def class_targets(self) -> ndarray:
+        """
+        The classifier targets of a training batch.
+        """
+        self._build_training_architecture()
+        return self._class_targets
+
+    @property
+    def compiled_train_step(self):
+        """
+        The compiled train step, None with the legacy train step.
+        """
+        self._build_training_architecture()
+        return self._compiled_train_step
 
     def _create_generator(self) -> Functional:
         """
@@ -120,6 +421,12 @@ class GanModel:
 
         :return:A generator as a Keras Functional object.
         """
+        if self.conditional:
+            return models.create_conditional_generator(seq_length=self.seq_length,
+                                                       num_channels=self.num_channels,
+                                                       latent_dim=self.training_parameters.latent_dimension,
+                                                       num_classes=self.num_classes,
+                                                       embedding_dim=self.training_parameters.class_embedding_dim)
         return models.create_generator(seq_length=self.seq_length,
                                        num_channels=self.num_channels,
                                        latent_dim=self.training_parameters.latent_dimension)
@@ -130,6 +437,11 @@ class GanModel:
 
         :return: A discriminator as a Keras Functional object.
         """
+        if self.conditional:
+            return models.create_conditional_discriminator(seq_length=self.seq_length,
+                                                           num_channels=self.num_channels,
+                                                           num_classes=self.num_classes,
+                                                           embedding_dim=self.training_parameters.class_embedding_dim)
         return models.create_discriminator(seq_length=self.seq_length, num_channels=self.num_channels)
 
     def _create_feature_net(self) -> Functional:
@@ -142,39 +454,56 @@ class GanModel:
                                                      num_channels=self.num_channels,
                                                      num_features=self.training_parameters.num_features)
 
-    def _train_synthetic_data(self) -> ndarray:
+    def _compute_real_feature_mean(self) -> ndarray:
         """
-        Trains synthetic data.
+        Computes the mean statistical feature vector of the real data, which is the target
+        of the SFD loss. This needs a pass over the whole class, so the result is cached on
+        disk, keyed by the dataset, class label, number of features and the definition of
+        the statistical features. A conditional GAN has a target for every class.
 
-        :return: A numpy array of trained synthetic data.
+        :return: A numpy array of shape (num_channels * num_features,), or of shape
+        (num_classes, num_channels * num_features) for a conditional GAN.
         """
-        return np.repeat(
-            np.reshape(
-                np.mean(
-                    self.feature_net.predict(
-                        self.input_data,
-                        self.training_parameters.batch_size
-                    ),
-                    axis=0),
-                (1, self.num_channels * self.training_parameters.num_features)),
-            self.training_parameters.batch_size, axis=0)
+        cache: Optional[ArrayCache] = None
+        cache_key: str = ''
+        if self.cache_settings.enabled:
+            cache = ArrayCache(os.path.join(self.cache_settings.directory, 'features'),
+                               self.cache_settings.max_size_mb * 1024 * 1024)
+            cache_key = cache.make_key(dataset=cache.dataset_fingerprint(self.data_file_path),
+                                       class_label='all' if self.conditional else self.class_label,
+                                       num_features=self.training_parameters.num_features,
+                                       features=function_fingerprint(critique.compute_statistical_features))
+            cached_mean: Optional[ndarray] = cache.load(cache_key)
+            if cached_mean is not None:
+                return cached_mean
+
+        real_feature_mean: ndarray
+        if self.conditional:
+            real_feature_mean = np.zeros((self.num_classes, self.num_channels * self.training_parameters.num_features),
+                                         dtype=np.float32)
+            for label in self.present_classes.tolist():
+                real_feature_mean[label] = critique.compute_mean_statistical_features(
+                    input_module.select_class(self.input_data, self.labels, label)[0],
+                    self.training_parameters.num_features)
+        else:
+            real_feature_mean = critique.compute_mean_statistical_features(
+                self.input_data,
+                self.training_parameters.num_features)
 
-    def _test_generated_data(self) -> ndarray:
+        if cache is not None:
+            cache.store(cache_key, real_feature_mean)
+        return real_feature_mean
+
+    def _train_synthetic_data(self) -> ndarray:
         """
-        Tests the generated data.
+        Trains synthetic data.
 
-        :return: A numpy array of tested data.
+        :return: A numpy array of trained synthetic data.
         """
         return np.repeat(
-            np.reshape(
-                np.mean(
-                    self.feature_net.predict(
-                        self.input_data,
-                        self.training_parameters.batch_size
-                    ),
-                    axis=0),
-                (1, self.num_channels * self.training_parameters.num_features)),
-            self.training_parameters.test_size, axis=0)
+            np.reshape(self.real_feature_mean,
+                       (1, self.num_channels * self.training_parameters.num_features)),
+            self.training_parameters.batch_size, axis=0)
 
     def _create_architecture(self, discriminator_to_freeze: Functional) -> None:
         """
@@ -195,95 +524,450 @@ class GanModel:
         if self.ignore_sfd:
             model_loss['SFN'] = train.null_loss
 
-        self.GCD: Functional = Model(inputs=self.generator.input,
-                                     outputs=[discriminator_to_freeze(self.generator.output),
-                                              self.classifier(self.generator.output),
-                                              self.feature_net(self.generator.output)])
+        # a conditional discriminator judges the synthetic data for the class it was generated for
+        discriminator_input = [self.generator.output, self.generator.input[1]] if self.conditional \
+            else self.generator.output
+        self._GCD: Functional = Model(inputs=self.generator.input,
+                                      outputs=[discriminator_to_freeze(discriminator_input),
+                                               self.classifier(self.generator.output),
+                                               self.feature_net(self.generator.output)])
 
-        self.GCD.compile(loss=model_loss,
-                         optimizer='adam', metrics={'D': 'accuracy', 'C': 'accuracy'},
-                         loss_weights={'D': self.weights.discriminator_loss_weight,
-                                       'C': self.weights.classifier_loss_weight,
-                                       'SFN': self.weights.sfd_loss_weight})
+        self._GCD.compile(loss=model_loss,
+                          optimizer='adam', metrics={'D': 'accuracy', 'C': 'accuracy'},
+                          loss_weights={'D': self.weights.discriminator_loss_weight,
+                                        'C': self.weights.classifier_loss_weight,
+                                        'SFN': self.weights.sfd_loss_weight})
 
-    def train_discriminator(self) -> Tuple[np.float, np.float]:
+    @property
+    def batch_source(self) -> BatchSource:
         """
-        Trains the discriminator. Mutates the discriminator and the generator.
+        The source of training batches, created on first use so that a model that is only
+        used for generating data never starts the prefetching thread.
+        """
+        if self._batch_source is None:
+            self._batch_source = BatchSource(self.input_data,
+                                             batch_size=self.training_parameters.batch_size,
+                                             latent_dim=self.training_parameters.latent_dimension,
+                                             prefetch_batches=self.training_parameters.prefetch_batches,
+                                             noise_source=self.training_parameters.noise_source,
+                                             class_labels=self.labels)
+        return self._batch_source
 
-        :return: The discriminator accuracy and the generator accuracy as a tuple in the following form
-        (numpy array, numpy array).
+    def train_step(self) -> train.TrainingStepResult:
         """
-        discriminator_loss_vector: list = train \
-            .train_discriminator(batch_size=self.training_parameters.batch_size,
-                                 input_data=self.input_data,
-                                 generator_model=self.generator,
-                                 discriminator_model=self.discriminator_model,
-                                 latent_dim=self.training_parameters.latent_dimension)
+        Trains the discriminator and then the generator on one batch, either through
+        train_on_batch of the Keras models or through the compiled train step,
+        depending on the train_step training parameter.
 
-        GCD_loss_vec: list = train.train_generator(batch_size=self.training_parameters.batch_size,
-                                                   input_data=self.input_data,
-                                                   class_label=self.class_label,
-                                                   actual_features=self.synthetic_data_train,
-                                                   num_labels=self.num_classes,
-                                                   model=self.GCD,
-                                                   latent_dim=self.training_parameters.latent_dimension)
+        :return: The loss vectors of the discriminator and the GCD model.
+        """
+        with phase('batch_wait'):
+            batch: TrainingBatch = self.batch_source.next()
+        class_targets: ndarray = self.class_targets
+        feature_targets: ndarray = self.synthetic_data_train
+        if self.conditional:
+            # the targets of the classifier and of the SFN follow the class of every generated segment
+            generator_classes: ndarray = batch.generator_classes[:, 0]
+            class_targets = to_categorical(generator_classes, num_classes=self.num_classes)
+            feature_targets = self.real_feature_mean[generator_classes]
+
+        if self.compiled_train_step is not None:
+            with phase('compiled_train_step'):
+                discriminator_losses, generator_losses = self.compiled_train_step(batch.real_data,
+                                                                                  batch.discriminator_noise,
+                                                                                  batch.generator_noise,
+                                                                                  class_targets,
+                                                                                  feature_targets,
+                                                                                  batch.discriminator_classes,
+                                                                                  batch.generator_classes)
+                return train.TrainingStepResult(discriminator_losses=discriminator_losses.numpy().tolist(),
+                                                generator_losses=generator_losses.numpy().tolist())
 
-        # accuracy for the discriminator during its "turn" for training
-        discriminator_accuracy: np.float = discriminator_loss_vector[1]
+        discriminator_loss_vector: list = train.train_discriminator(batch=batch,
+                                                                    generator_model=self.generator,
+                                                                    discriminator_model=self.discriminator_model)
 
-        # accuracy for the generator in tricking discriminator
-        gen_accuracy: np.float = GCD_loss_vec[4]
+        GCD_loss_vec: list = train.train_generator(batch=batch,
+                                                   class_labels=class_targets,
+                                                   actual_features=feature_targets,
+                                                   model=self.GCD)
 
-        return discriminator_accuracy, gen_accuracy
+        return train.TrainingStepResult(discriminator_losses=list(discriminator_loss_vector),
+                                        generator_losses=list(GCD_loss_vec))
 
-    def generate_synthetic_data(self) -> Tuple[ndarray, float]:
+    def stop_training(self) -> None:
+        """
+        Stops the background preparation of training batches.
+        """
+        if self._batch_source is not None:
+            self._batch_source.close()
+            self._batch_source = None
+
+    def train_discriminator(self) -> Tuple[np.float, np.float]:
+        """
+        Trains the discriminator. Mutates the discriminator and the generator.
+
+        :return: The discriminator accuracy and the generator accuracy as a tuple in the following form
+        (numpy array, numpy array).
+        """
+        step_result: train.TrainingStepResult = self.train_step()
+        return step_result.discriminator_accuracy, step_result.generator_discriminator_accuracy
+
+    def generate_synthetic_data(self,
+                                generator: Optional[Functional] = None,
+                                classifier: Optional[Functional] = None,
+                                noise_generator: Optional[NoiseGenerator] = None,
+                                classes: Optional[ndarray] = None,
+                                classify: bool = True) -> Tuple[ndarray, Optional[float]]:
         """
         Generates synthetic data.
 
+        :param generator: A copy of the generator to use instead of the generator being trained.
+        :param classifier: A copy of the classifier to use instead of the classifier of the GCD model.
+        :param noise_generator: The noise generator of the copy of the generator, which has to be
+        of the shape (test_size, seq_length, latent_dim).
+        :param classes: For a conditional GAN, the class labels of the shape (test_size, 1) to generate
+        data for, by default test_size segments spread evenly over the classes.
+        :param classify: Whether to run the classifier on the synthetic data, otherwise the accuracy is None.
         :return: Synthetic data that has been generated as a tuple containing the synthetic data
         and the accuracy of the generator class in the following form (numpy array, float).
         """
-        syn_data: ndarray = train.generate_synthetic_data(size=self.training_parameters.test_size,
-                                                          generator=self.generator,
-                                                          latent_dim=self.training_parameters.latent_dimension,
-                                                          time_steps=self.seq_length)
+        if self.conditional and classes is None:
+            classes = self.evaluation_classes
 
-        pred: ndarray = np.argmax(self.classifier.predict(syn_data), axis=-1)
-        true: list = [self.class_label] * self.training_parameters.test_size
+        syn_data: ndarray
+        if generator is None and self.graph_synthetic_data is not None:
+            with phase('generator.predict'):
+                syn_data = self.graph_synthetic_data(tf.constant(self.training_parameters.test_size),
+                                                     None if classes is None else tf.constant(classes)).numpy()
+        else:
+            syn_data = train.generate_synthetic_data(size=self.training_parameters.test_size,
+                                                     generator=generator or self.generator,
+                                                     latent_dim=self.training_parameters.latent_dimension,
+                                                     time_steps=self.seq_length,
+                                                     noise_generator=noise_generator if generator is not None
+                                                     else self.evaluation_noise,
+                                                     classes=classes)
+        if not classify:
+            return syn_data, None
+
+        with phase('classifier.predict'):
+            pred: ndarray = np.argmax((classifier or self.classifier).predict(syn_data), axis=-1)
+        true: list = [self.class_label] * self.training_parameters.test_size if classes is None \
+            else classes.reshape(-1).tolist()
         gen_class_acc: float = accuracy_score(true, pred)
 
         return syn_data, gen_class_acc
 
+    def generate_class_samples(self, classify: bool = True) -> Tuple[ndarray, Optional[float]]:
+        """
+        Generates test_size synthetic segments of the class label of the .toml file, which for a
+        conditional GAN is one of the classes its generator serves.
+
+        :param classify: Whether to run the classifier, which is then loaded if it is not yet.
+        :return: A tuple of the synthetic data and the classifier accuracy on it, None if it was not run.
+        """
+        classes: Optional[ndarray] = None
+        if self.conditional:
+            classes = np.full((self.training_parameters.test_size, 1), self.class_label, dtype=np.int32)
+        return self.generate_synthetic_data(classes=classes, classify=classify)
+
+    def export_synthetic_data(self,
+                              path: str,
+                              num_segments: int,
+                              class_labels: Optional[List[int]] = None,
+                              classify: bool = True,
+                              batch_size: int = 1024,
+                              compression: Optional[str] = None) -> ExportSummary:
+        """
+        Streams a large number of synthetic segments into a single .h5 or .npy file, see export_module.
+
+        :param path: The path of the exported file.
+        :param num_segments: The number of segments to export.
+        :param class_labels: The class labels to generate segments of, by default the class label of
+        the .toml file. Only a conditional GAN can generate more than one class.
+        :param classify: Whether to run the classifier and export its predictions and accuracy.
+        :param batch_size: The number of segments generated at once.
+        :param compression: An optional HDF5 compression filter for the segments.
+        :return: A summary of the export.
+        """
+        return export_synthetic_data(self.generator,
+                                     path,
+                                     num_segments,
+                                     class_labels=class_labels or [self.class_label],
+                                     num_classes=self.num_classes,
+                                     latent_dim=self.training_parameters.latent_dimension,
+                                     conditional=self.conditional,
+                                     classifier=self.classifier if classify else None,
+                                     batch_size=batch_size,
+                                     compression=compression)
+
+    def probe_classifier_accuracy(self) -> float:
+        """
+        A cheap estimate of the classifier accuracy on synthetic data, on probe_size segments and
+        without any of the other metrics, meant for the steps in between full evaluations.
+
+        :return: The fraction of synthetic segments the classifier labels with the class label
+        they were generated for.
+        """
+        if self.probe_noise is not None:
+            noise: ndarray = self.probe_noise.next()
+            syn_data: ndarray = self.generator.predict_on_batch(noise if self.probe_classes is None
+                                                                else [noise, self.probe_classes])
+        else:
+            syn_data = self.graph_synthetic_data(tf.constant(self.training_parameters.probe_size),
+                                                 None if self.probe_classes is None
+                                                 else tf.constant(self.probe_classes)).numpy()
+        pred: ndarray = np.argmax(self.classifier.predict_on_batch(syn_data), axis=-1)
+        true = self.class_label if self.probe_classes is None else self.probe_classes.reshape(-1)
+        return float(np.mean(pred == true))
+
+    def evaluate(self,
+                 step: int,
+                 generator: Optional[Functional] = None,
+                 classifier: Optional[Functional] = None,
+                 noise_generator: Optional[NoiseGenerator] = None) -> EvaluationResult:
+        """
+        Runs the full evaluation: generates test_size synthetic segments and computes the
+        classifier accuracy, the rts and sts similarity and the SFD on them.
+
+        :param step: The training step the evaluation belongs to.
+        :param generator: A copy of the generator to evaluate instead of the generator being trained.
+        :param classifier: A copy of the classifier to use instead of the classifier of the GCD model.
+        :param noise_generator: The noise generator of the copy of the generator.
+        :return: The evaluation result.
+        """
+        start: float = time.perf_counter()
+        with phase('GanModel.evaluate'):
+            syn_data, gen_class_acc = self.generate_synthetic_data(generator, classifier, noise_generator)
+            mean_rts_similarity, mean_sts_similarity = self.compute_rts_sts(syn_data, self.evaluation_classes)
+            sts_distribution: Optional[SimilarityDistribution] = None
+            if self.training_parameters.sts_mode == EXHAUSTIVE_MODE:
+                sts_distribution = self.compute_sts_distribution(syn_data)
+            return EvaluationResult(step=step,
+                                    synthetic_data=syn_data,
+                                    classifier_accuracy=gen_class_acc,
+                                    mean_rts_similarity=mean_rts_similarity,
+                                    mean_sts_similarity=mean_sts_similarity,
+                                    statistical_feature_distance=self.compute_statistical_feature_distance(
+                                        syn_data, self.evaluation_classes),
+                                    sts_distribution=sts_distribution,
+                                    seconds=time.perf_counter() - start)
+
+    def snapshot_weights(self, step: int) -> WeightsSnapshot:
+        """
+        Copies the current weights of the generator and of the classifier, which the GCD model trains as well.
+
+        :param step: The training step the weights belong to.
+        :return: The snapshot of the weights.
+        """
+        return WeightsSnapshot(step=step,
+                               generator_weights=self.generator.get_weights(),
+                               classifier_weights=self.classifier.get_weights())
+
+    def create_evaluation_worker(self) -> EvaluationWorker:
+        """
+        Creates a worker which evaluates weight snapshots on a background thread, concurrently with
+        further training. It evaluates private copies of the generator and of the classifier.
+
+        :return: The evaluation worker.
+        """
+        generator: Functional = clone_model(self.generator)
+        classifier: Functional = clone_model(self.classifier)
+        noise_generator: NoiseGenerator = NoiseGenerator((self.training_parameters.test_size, self.seq_length,
+                                                          self.training_parameters.latent_dimension),
+                                                         np.random.default_rng(np.random.randint(0, 2 ** 31)))
+        # what the evaluation needs is built here, so that the worker thread never builds it
+        _ = self.similarity_engine, self.class_similarity_engines, self.real_feature_mean, self.evaluation_classes
+
+        def evaluate_snapshot(snapshot: WeightsSnapshot) -> EvaluationResult:
+            generator.set_weights(snapshot.generator_weights)
+            classifier.set_weights(snapshot.classifier_weights)
+            return self.evaluate(snapshot.step, generator, classifier, noise_generator)
+
+        return EvaluationWorker(evaluate_snapshot)
+
+    def _rng_state(self) -> dict:
+        """
+        :return: The state of the random generators of training, as JSON serializable values.
+        """
+        numpy_state: dict = np.random.get_state(legacy=False)
+        rng_state: dict = {'numpy': {**numpy_state,
+                                     'state': {**numpy_state['state'], 'key': numpy_state['state']['key'].tolist()}}}
+        if self.evaluation_noise is not None:
+            rng_state['evaluation_noise'] = self.evaluation_noise.generator.bit_generator.state
+        if self.probe_noise is not None:
+            rng_state['probe_noise'] = self.probe_noise.generator.bit_generator.state
+        if self.graph_noise_generator is not None:
+            rng_state['graph_noise'] = self.graph_noise_generator.state.numpy().tolist()
+        return rng_state
+
+    def _restore_rng_state(self, rng_state: dict) -> None:
+        """
+        Restores the state of the random generators returned by _rng_state. The batch source is seeded
+        from the numpy state when it is created, so the training batches of a resumed run are reproducible,
+        but differ from those of the interrupted run, which had prefetched batches ahead of its checkpoint.
+        """
+        np.random.set_state(rng_state['numpy'])
+        if self.evaluation_noise is not None and 'evaluation_noise' in rng_state:
+            self.evaluation_noise.generator.bit_generator.state = rng_state['evaluation_noise']
+        if self.probe_noise is not None and 'probe_noise' in rng_state:
+            self.probe_noise.generator.bit_generator.state = rng_state['probe_noise']
+        if self.graph_noise_generator is not None and 'graph_noise' in rng_state:
+            self.graph_noise_generator.reset(tf.constant(rng_state['graph_noise'], dtype=tf.int64))
+
+    def capture_checkpoint(self, step: int) -> Checkpoint:
+        """
+        Copies everything training needs to go on after the given step: the weights of the models
+        and of their optimizers and the state of the random generators.
+
+        :param step: The training step that just finished.
+        :return: The checkpoint.
+        """
+        training_state: TrainingState = TrainingState(
+            classifier_weights=self.classifier.get_weights(),
+            discriminator_optimizer_weights=checkpoint_module.get_optimizer_weights(
+                self.discriminator_model.optimizer),
+            generator_optimizer_weights=checkpoint_module.get_optimizer_weights(self.GCD.optimizer),
+            rng_state=self._rng_state())
+        return Checkpoint(step=step,
+                          generator_weights=self.generator.get_weights(),
+                          discriminator_weights=self.discriminator.get_weights(),
+                          training_state=training_state)
+
+    def create_checkpoint_writer(self, resume: bool = False, overwrite: bool = False) -> CheckpointWriter:
+        """
+        Creates the writer of the checkpoints of this run, which saves them through private copies
+        of the generator and of the discriminator on a background thread.
+
+        :param resume: Whether the run resumed from a checkpoint.
+        :param overwrite: Whether a run which does not resume removes the checkpoints of an earlier
+        run of the class label, instead of raising ExistingCheckpointsError.
+        :return: The checkpoint writer.
+        """
+        return CheckpointWriter(self.checkpoint_directory,
+                                self.class_label,
+                                generator=clone_model(self.generator),
+                                discriminator=clone_model(self.discriminator),
+                                keep_best=self.training_parameters.checkpoint_keep_best,
+                                metric=self.training_parameters.checkpoint_metric,
+                                resume=resume,
+                                overwrite=overwrite)
+
+    def restore_checkpoint(self, stored: StoredCheckpoint) -> None:
+        """
+        Restores the state of training saved by a checkpoint.
+
+        :param stored: The checkpoint written to disk.
+        """
+        training_state: TrainingState = checkpoint_module.read_training_state(stored)
+        self.generator.load_weights(stored.generator_path)
+        self.discriminator.load_weights(stored.discriminator_path)
+        self.classifier.set_weights(training_state.classifier_weights)
+        checkpoint_module.set_optimizer_weights(self.discriminator_model.optimizer,
+                                                self.discriminator_variables,
+                                                training_state.discriminator_optimizer_weights)
+        checkpoint_module.set_optimizer_weights(self.GCD.optimizer,
+                                                self.GCD.trainable_variables,
+                                                training_state.generator_optimizer_weights)
+        self._restore_rng_state(training_state.rng_state)
+        # the results of the resumed run are appended to those of the interrupted run
+        self._resumed = True
+
+    def restore_latest_checkpoint(self) -> int:
+        """
+        Restores the latest checkpoint of the class label, if there is one.
+
+        :return: The step of the checkpoint, 0 if there is none.
+        """
+        stored: Optional[StoredCheckpoint] = checkpoint_module.latest_checkpoint(self.checkpoint_directory,
+                                                                                 self.class_label)
+        if stored is None:
+            return 0
+        self.restore_checkpoint(stored)
+        return stored.step
+
     def train_tstr_classifier(self, synthetic_data: np.ndarray):
         train_tstr_classifier(synthetic_data=synthetic_data,
                               classifier=self.metric_classifier,
                               class_label=self.class_label)
 
 
-    def compute_rts_sts(self, syn_data: ndarray) -> Tuple[ndarray, ndarray]:
+    def compute_rts_sts(self, syn_data: ndarray, classes: Optional[ndarray] = None) -> Tuple[ndarray, ndarray]:
         """
         Computes the similarity metrics.
 
         :param syn_data: The synthetic data as a numpy array.
+        :param classes: For a conditional GAN, the class labels the synthetic data was generated for.
+        The metrics are then computed per class, against the real data of the class, and averaged
+        weighted by the number of synthetic segments of each class.
         :return: A tuple of the following form (numpy array, numpy array) containing
         the rts similarity metrics and the sts similarity metrics.
         """
+        if self.conditional:
+            classes = classes.reshape(-1)
+            rts_similarities: list = []
+            sts_similarities: list = []
+            counts: list = []
+            for label in np.unique(classes).tolist():
+                class_syn_data: ndarray = syn_data[classes == label]
+                engine: RealSimilarityEngine = self.class_similarity_engines[label]
+                # with an engine, the real data is only needed for its shape
+                class_rts, class_sts = train.compute_similarity_metrics(
+                    synthetic_input_data=class_syn_data,
+                    real_input_data=self.input_data,
+                    batch_size=len(class_syn_data),
+                    real_synthetic_ratio=self.training_parameters.real_synthetic_ratio,
+                    synthetic_synthetic_ratio=self.training_parameters.synthetic_synthetic_ratio,
+                    rts_mode=self.training_parameters.rts_mode,
+                    sts_mode=self.training_parameters.sts_mode,
+                    rts_legacy_sampling=self.training_parameters.rts_legacy_sampling,
+                    similarity_engine=engine)
+                rts_similarities.append(class_rts)
+                sts_similarities.append(class_sts)
+                counts.append(len(class_syn_data))
+            return np.average(rts_similarities, weights=counts), np.average(sts_similarities, weights=counts)
+
         return train.compute_similarity_metrics(synthetic_input_data=syn_data,
                                                 real_input_data=self.input_data,
                                                 batch_size=self.training_parameters.test_size,
                                                 real_synthetic_ratio=self.training_parameters.real_synthetic_ratio,
                                                 synthetic_synthetic_ratio=
-                                                self.training_parameters.synthetic_synthetic_ratio)
+                                                self.training_parameters.synthetic_synthetic_ratio,
+                                                rts_mode=self.training_parameters.rts_mode,
+                                                sts_mode=self.training_parameters.sts_mode,
+                                                rts_legacy_sampling=self.training_parameters.rts_legacy_sampling,
+                                                similarity_engine=self.similarity_engine)
+
+    def compute_sts_distribution(self, syn_data: ndarray) -> SimilarityDistribution:
+        """
+        Computes the distribution of the similarity over all pairs of synthetic segments,
+        which includes a quantile based mode collapse score.
 
-    def compute_statistical_feature_distance(self, syn_data: ndarray) -> ndarray:
+        :param syn_data: The synthetic data as a numpy array.
+        :return: The distribution of the all-pairs sts similarity.
+        """
+        with phase('sts_distribution'):
+            return compute_pairwise_similarity_distribution(
+                syn_data,
+                chunk_size=self.training_parameters.similarity_chunk_size,
+                collapse_quantile=self.training_parameters.sts_collapse_quantile)
+
+    def compute_statistical_feature_distance(self, syn_data: ndarray, classes: Optional[ndarray] = None) -> ndarray:
         """
         Computes the statistical feature distance.
 
         :param syn_data: The synthetic data.
+        :param classes: For a conditional GAN, the class labels the synthetic data was generated for,
+        every segment is then compared to the mean features of its class.
         :return: The statistical feature distance as a numpy array.
         """
-        synthetic_features = self.feature_net.predict(syn_data, self.training_parameters.test_size, verbose=0)
-        return critique.compute_statistical_feature_distance(synthetic_features, self.synthetic_data_test)
+        with phase('statistical_feature_distance'):
+            synthetic_features = critique.compute_statistical_features(syn_data,
+                                                                       self.training_parameters.num_features)
+            real_features: ndarray = self.real_feature_mean if not self.conditional \
+                else self.real_feature_mean[classes.reshape(-1)]
+            return critique.compute_statistical_feature_distance(synthetic_features, real_features)
 
     def save_model_to_directory(self) -> None:
         """
@@ -291,48 +975,73 @@ class GanModel:
 
         :return: Nothing, since this function is a void function.
         """
-        save.save_keras_model(self.generator, self.model_save_directory, self.generator_save_location)
-        save.save_keras_model(self.discriminator, self.model_save_directory, self.discriminator_save_location)
+        with phase('GanModel.save_model'):
+            save.save_keras_model(self.generator, self.model_save_directory, self.generator_save_location)
+            save.save_keras_model(self.discriminator, self.model_save_directory, self.discriminator_save_location)
+
+    @property
+    def metrics_sink(self) -> MetricsSink:
+        """
+        The sink of the training results, which opens the metrics database on first use.
+        """
+        if self._metrics_sink is None:
+            configuration: dict = {'training_parameters': asdict(self.training_parameters),
+                                   'weights': asdict(self.weights),
+                                   'ignore_classifier': self.ignore_classifier,
+                                   'ignore_sfd': self.ignore_sfd,
+                                   'dataset': os.path.basename(self.data_file_path)}
+            configuration_hash: str = config_hash(configuration)
+            run_id: Optional[str] = latest_unfinished_run(self.metrics_database, self.data_file_path,
+                                                          self.class_label) if self._resumed else None
+            self._metrics_sink = MetricsSink(self.metrics_database,
+                                             configuration_hash,
+                                             self.class_label,
+                                             dataset=self.data_file_path,
+                                             config=configuration,
+                                             run_id=run_id)
+        return self._metrics_sink
 
     def write_training_results(self,
                                current_epoch: int,
-                               discriminator_accuracy: np.float,
-                               generator_discriminator_acc: np.float,
-                               generator_classifier_acc: np.float,
-                               mean_rts_similarity: ndarray,
-                               mean_sts_similarity: ndarray) -> None:
+                               discriminator_accuracy: float,
+                               generator_discriminator_acc: float,
+                               evaluation: EvaluationResult,
+                               step_seconds: Optional[float] = None) -> None:
         """
-        Writes the training results.
+        Writes the training results of a step to the metrics database, in batches.
 
         :param current_epoch: The current epoch.
         :param discriminator_accuracy: The accuracy of the discriminator.
         :param generator_discriminator_acc: The generator discriminator accuracy.
-        :param generator_classifier_acc: The generator classifier accuracy.
-        :param mean_rts_similarity: The mean rts similarity.
-        :param mean_sts_similarity: The mean sts similarity.
-        :return: Nothing, since, well, its a void function, I hope at least. Maybe its not,
-        and then the code will break one day.
-        """
-        save.write_results(current_epoch,
-                           self.class_label,
-                           discriminator_accuracy,
-                           generator_discriminator_acc,
-                           generator_classifier_acc,
-                           mean_rts_similarity,
-                           mean_sts_similarity)
-
-    @staticmethod
-    def _load_pretrained_model(generator_path: str,
-                               discriminator_path: str,
-                               directory: str) -> Tuple[Functional, Functional]:
-        """
-        Loads a pre-trained model.
-
-        :return: Nothing.
-        """
-        generator_file_path = os.path.join(directory, generator_path)
-        discriminator_file_path = os.path.join(directory, discriminator_path)
-        return load_model(generator_file_path), load_model(discriminator_file_path)
+        :param evaluation: The evaluation of the step.
+        :param step_seconds: The duration of the training step.
+        """
+        self.metrics_sink.record(MetricsRow(step=current_epoch,
+                                            discriminator_accuracy=float(discriminator_accuracy),
+                                            generator_discriminator_accuracy=float(generator_discriminator_acc),
+                                            classifier_accuracy=float(evaluation.classifier_accuracy),
+                                            mean_rts_similarity=float(np.mean(evaluation.mean_rts_similarity)),
+                                            mean_sts_similarity=float(np.mean(evaluation.mean_sts_similarity)),
+                                            statistical_feature_distance=float(
+                                                np.mean(evaluation.statistical_feature_distance)),
+                                            step_seconds=step_seconds,
+                                            evaluation_seconds=evaluation.seconds))
+
+    def write_stop_reason(self, stop_decision: StopDecision) -> None:
+        """
+        Records why training stopped with the training results.
+
+        :param stop_decision: The decision of the stopping policy.
+        """
+        self.metrics_sink.record_stop(stop_decision.step, stop_decision.reason, stop_decision.detail)
+
+    def close_training_results(self) -> None:
+        """
+        Writes the buffered training results and closes the metrics database.
+        """
+        if self._metrics_sink is not None:
+            self._metrics_sink.close()
+            self._metrics_sink = None
 
     def compute_one_segment_real(self) -> ndarray:
         """
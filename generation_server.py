@@ -0,0 +1,475 @@
+"""
+A long-running local server generating synthetic data from one or more saved generators, which are
+loaded once at startup. Concurrent requests to a generator are coalesced into larger forward passes,
+waiting at most --max_wait_ms for more requests to join a batch.
+Usage: python3 generation_server.py models/G_walking.h5 models/G_running.h5 --port 8080
+       python3 generation_server.py models/G_conditional.h5 --unix_socket /tmp/supergan.sock
+
+Endpoints:
+    GET /generate?generator=G_walking&count=100          the segments as a .npy array of float32
+    GET /generate?generator=G_conditional&count=100&class=2
+    GET /generators                                       the loaded generators as JSON
+    GET /metrics                                          latencies and counters, in the Prometheus text format
+The generator parameter can be left out when a single generator is loaded.
+"""
+
+import argparse as arg_parser
+import io
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from argparse import Namespace
+from concurrent.futures import Future
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import tensorflow as tf
+from keras.layers import Embedding
+from keras.models import load_model
+
+# the upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# the upper bounds of the batch size histogram buckets, in segments
+BATCH_SIZE_BUCKETS = (1, 8, 32, 128, 512, 1024, 4096, 16384)
+
+NPY_CONTENT_TYPE = 'application/octet-stream'
+
+
+class Histogram:
+    """
+    A cumulative histogram with fixed buckets, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        """
+        :param buckets: The upper bounds of the buckets, in increasing order.
+        """
+        self.buckets: Tuple[float, ...] = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.total: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        """
+        :param value: A new observation.
+        """
+        index: int = int(np.searchsorted(self.buckets, value, side='left'))
+        self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+    def exposition(self, name: str, labels: str) -> List[str]:
+        """
+        :param name: The name of the metric.
+        :param labels: The labels of the metric, e.g. generator="G_walking".
+        :return: The lines of the Prometheus text format describing the histogram.
+        """
+        lines: List[str] = []
+        cumulative: int = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class ServerMetrics:
+    """
+    The request latencies, batch sizes and throughput counters of every generator.
+    """
+
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.start_time: float = time.monotonic()
+        self.latencies: Dict[str, Histogram] = {}
+        self.batch_sizes: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, str], int] = {}
+
+    def _increment(self, name: str, generator: str, amount: int = 1) -> None:
+        self.counters[(name, generator)] = self.counters.get((name, generator), 0) + amount
+
+    def record_request(self, generator: str, num_segments: int, seconds: float, failed: bool = False) -> None:
+        """
+        Records a finished request.
+
+        :param generator: The name of the generator.
+        :param num_segments: The number of segments requested.
+        :param seconds: The latency of the request, from its arrival to its response.
+        :param failed: Whether the request failed.
+        """
+        with self.lock:
+            self.latencies.setdefault(generator, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self._increment('supergan_requests_total', generator)
+            if failed:
+                self._increment('supergan_request_failures_total', generator)
+            else:
+                self._increment('supergan_segments_total', generator, num_segments)
+
+    def record_batch(self, generator: str, num_segments: int) -> None:
+        """
+        Records a forward pass of a generator.
+
+        :param generator: The name of the generator.
+        :param num_segments: The number of segments of the coalesced batch.
+        """
+        with self.lock:
+            self.batch_sizes.setdefault(generator, Histogram(BATCH_SIZE_BUCKETS)).observe(num_segments)
+            self._increment('supergan_batches_total', generator)
+
+    def exposition(self) -> str:
+        """
+        :return: Every metric in the Prometheus text format.
+        """
+        with self.lock:
+            lines: List[str] = [f'supergan_uptime_seconds {time.monotonic() - self.start_time}']
+            for (name, generator), value in sorted(self.counters.items()):
+                lines.append(f'{name}{{generator="{generator}"}} {value}')
+            for generator, histogram in sorted(self.latencies.items()):
+                lines.extend(histogram.exposition('supergan_request_latency_seconds', f'generator="{generator}"'))
+            for generator, histogram in sorted(self.batch_sizes.items()):
+                lines.extend(histogram.exposition('supergan_batch_segments', f'generator="{generator}"'))
+        return '\n'.join(lines) + '\n'
+
+
+@dataclass(frozen=True)
+class GenerationRequest:
+    """
+    A request for count segments of a class, fulfilled through its future.
+    """
+    count: int
+    class_label: Optional[int]
+    future: Future
+
+
+class BatchingGenerator:
+    """
+    A saved generator and the thread running it. Requests are queued, and the thread coalesces the
+    requests arriving within max_wait_seconds of the first one (up to max_batch_size segments) into a
+    single forward pass. A request larger than max_batch_size is generated in several passes.
+    """
+
+    def __init__(self,
+                 name: str,
+                 path: str,
+                 metrics: ServerMetrics,
+                 max_batch_size: int = 1024,
+                 max_wait_seconds: float = 0.005,
+                 seed: Optional[int] = None):
+        """
+        :param name: The name requests refer to the generator by.
+        :param path: The path of the saved generator.
+        :param metrics: The metrics of the server.
+        :param max_batch_size: The maximum number of segments of a forward pass.
+        :param max_wait_seconds: How long the first request of a batch waits for more requests.
+        :param seed: The seed of the noise.
+        """
+        self.name: str = name
+        self.path: str = path
+        self.metrics: ServerMetrics = metrics
+        self.max_batch_size: int = max_batch_size
+        self.max_wait_seconds: float = max_wait_seconds
+        self.model = load_model(path, compile=False)
+
+        # a conditional generator takes the class labels as its second input
+        self.conditional: bool = isinstance(self.model.input, list)
+        noise_shape: tuple = tuple((self.model.input[0] if self.conditional else self.model.input).shape[1:])
+        self.seq_length: int = noise_shape[0]
+        self.latent_dim: int = noise_shape[1]
+        self.output_shape: tuple = tuple(self.model.output_shape[1:])
+        self.num_classes: Optional[int] = None
+        if self.conditional:
+            self.num_classes = next(layer.input_dim for layer in self.model.layers if isinstance(layer, Embedding))
+        self.random_generator: np.random.Generator = np.random.default_rng(seed)
+
+        # one trace serves every batch size
+        input_signature: list = [tf.TensorSpec((None,) + noise_shape, tf.float32)]
+        if self.conditional:
+            input_signature.append(tf.TensorSpec((None, 1), tf.int32))
+        self._forward = tf.function(lambda *inputs: self.model(list(inputs) if self.conditional else inputs[0],
+                                                               training=False),
+                                    input_signature=input_signature)
+
+        self._requests: queue.Queue = queue.Queue()
+        self._thread: threading.Thread = threading.Thread(target=self._run, name=f'Generator-{name}', daemon=True)
+        self._thread.start()
+
+    def describe(self) -> dict:
+        """
+        :return: The properties of the generator clients need.
+        """
+        return {'name': self.name,
+                'path': self.path,
+                'conditional': self.conditional,
+                'num_classes': self.num_classes,
+                'output_shape': list(self.output_shape),
+                'latent_dim': self.latent_dim}
+
+    def submit(self, count: int, class_label: Optional[int]) -> Future:
+        """
+        Queues a request.
+
+        :param count: The number of segments.
+        :param class_label: The class label, which a conditional generator needs.
+        :return: A future resolving to the segments, of the shape (count, seq_length, num_channels).
+        """
+        if self.conditional and class_label is None:
+            raise ValueError(f'The generator "{self.name}" is conditional, a class is required')
+        if self.conditional and not 0 <= class_label < self.num_classes:
+            raise ValueError(f'The class has to be between 0 and {self.num_classes - 1}')
+        future: Future = Future()
+        self._requests.put(GenerationRequest(count, class_label, future))
+        return future
+
+    def _collect_batch(self) -> Optional[List[GenerationRequest]]:
+        """
+        Waits for a request, then for more requests until the batch is full or the wait is over.
+
+        :return: The requests of the batch, None when the generator is closed.
+        """
+        first: Optional[GenerationRequest] = self._requests.get()
+        if first is None:
+            return None
+        batch: List[GenerationRequest] = [first]
+        num_segments: int = first.count
+        deadline: float = time.monotonic() + self.max_wait_seconds
+        while num_segments < self.max_batch_size:
+            remaining: float = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request: Optional[GenerationRequest] = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                # handle the batch first, then stop
+                self._requests.put(None)
+                break
+            batch.append(request)
+            num_segments += request.count
+        return batch
+
+    def _generate(self, batch: List[GenerationRequest]) -> np.ndarray:
+        """
+        Runs the forward passes of a batch of requests.
+
+        :return: The segments of every request, concatenated in the order of the requests.
+        """
+        num_segments: int = sum(request.count for request in batch)
+        classes: Optional[np.ndarray] = None
+        if self.conditional:
+            classes = np.repeat([request.class_label for request in batch],
+                                [request.count for request in batch]).astype(np.int32)[:, np.newaxis]
+
+        output: np.ndarray = np.empty((num_segments,) + self.output_shape, dtype=np.float32)
+        for start in range(0, num_segments, self.max_batch_size):
+            stop: int = min(start + self.max_batch_size, num_segments)
+            noise: np.ndarray = self.random_generator.standard_normal((stop - start, self.seq_length,
+                                                                        self.latent_dim), dtype=np.float32)
+            inputs: list = [noise] if classes is None else [noise, classes[start:stop]]
+            output[start:stop] = self._forward(*inputs).numpy()
+            self.metrics.record_batch(self.name, stop - start)
+        return output
+
+    def _run(self) -> None:
+        """
+        The body of the generator thread, which serves batches until the generator is closed.
+        """
+        while True:
+            batch: Optional[List[GenerationRequest]] = self._collect_batch()
+            if batch is None:
+                return
+            try:
+                output: np.ndarray = self._generate(batch)
+            except Exception as error:
+                for request in batch:
+                    request.future.set_exception(error)
+                continue
+            start: int = 0
+            for request in batch:
+                request.future.set_result(output[start:start + request.count])
+                start += request.count
+
+    def close(self) -> None:
+        """
+        Stops the generator thread once the queued requests are served.
+        """
+        self._requests.put(None)
+        self._thread.join()
+
+
+def to_npy_bytes(array: np.ndarray) -> bytes:
+    """
+    :param array: An array.
+    :return: The array in the .npy format, which numpy.load reads back.
+    """
+    buffer: io.BytesIO = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the endpoints of the server, see the top of the file.
+    """
+    generators: Dict[str, BatchingGenerator] = {}
+    metrics: ServerMetrics = None
+    max_request_size: int = 100000
+
+    def address_string(self) -> str:
+        # the client address of a Unix socket is empty
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        # one log line per request would slow down the server, errors are returned to the client
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send(status, json.dumps({'error': message}).encode('utf-8'), 'application/json')
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/generate':
+            self._generate(parse_qs(url.query))
+        elif url.path == '/generators':
+            self._send(200, json.dumps([generator.describe() for generator in self.generators.values()]).encode(
+                'utf-8'), 'application/json')
+        elif url.path == '/metrics':
+            self._send(200, self.metrics.exposition().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self._send_error(404, f'Unknown endpoint "{url.path}"')
+
+    def _generate(self, query: Dict[str, List[str]]) -> None:
+        start: float = time.monotonic()
+        name: Optional[str] = query.get('generator', [None])[0]
+        if name is None and len(self.generators) == 1:
+            name = next(iter(self.generators))
+        if name not in self.generators:
+            self._send_error(404, f'Unknown generator "{name}", expected one of {list(self.generators)}')
+            return
+        try:
+            count: int = int(query.get('count', ['1'])[0])
+            class_label: Optional[int] = int(query['class'][0]) if 'class' in query else None
+        except ValueError as error:
+            self._send_error(400, str(error))
+            return
+        if not 0 < count <= self.max_request_size:
+            self._send_error(400, f'The count has to be between 1 and {self.max_request_size}')
+            return
+
+        generator: BatchingGenerator = self.generators[name]
+        try:
+            segments: np.ndarray = generator.submit(count, class_label).result()
+        except ValueError as error:
+            self.metrics.record_request(name, count, time.monotonic() - start, failed=True)
+            self._send_error(400, str(error))
+            return
+        except Exception as error:
+            self.metrics.record_request(name, count, time.monotonic() - start, failed=True)
+            self._send_error(500, repr(error))
+            return
+        self._send(200, to_npy_bytes(segments), NPY_CONTENT_TYPE, {'X-Generator': name})
+        self.metrics.record_request(name, count, time.monotonic() - start)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    An HTTP server listening on a Unix socket, with a thread per connection.
+    """
+    daemon_threads = True
+
+
+def create_server(generator_paths: List[str],
+                  host: str = '127.0.0.1',
+                  port: int = 8080,
+                  unix_socket: Optional[str] = None,
+                  max_batch_size: int = 1024,
+                  max_wait_seconds: float = 0.005,
+                  max_request_size: int = 100000) -> socketserver.BaseServer:
+    """
+    Loads the generators and creates the server, which serve_forever then runs.
+
+    :param generator_paths: The paths of the saved generators, named after their file names.
+    :param host: The host of the HTTP server.
+    :param port: The port of the HTTP server.
+    :param unix_socket: If given, the server listens on this Unix socket instead of host and port.
+    :param max_batch_size: The maximum number of segments of a forward pass.
+    :param max_wait_seconds: How long the first request of a batch waits for more requests.
+    :param max_request_size: The maximum number of segments of a request.
+    :return: The server.
+    """
+    metrics: ServerMetrics = ServerMetrics()
+    generators: Dict[str, BatchingGenerator] = {}
+    for path in generator_paths:
+        name: str = os.path.splitext(os.path.basename(path))[0]
+        generators[name] = BatchingGenerator(name, path, metrics,
+                                             max_batch_size=max_batch_size,
+                                             max_wait_seconds=max_wait_seconds)
+
+    handler = type('Handler', (GenerationRequestHandler,), {'generators': generators,
+                                                            'metrics': metrics,
+                                                            'max_request_size': max_request_size})
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_cli_arguments() -> Namespace:
+    """
+    Utility function that parses command line arguments
+    """
+    parser = arg_parser.ArgumentParser(description='Serves synthetic data from saved SuperGAN generators')
+    parser.add_argument('generators', type=str, nargs='+',
+                        help='The saved generators to serve, named after their file names')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='The host to listen on')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='The port to listen on')
+    parser.add_argument('--unix_socket', type=str, default=None,
+                        help='Listen on this Unix socket instead of the host and port')
+    parser.add_argument('--max_batch_size', type=int, default=1024,
+                        help='The maximum number of segments generated in one forward pass')
+    parser.add_argument('--max_wait_ms', type=float, default=5.0,
+                        help='How long a request waits for other requests to join its forward pass')
+    parser.add_argument('--max_request_size', type=int, default=100000,
+                        help='The maximum number of segments of a single request')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cli_args: Namespace = parse_cli_arguments()
+    generation_server = create_server(cli_args.generators,
+                                      host=cli_args.host,
+                                      port=cli_args.port,
+                                      unix_socket=cli_args.unix_socket,
+                                      max_batch_size=cli_args.max_batch_size,
+                                      max_wait_seconds=cli_args.max_wait_ms / 1000,
+                                      max_request_size=cli_args.max_request_size)
+    print(f'Serving {", ".join(cli_args.generators)} on '
+          f'{cli_args.unix_socket or f"http://{cli_args.host}:{cli_args.port}"}')
+    try:
+        generation_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        generation_server.server_close()
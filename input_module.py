@@ -1,12 +1,21 @@
 """
 Contains functions necessary for processing the .txt input file and loading the appropriate data
 """
-from typing import Tuple
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
 
 import h5py
 import numpy as np
 import toml
 
+# number of rows read at a time from datasets which are not chunked
+READ_BLOCK_ROWS = 1024
+
+# datasets written by convert_dataset.py next to X, y and y_onehot
+CLASS_INDEX_KEY = 'class_index'
+CHANNEL_STATS_KEY = 'channel_stats'
+
 
 class InputModuleConfiguration:
     """
@@ -18,6 +27,10 @@ class InputModuleConfiguration:
     classifier_path: str = None
     class_label: int = 0
     write_train_results: bool = False
+    results_directory: str = '.'
+    metrics_database: str = 'metrics.sqlite'
+    checkpoint_directory: str = 'checkpoints'
+    memory_map: bool = False
 
     def __init__(self):
         pass
@@ -51,38 +64,101 @@ def parse_input_file(file_name: str) -> InputModuleConfiguration:
     return input_module_config
 
 
-def load_data(filepath_data: str, class_label: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+def class_row_runs(rows: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Splits sorted row indices into runs of consecutive rows.
+
+    :param rows: A sorted numpy array of row indices.
+    :return: A list of (start, stop) tuples, where stop is exclusive.
+    """
+    if len(rows) == 0:
+        return []
+    breaks: np.ndarray = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts: np.ndarray = rows[np.concatenate(([0], breaks))]
+    stops: np.ndarray = rows[np.concatenate((breaks - 1, [len(rows) - 1]))] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def read_rows(dataset: h5py.Dataset, rows: np.ndarray) -> np.ndarray:
+    """
+    Reads the given rows of a HDF5 dataset without reading the rest of it.
+    Consecutive rows are read with a single slice. When the rows are scattered, so that
+    there are more runs than storage blocks (HDF5 chunks, or READ_BLOCK_ROWS rows for
+    contiguous datasets) containing them, every such block is read once instead.
+
+    :param dataset: A HDF5 dataset whose first axis indexes the rows.
+    :param rows: A sorted numpy array of row indices.
+    :return: A numpy array containing the selected rows.
+    """
+    output: np.ndarray = np.empty((len(rows),) + dataset.shape[1:], dtype=dataset.dtype)
+    runs: List[Tuple[int, int]] = class_row_runs(rows)
+    block_rows: int = dataset.chunks[0] if dataset.chunks is not None else READ_BLOCK_ROWS
+    blocks: np.ndarray = np.unique(rows // block_rows)
+
+    if len(runs) <= len(blocks):
+        position: int = 0
+        for start, stop in runs:
+            dataset.read_direct(output, source_sel=np.s_[start:stop],
+                                dest_sel=np.s_[position:position + stop - start])
+            position += stop - start
+        return output
+
+    position: int = 0
+    for block in blocks.tolist():
+        block_start: int = block * block_rows
+        rows_in_block: np.ndarray = rows[(rows >= block_start) & (rows < block_start + block_rows)]
+        output[position:position + len(rows_in_block)] = \
+            dataset[block_start:rows_in_block[-1] + 1][rows_in_block - block_start]
+        position += len(rows_in_block)
+    return output
+
+
+def memory_map_rows(filepath_data: str, dataset: h5py.Dataset, rows: np.ndarray) -> Optional[np.ndarray]:
     """
-    Loads data from an input file, based on a given filepath.
+    Memory maps the given rows of a HDF5 dataset, which is only possible when the dataset is
+    stored contiguously and uncompressed and the rows are consecutive (e.g. a class of a class
+    sorted dataset).
 
     :param filepath_data: The filepath that the .h5 file is located at.
-    :param class_label: A class label, which is used for loading data from a selected class.
-    :return: A 3-tuple of numpy array, formulated as follows (input_data, output_data, output_data_onehot)
+    :param dataset: A HDF5 dataset whose first axis indexes the rows.
+    :param rows: A sorted numpy array of row indices.
+    :return: A read-only numpy memmap of the rows, or None if they cannot be memory mapped.
     """
+    runs: List[Tuple[int, int]] = class_row_runs(rows)
+    offset: Optional[int] = dataset.id.get_offset()
+    if len(runs) != 1 or dataset.chunks is not None or dataset.compression is not None or offset is None:
+        return None
 
-    def load_class_data(given_input_data: np.ndarray,
-                        given_output_data: np.ndarray,
-                        given_output_onehot: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        """
-        A helper function which loads data for a class which is specified by the class_label
-        parameter of the surrounding function, filters out extraneous data.
-
-        :param given_input_data: The given input data, which is a numpy array.
-        :param given_output_data: The given output data, which is a numpy array.
-        :param given_output_onehot: The given output onehot data, which is also a numpy array.
-        :return: A three tuple, which contains the filtered data in the following form:
-        (input_data, output_data, output_data_onehot)
-        """
+    start, stop = runs[0]
+    return np.memmap(filepath_data, dtype=dataset.dtype, mode='r',
+                     offset=offset, shape=dataset.shape)[start:stop]
+
+
+def read_class_index(h5_file: h5py.File) -> Optional[Dict[int, Tuple[int, int]]]:
+    """
+    Reads the per class index of a class sorted dataset (see convert_dataset.py).
+
+    :param h5_file: An open .h5 file.
+    :return: A dictionary mapping each class label to the (offset, length) of its rows,
+    or None if the file has no class index.
+    """
+    if CLASS_INDEX_KEY not in h5_file.keys():
+        return None
+    return {int(label): (int(offset), int(length))
+            for label, offset, length in np.asarray(h5_file[CLASS_INDEX_KEY])}
 
-        # filter the output data
-        indices_toKeep = np.where(given_output_data == class_label)
 
-        # get the data at the indices to keep location
-        in_data = given_input_data[indices_toKeep]
-        out_data = given_output_data[indices_toKeep]
-        out_data_onehot = given_output_onehot[indices_toKeep]
-        return in_data, out_data, out_data_onehot
+def load_data(filepath_data: str, class_label: int, memory_map: bool = False) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Loads data from an input file, based on a given filepath. Only the labels are read
+    in full, the input data is read for the rows of the selected class only.
 
+    :param filepath_data: The filepath that the .h5 file is located at.
+    :param class_label: A class label, which is used for loading data from a selected class.
+    :param memory_map: Whether to return a read-only memory map of the input data instead
+    of a copy, when the layout of the file allows it.
+    :return: A 3-tuple, formulated as follows (input_data, output_data, num_classes)
+    """
     with h5py.File(filepath_data, mode='r') as h5_file:
         h5_file_keys = h5_file.keys()
 
@@ -90,14 +166,101 @@ def load_data(filepath_data: str, class_label: int) -> Tuple[np.ndarray, np.ndar
         if 'X' not in h5_file_keys or 'y' not in h5_file_keys or 'y_onehot' not in h5_file_keys:
             raise IOError
 
-        input_data = np.array(h5_file.get('X'))
-        output_data = np.array(h5_file.get('y'))
-        output_data_onehot = np.array(h5_file.get('y_onehot'))
+        # the one-hot labels are never read, only their width is needed
+        num_classes: int = h5_file['y_onehot'].shape[1]
+
+        # a class sorted file stores every class as one slice, so y does not need to be searched
+        class_index: Optional[Dict[int, Tuple[int, int]]] = read_class_index(h5_file)
+        if class_index is not None:
+            offset, length = class_index.get(class_label, (0, 0))
+            output_data: np.ndarray = np.asarray(h5_file['y'][offset:offset + length]).reshape(-1)
+            rows_to_keep: np.ndarray = np.arange(offset, offset + length)
+        else:
+            output_data: np.ndarray = np.asarray(h5_file['y']).reshape(-1)
+            rows_to_keep: np.ndarray = np.flatnonzero(output_data == class_label)
+            output_data = output_data[rows_to_keep]
+
+        input_data: Optional[np.ndarray] = None
+        if memory_map:
+            input_data = memory_map_rows(filepath_data, h5_file['X'], rows_to_keep)
+        if input_data is None:
+            input_data = read_rows(h5_file['X'], rows_to_keep)
 
-        # close and prevent memory leaks
-        h5_file.close()
-        input_data, output_data, output_data_onehot = load_class_data(input_data,
-                                                                      output_data,
-                                                                      output_data_onehot)
+    return input_data, output_data, num_classes
+
+
+def load_all_data(filepath_data: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Loads the input data and the one-hot labels of every class, each with a single
+    sequential read.
 
-    return input_data, output_data, output_data_onehot
+    :param filepath_data: The filepath that the .h5 file is located at.
+    :return: A 2-tuple of numpy arrays, formulated as follows (input_data, output_data_onehot)
+    """
+    with h5py.File(filepath_data, mode='r') as h5_file:
+        if 'X' not in h5_file.keys() or 'y_onehot' not in h5_file.keys():
+            raise IOError
+        input_data: np.ndarray = read_rows(h5_file['X'], np.arange(h5_file['X'].shape[0]))
+        output_data_onehot: np.ndarray = np.asarray(h5_file['y_onehot'])
+    return input_data, output_data_onehot
+
+
+def load_labelled_data(filepath_data: str) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Loads the input data and the labels of every class, so that the data of any class can then
+    be selected without reading the file again.
+
+    :param filepath_data: The filepath that the .h5 file is located at.
+    :return: A 3-tuple, formulated as follows (input_data, output_data, num_classes)
+    """
+    with h5py.File(filepath_data, mode='r') as h5_file:
+        if 'X' not in h5_file.keys() or 'y' not in h5_file.keys() or 'y_onehot' not in h5_file.keys():
+            raise IOError
+        input_data: np.ndarray = read_rows(h5_file['X'], np.arange(h5_file['X'].shape[0]))
+        output_data: np.ndarray = np.asarray(h5_file['y']).reshape(-1)
+        num_classes: int = h5_file['y_onehot'].shape[1]
+    return input_data, output_data, num_classes
+
+
+def read_num_classes(filepath_data: str) -> int:
+    """
+    Reads the number of classes of a dataset without loading any of its data.
+
+    :param filepath_data: The filepath that the .h5 file is located at.
+    :return: The number of classes.
+    """
+    with h5py.File(filepath_data, mode='r') as h5_file:
+        if 'y_onehot' not in h5_file.keys():
+            raise IOError
+        return h5_file['y_onehot'].shape[1]
+
+
+def select_class(input_data: np.ndarray, output_data: np.ndarray, class_label: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Selects the data of a class from data loaded by load_labelled_data. When the rows of the
+    class are consecutive, as in a class sorted file, the result is a view rather than a copy.
+
+    :param input_data: The input data of every class.
+    :param output_data: The labels of every class.
+    :param class_label: The class label.
+    :return: A 2-tuple, formulated as follows (input_data, output_data)
+    """
+    rows: np.ndarray = np.flatnonzero(output_data == class_label)
+    if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows):
+        return input_data[rows[0]:rows[-1] + 1], output_data[rows[0]:rows[-1] + 1]
+    return input_data[rows], output_data[rows]
+
+
+def file_fingerprint(file_path: str, block_size: int = 1 << 20) -> Tuple[str, int]:
+    """
+    Computes a fingerprint of a (dataset) file, used to key caches derived from its content.
+
+    :param file_path: The path of the file.
+    :param block_size: The number of bytes hashed at a time.
+    :return: A tuple of the form (sha256 hex digest, size in bytes).
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, mode='rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest(), os.path.getsize(file_path)
@@ -0,0 +1,529 @@
+"""
+Contains the instrumentation of the phases of a run: the code marks its phases (loading the data,
+building the models, the training steps, the evaluations, saving...) with phase(), and the recorders
+installed with install() are told when each phase starts and stops. Without a recorder a phase costs
+next to nothing, so the phases stay in place in every run.
+
+The PhaseTimer records the wall-clock time of every phase: the number of calls and the mean and
+percentiles of their durations, and optionally a Chrome trace (chrome://tracing, Perfetto) and a
+TensorFlow profiler trace of a window of steps.
+
+The MemoryTracker records, for every phase, the peak resident set size of the process, the peak of
+the memory allocated by Python and NumPy (through tracemalloc) and the largest of these allocations,
+as well as the peak memory of every GPU when TensorFlow is used with one.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+
+class PhaseRecorder:
+    """
+    Records the phases of a run. start is called when a phase starts and returns a token, which
+    is passed to stop when the phase stops. Phases nest, and may run on several threads at once.
+    """
+
+    def start(self, name: str) -> object:
+        return None
+
+    def stop(self, name: str, token: object) -> None:
+        pass
+
+    def step(self, step: int) -> None:
+        """
+        Called when a training step starts.
+
+        :param step: The step.
+        """
+
+    def close(self) -> None:
+        """
+        Stops recording.
+        """
+
+
+_recorders: List[PhaseRecorder] = []
+_NO_PHASE = contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def _recorded_phase(name: str, recorders: List[PhaseRecorder]):
+    tokens: List[object] = [recorder.start(name) for recorder in recorders]
+    try:
+        yield
+    finally:
+        for recorder, token in zip(reversed(recorders), reversed(tokens)):
+            recorder.stop(name, token)
+
+
+def phase(name: str):
+    """
+    Marks a phase of the run, e.g.
+
+        with phase('train_step'):
+            gan_model.train_step()
+
+    :param name: The name of the phase, phases of the same name are aggregated.
+    :return: A context manager.
+    """
+    if not _recorders:
+        return _NO_PHASE
+    return _recorded_phase(name, list(_recorders))
+
+
+def mark_step(step: int) -> None:
+    """
+    Tells the recorders that a training step starts.
+
+    :param step: The step.
+    """
+    for recorder in list(_recorders):
+        recorder.step(step)
+
+
+def install(recorder: PhaseRecorder) -> PhaseRecorder:
+    """
+    Installs a recorder, which records the phases from now on.
+
+    :param recorder: The recorder.
+    :return: The recorder.
+    """
+    _recorders.append(recorder)
+    return recorder
+
+
+def uninstall(recorder: PhaseRecorder) -> None:
+    """
+    Uninstalls and closes a recorder.
+
+    :param recorder: The recorder.
+    """
+    if recorder in _recorders:
+        _recorders.remove(recorder)
+    recorder.close()
+
+
+def current_rss() -> int:
+    """
+    :return: The resident set size of the process in bytes, or its peak if the current size
+    cannot be read (i.e. not on Linux).
+    """
+    try:
+        with open('/proc/self/statm', mode='r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """
+    :return: The peak resident set size of the process so far in bytes.
+    """
+    max_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in kilobytes on Linux, in bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _gpu_devices() -> List[str]:
+    # TensorFlow only keeps statistics of the memory of GPUs
+    import tensorflow as tf
+    return [device.name.replace('/device:', '') for device in tf.config.list_logical_devices('GPU')]
+
+
+def _gpu_peak_bytes(devices: List[str]) -> int:
+    import tensorflow as tf
+    return sum(tf.config.experimental.get_memory_info(device)['peak'] for device in devices)
+
+
+def _reset_gpu_peaks(devices: List[str]) -> None:
+    import tensorflow as tf
+    for device in devices:
+        tf.config.experimental.reset_memory_stats(device)
+
+
+@dataclass
+class PhaseMemory:
+    """
+    The memory used by the calls of a phase. The growths are relative to the start of a call, and
+    the largest allocations are those the first call made and still held when it stopped, by the
+    line they were made on. The memory is that of the whole process, so the growths of the calls
+    which overlapped a phase of another thread (e.g. of the batches prepared in the background)
+    include what that thread allocated meanwhile, and are approximate.
+    """
+    name: str
+    calls: int = 0
+    approximate_calls: int = 0
+    peak_rss_bytes: int = 0
+    max_rss_growth_bytes: int = 0
+    max_traced_growth_bytes: int = 0
+    max_gpu_growth_bytes: Optional[int] = None
+    largest_allocations: List[Dict[str, object]] = field(default_factory=list)
+
+
+class _OpenPhase:
+    """
+    The peaks of a call of a phase which has not stopped yet.
+    """
+
+    def __init__(self, rss: int, traced: int, gpu: int, baseline: Optional[tracemalloc.Snapshot]):
+        self.baseline: Optional[tracemalloc.Snapshot] = baseline
+        self.thread_id: int = threading.get_ident()
+        # whether a phase of another thread was open during the call
+        self.approximate: bool = False
+        self.start_rss: int = rss
+        self.start_traced: int = traced
+        self.start_gpu: int = gpu
+        self.peak_rss: int = rss
+        self.peak_traced: int = traced
+        self.peak_gpu: int = gpu
+
+
+class MemoryTracker(PhaseRecorder):
+    """
+    Records the memory used by every phase. The resident set size is sampled on a background thread,
+    while tracemalloc and TensorFlow keep the peaks of the allocations themselves. Tracing the
+    allocations slows down the Python code of the run, so the tracker is opt-in.
+    """
+
+    def __init__(self, sample_interval: float = 0.005, top_allocations: int = 5, trace_allocations: bool = True):
+        """
+        :param sample_interval: The number of seconds between two samples of the resident set size.
+        :param top_allocations: The number of largest allocations kept per phase.
+        :param trace_allocations: Whether the allocations of Python and NumPy are traced.
+        """
+        self.sample_interval: float = sample_interval
+        self.top_allocations: int = top_allocations
+        self.trace_allocations: bool = trace_allocations
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.phases: Dict[str, PhaseMemory] = {}
+        self.start_time: float = time.time()
+        self._open_phases: List[_OpenPhase] = []
+        self._gpu_devices: Optional[List[str]] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(target=self._sample, name='MemoryTracker', daemon=True)
+        self._thread.start()
+
+    def _sample(self) -> None:
+        """
+        The body of the background thread, which keeps the peak resident set size of the open phases.
+        """
+        while not self._stop_event.wait(self.sample_interval):
+            rss: int = current_rss()
+            with self._lock:
+                for open_phase in self._open_phases:
+                    open_phase.peak_rss = max(open_phase.peak_rss, rss)
+
+    def _fold_peaks(self) -> None:
+        """
+        Folds the peaks of tracemalloc and of the GPUs into every open phase, and resets them, so
+        that a nested phase measures its own peaks without losing those of the enclosing phases.
+        Called with the lock held.
+        """
+        if self.trace_allocations:
+            traced_peak: int = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+        gpu_peak: int = _gpu_peak_bytes(self._gpu_devices) if self._gpu_devices else 0
+        if self._gpu_devices:
+            _reset_gpu_peaks(self._gpu_devices)
+        for open_phase in self._open_phases:
+            if self.trace_allocations:
+                open_phase.peak_traced = max(open_phase.peak_traced, traced_peak)
+            open_phase.peak_gpu = max(open_phase.peak_gpu, gpu_peak)
+
+    def start(self, name: str) -> object:
+        # the allocations are compared to a snapshot for the first call of a phase only, as a
+        # snapshot is slow with many allocations
+        baseline: Optional[tracemalloc.Snapshot] = None
+        if self.trace_allocations and name not in self.phases:
+            baseline = tracemalloc.take_snapshot()
+        rss: int = current_rss()
+        with self._lock:
+            if self._gpu_devices is None and 'tensorflow' in sys.modules:
+                # the GPUs are only known once TensorFlow is imported
+                self._gpu_devices = _gpu_devices()
+            self._fold_peaks()
+            traced: int = tracemalloc.get_traced_memory()[0] if self.trace_allocations else 0
+            gpu: int = _gpu_peak_bytes(self._gpu_devices) if self._gpu_devices else 0
+            open_phase: _OpenPhase = _OpenPhase(rss, traced, gpu, baseline)
+            self._open_phases.append(open_phase)
+            self._mark_overlaps()
+        return open_phase
+
+    def _mark_overlaps(self) -> None:
+        """
+        Marks the open phases as approximate if they are open on more than one thread, as the peaks
+        are those of the whole process. Called with the lock held.
+        """
+        if len({open_phase.thread_id for open_phase in self._open_phases}) > 1:
+            for open_phase in self._open_phases:
+                open_phase.approximate = True
+
+    def stop(self, name: str, token: object) -> None:
+        open_phase: _OpenPhase = token
+        rss: int = current_rss()
+        with self._lock:
+            self._fold_peaks()
+            self._open_phases.remove(open_phase)
+            open_phase.peak_rss = max(open_phase.peak_rss, rss)
+
+            memory: PhaseMemory = self.phases.setdefault(name, PhaseMemory(name))
+            memory.calls += 1
+            if open_phase.approximate:
+                memory.approximate_calls += 1
+            memory.peak_rss_bytes = max(memory.peak_rss_bytes, open_phase.peak_rss)
+            memory.max_rss_growth_bytes = max(memory.max_rss_growth_bytes, open_phase.peak_rss - open_phase.start_rss)
+            if self._gpu_devices:
+                memory.max_gpu_growth_bytes = max(memory.max_gpu_growth_bytes or 0,
+                                                  open_phase.peak_gpu - open_phase.start_gpu)
+
+            memory.max_traced_growth_bytes = max(memory.max_traced_growth_bytes,
+                                                 open_phase.peak_traced - open_phase.start_traced)
+
+        if open_phase.baseline is not None:
+            largest_allocations: List[Dict[str, object]] = self._largest_allocations(open_phase.baseline)
+            with self._lock:
+                memory.largest_allocations = largest_allocations
+
+    def _largest_allocations(self, baseline: tracemalloc.Snapshot) -> List[Dict[str, object]]:
+        """
+        :param baseline: The snapshot taken when the phase started.
+        :return: The largest allocations made since the snapshot and still held, by the line they were made on.
+        """
+        ignored: tuple = (tracemalloc.Filter(False, tracemalloc.__file__),
+                                     tracemalloc.Filter(False, __file__))
+        differences: List[tracemalloc.StatisticDiff] = tracemalloc.take_snapshot().filter_traces(
+            ignored).compare_to(baseline.filter_traces(ignored), 'lineno')
+        return [{'location': f'{difference.traceback[0].filename}:{difference.traceback[0].lineno}',
+                 'size_bytes': difference.size_diff,
+                 'count': difference.count_diff}
+                for difference in differences if difference.size_diff > 0][:self.top_allocations]
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+        if self.trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def report(self) -> dict:
+        """
+        :return: The report of the run, which is serializable to JSON.
+        """
+        with self._lock:
+            phases: List[dict] = [asdict(memory) for memory in self.phases.values()]
+        return {'pid': os.getpid(),
+                'start_time': self.start_time,
+                'peak_rss_bytes': peak_rss(),
+                'phases': phases}
+
+    def write_report(self, path: str) -> None:
+        """
+        Writes the report of the run to a JSON file.
+
+        :param path: The path of the JSON file.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w', encoding='utf-8') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def format_table(self) -> str:
+        """
+        :return: A table of the phases, by peak resident set size.
+        """
+        def megabytes(num_bytes: Optional[int]) -> str:
+            return '-' if num_bytes is None else f'{num_bytes / 2 ** 20:.1f}'
+
+        rows: List[str] = [f'{"phase":<40}{"calls":>8}{"approx.":>8}{"peak RSS":>12}{"RSS growth":>12}'
+                           f'{"traced growth":>15}{"GPU growth":>12}  largest allocation (MB)']
+        with self._lock:
+            phases: List[PhaseMemory] = sorted(self.phases.values(), key=lambda memory: memory.peak_rss_bytes,
+                                               reverse=True)
+        for memory in phases:
+            largest: str = ''
+            if memory.largest_allocations:
+                allocation: dict = memory.largest_allocations[0]
+                largest = f'{allocation["location"]} ({megabytes(allocation["size_bytes"])})'
+            rows.append(f'{memory.name:<40}{memory.calls:>8}{memory.approximate_calls:>8}'
+                        f'{megabytes(memory.peak_rss_bytes):>12}'
+                        f'{megabytes(memory.max_rss_growth_bytes):>12}{megabytes(memory.max_traced_growth_bytes):>15}'
+                        f'{megabytes(memory.max_gpu_growth_bytes):>12}  {largest}')
+        if any(memory.approximate_calls for memory in phases):
+            rows.append('approx.: the calls which overlapped a phase of another thread, whose growths include '
+                        'what that thread allocated')
+        rows.append(f'peak RSS of the run: {megabytes(peak_rss())} MB')
+        return '\n'.join(rows)
+
+
+@dataclass(frozen=True)
+class PhaseTiming:
+    """
+    The wall-clock time of the calls of a phase, in milliseconds except for the total.
+    """
+    name: str
+    calls: int
+    total_seconds: float
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+class PhaseTimer(PhaseRecorder):
+    """
+    Records the wall-clock time of every phase. The duration of every call is kept, so that the
+    percentiles are exact, and within the trace window every call is also kept as an event of a
+    Chrome trace, on the thread it ran on. The TensorFlow profiler, which has a far larger overhead,
+    traces the same window when a log directory is given.
+    """
+
+    def __init__(self,
+                 trace_path: Optional[str] = None,
+                 trace_steps: Optional[Tuple[int, int]] = None,
+                 tensorflow_log_directory: Optional[str] = None):
+        """
+        :param trace_path: The path of the Chrome trace JSON file, or None for no trace.
+        :param trace_steps: The first and last step traced, every step by default.
+        :param tensorflow_log_directory: The log directory of the TensorFlow profiler (viewed with
+        TensorBoard), or None for no TensorFlow trace.
+        """
+        self.trace_path: Optional[str] = trace_path
+        self.trace_steps: Optional[Tuple[int, int]] = trace_steps
+        self.tensorflow_log_directory: Optional[str] = tensorflow_log_directory
+        self.start_time: float = time.time()
+        self.current_step: Optional[int] = None
+        self.durations: Dict[str, List[int]] = {}
+        self.events: List[dict] = []
+        self._thread_names: Dict[int, str] = {}
+        self._tracing: bool = trace_path is not None and trace_steps is None
+        self._tensorflow_tracing: bool = False
+        self._lock: threading.Lock = threading.Lock()
+
+    def start(self, name: str) -> object:
+        return time.perf_counter_ns()
+
+    def stop(self, name: str, token: object) -> None:
+        end: int = time.perf_counter_ns()
+        start: int = token
+        with self._lock:
+            durations: Optional[List[int]] = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = []
+            durations.append(end - start)
+            if self._tracing:
+                thread_id: int = threading.get_ident()
+                if thread_id not in self._thread_names:
+                    self._thread_names[thread_id] = threading.current_thread().name
+                # the times of a Chrome trace are in microseconds
+                self.events.append({'name': name, 'ph': 'X', 'ts': start / 1000, 'dur': (end - start) / 1000,
+                                    'pid': os.getpid(), 'tid': thread_id, 'args': {'step': self.current_step}})
+
+    def _in_trace_window(self, step: int) -> bool:
+        return self.trace_steps is None or self.trace_steps[0] <= step <= self.trace_steps[1]
+
+    def step(self, step: int) -> None:
+        with self._lock:
+            self.current_step = step
+            if self.trace_path is not None:
+                self._tracing = self._in_trace_window(step)
+        if self.tensorflow_log_directory is not None:
+            if self._in_trace_window(step) and not self._tensorflow_tracing:
+                import tensorflow as tf
+                tf.profiler.experimental.start(self.tensorflow_log_directory)
+                self._tensorflow_tracing = True
+            elif not self._in_trace_window(step) and self._tensorflow_tracing:
+                self._stop_tensorflow_trace()
+
+    def _stop_tensorflow_trace(self) -> None:
+        import tensorflow as tf
+        tf.profiler.experimental.stop()
+        self._tensorflow_tracing = False
+
+    def close(self) -> None:
+        if self._tensorflow_tracing:
+            self._stop_tensorflow_trace()
+        with self._lock:
+            self._tracing = False
+        if self.trace_path is not None:
+            self.write_trace(self.trace_path)
+
+    def timings(self) -> List[PhaseTiming]:
+        """
+        :return: The timing of every phase, by total time.
+        """
+        import numpy as np
+        with self._lock:
+            durations: Dict[str, List[int]] = {name: list(calls) for name, calls in self.durations.items()}
+        timings: List[PhaseTiming] = []
+        for name, calls in durations.items():
+            milliseconds: np.ndarray = np.asarray(calls, dtype=np.float64) / 1e6
+            p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+            timings.append(PhaseTiming(name=name,
+                                       calls=len(calls),
+                                       total_seconds=float(milliseconds.sum() / 1e3),
+                                       mean_ms=float(milliseconds.mean()),
+                                       p50_ms=float(p50),
+                                       p95_ms=float(p95),
+                                       p99_ms=float(p99),
+                                       max_ms=float(milliseconds.max())))
+        return sorted(timings, key=lambda timing: timing.total_seconds, reverse=True)
+
+    def report(self) -> dict:
+        """
+        :return: The report of the run, which is serializable to JSON.
+        """
+        return {'pid': os.getpid(),
+                'start_time': self.start_time,
+                'wall_seconds': time.time() - self.start_time,
+                'phases': [asdict(timing) for timing in self.timings()]}
+
+    def write_report(self, path: str) -> None:
+        """
+        Writes the report of the run to a JSON file.
+
+        :param path: The path of the JSON file.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w', encoding='utf-8') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def write_trace(self, path: str) -> None:
+        """
+        Writes the traced calls to a Chrome trace JSON file, which chrome://tracing and
+        https://ui.perfetto.dev open.
+
+        :param path: The path of the JSON file.
+        """
+        with self._lock:
+            events: List[dict] = list(self.events)
+            thread_names: Dict[int, str] = dict(self._thread_names)
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread_id, 'args': {'name': name}}
+                   for thread_id, name in thread_names.items()]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w', encoding='utf-8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+    def format_table(self) -> str:
+        """
+        :return: A table of the phases, by total time.
+        """
+        timings: List[PhaseTiming] = self.timings()
+        rows: List[str] = [f'{"phase":<40}{"calls":>8}{"total (s)":>12}{"mean (ms)":>12}'
+                           f'{"p50 (ms)":>12}{"p95 (ms)":>12}{"p99 (ms)":>12}{"max (ms)":>12}']
+        for timing in timings:
+            rows.append(f'{timing.name:<40}{timing.calls:>8}{timing.total_seconds:>12.3f}{timing.mean_ms:>12.3f}'
+                        f'{timing.p50_ms:>12.3f}{timing.p95_ms:>12.3f}{timing.p99_ms:>12.3f}{timing.max_ms:>12.3f}')
+        rows.append(f'wall-clock time of the run: {time.time() - self.start_time:.3f}s')
+        return '\n'.join(rows)
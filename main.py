@@ -1,16 +1,22 @@
 """
 Main file where generator training and metric calculations take place.
 """
+import os
+import sys
+import time
 from argparse import Namespace, ArgumentParser
+from typing import TYPE_CHECKING
 from colorama import Fore
-from numpy import ndarray
-from typing import Tuple
 
 import config_file_parser
-import saving_module
-import training_module
-from gan_model import GanModel
-from plotting_module import plot_results
+from instrumentation_module import mark_step, phase
+
+# tensorflow, keras and matplotlib are imported by the code paths that need them, so that the
+# command line is parsed (and --help answered) without waiting for them
+if TYPE_CHECKING:
+    from evaluation_module import EvaluationResult
+    from gan_model import GanModel
+    from stopping_module import StopDecision
 
 
 def parse_command_line_args() -> Namespace:
@@ -31,6 +37,9 @@ def parse_command_line_args() -> Namespace:
                         help='Save samples of data')
     parser.add_argument('-l', '--load', action='store_true',
                         help='Load a pre-trained GAN model, and generate a number of sample')
+    parser.add_argument('-g', '--generate', action='store_true',
+                        help='Only generate samples (--count of them, or --export) from the pre-trained generator, '
+                             'without loading the dataset')
     parser.add_argument('-C', '--ignore_classifier', action='store_true',
                         help="Don't use classifier for training Generator")
     parser.add_argument('-R', '--ignore_regularization', action='store_true',
@@ -41,100 +50,258 @@ def parse_command_line_args() -> Namespace:
                         help='The .toml configuration file that needs to be loaded')
     parser.add_argument('-p', '--show_plot_results', action='store_true',
                         help='Show a plot of the results')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='Resume training from the latest checkpoint of the class label')
+    parser.add_argument('--overwrite_checkpoints', action='store_true',
+                        help='Remove the checkpoints of an earlier run of the class label instead of stopping '
+                             'when training does not resume from them')
+    parser.add_argument('-e', '--export', type=str, default=None,
+                        help='Export synthetic data to a single .h5 or .npy file')
+    parser.add_argument('--export_count', type=int, default=10000,
+                        help='The number of segments to export')
+    parser.add_argument('--export_classes', type=int, nargs='+', default=None,
+                        help='The class labels to export segments of (a conditional GAN only), '
+                             'by default the class label of the .toml file')
+    parser.add_argument('--export_batch_size', type=int, default=1024,
+                        help='The number of segments generated at once while exporting')
+    parser.add_argument('--compression', type=str, default=None, choices=('gzip', 'lzf'),
+                        help='Compress the exported segments of an .h5 file')
+    parser.add_argument('--no_classifier', action='store_true',
+                        help="Don't run the classifier on the generated or exported segments")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Run with python -X importtime and report the time spent importing each module')
+    parser.add_argument('--track_memory', action='store_true',
+                        help='Record the peak memory and the largest allocations of every phase of the run, '
+                             'and write them to Memory_label_class_<label>.json next to the results')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record the wall-clock time of every phase of the run (count, mean, p50/p95/p99), '
+                             'and write it to Timing_label_class_<label>.json next to the results')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Write a Chrome trace of the phases of the run to this JSON file (implies --profile)')
+    parser.add_argument('--trace_steps', type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help='Only trace the steps FIRST to LAST, every step by default')
+    parser.add_argument('--tensorflow_trace', type=str, default=None,
+                        help='Trace the steps of --trace_steps with the TensorFlow profiler as well, '
+                             'into this log directory (implies --profile)')
     return parser.parse_args()
 
 
-def generate_data_samples(arguments: Namespace, gan_model: GanModel):
+def generate_data_samples(arguments: Namespace, gan_model: 'GanModel'):
+    import saving_module
+
     # save a given number of samples
     for i in range(arguments.count):
         # compute the performance metrics
-        synthetic_data, generator_classifier_accuracy = gan_model.generate_synthetic_data()
+        synthetic_data, generator_classifier_accuracy = gan_model.generate_class_samples(
+            classify=not arguments.no_classifier)
         saving_module.save_data_sample(synthetic_data, i + 1,
                                        gan_model.class_label,
                                        generator_classifier_accuracy)
 
 
-def compute_performance_metrics(gan_model: GanModel) -> \
-        Tuple[ndarray, ndarray, ndarray, float]:
-    # GENERATE SYNTHETIC DATA AND GET CLASSIFIER ACCURACY
-    synthetic_data, generator_classifier_accuracy = \
-        gan_model.generate_synthetic_data()
-    print(
-        f'Classifier accuracy for synthetic data: {generator_classifier_accuracy}')
+def export_data_samples(arguments: Namespace, gan_model: 'GanModel'):
+    # stream the segments into a single file, one batch at a time
+    summary = gan_model.export_synthetic_data(arguments.export,
+                                              arguments.export_count,
+                                              class_labels=arguments.export_classes,
+                                              classify=not arguments.no_classifier,
+                                              batch_size=arguments.export_batch_size,
+                                              compression=arguments.compression)
+    print(f'Exported {summary.num_segments} segments to {summary.path}')
+    if summary.classifier_accuracy is not None:
+        print(f'Classifier accuracy for exported data: {summary.classifier_accuracy}')
 
-    # COMPUTE RTS AND STS METRICS
-    mean_RTS_sim, mean_STS_sim = gan_model.compute_rts_sts(synthetic_data)
-    print(f'RTS similarity: {mean_RTS_sim}')
-    print(f'STS similarity: {mean_STS_sim}')
 
-    SFD = gan_model.compute_statistical_feature_distance(
-        syn_data=synthetic_data)
-    print(f'Statistical Feature Distance (SFD): {SFD}')
+def print_performance_metrics(evaluation: 'EvaluationResult') -> None:
+    with phase('console_output'):
+        print(f'Classifier accuracy for synthetic data: {evaluation.classifier_accuracy}')
+        print(f'RTS similarity: {evaluation.mean_rts_similarity}')
+        print(f'STS similarity: {evaluation.mean_sts_similarity}')
 
-    # not entirely sure why this is being computed, but maybe its important
-    one_segment_real = gan_model.compute_one_segment_real()
+        if evaluation.sts_distribution is not None:
+            print(f'STS similarity std: {evaluation.sts_distribution.std}')
+            print(f'STS collapse score (q={evaluation.sts_distribution.collapse_quantile}): '
+                  f'{evaluation.sts_distribution.collapse_score}')
 
-    return synthetic_data, \
-        mean_RTS_sim, \
-        mean_STS_sim, \
-        generator_classifier_accuracy
+        print(f'Statistical Feature Distance (SFD): {evaluation.statistical_feature_distance}')
 
 
-def train_model(arguments: Namespace, gan_model: GanModel):
-    # set the generator classifier accuracy and step
-    generator_classifier_accuracy = 0
-    epoch = 1
-    accuracy_threshold = gan_model.training_parameters.accuracy_threshold
-    epoch_threshold = gan_model.training_parameters.epochs
+def compute_performance_metrics(gan_model: 'GanModel', step: int = 0) -> 'EvaluationResult':
+    # GENERATE SYNTHETIC DATA AND COMPUTE THE CLASSIFIER ACCURACY, RTS, STS AND SFD
+    evaluation: 'EvaluationResult' = gan_model.evaluate(step)
+    print_performance_metrics(evaluation)
+    return evaluation
 
-    epochs = []
-    discriminator_accuracies = []
-    classifier_accuracies = []
-    generator_tricking_accuracies = []
 
-    while generator_classifier_accuracy < accuracy_threshold and epoch < epoch_threshold:
-        # make the wrapper green, so that
-        # the user feels like an elite hacker
-        print(Fore.GREEN)
-        epoch_string = f'------------------------------Epoch: {epoch}------------------------------'
-        print(epoch_string)
-
-        print(Fore.MAGENTA)
+def train_model(arguments: Namespace, gan_model: 'GanModel') -> 'StopDecision':
+    from checkpoint_module import evaluation_metrics
+    from evaluation_module import EvaluationSchedule
+    from stopping_module import StopDecision, StoppingPolicy, logged_metrics, STOP_EPOCH_LIMIT, \
+        STOP_NON_FINITE_LOSS
 
-        # TRAIN DISCRIMINATOR AND GENERATOR AND DISPLAY ACCURACY FOR EACH
-        discriminator_acc, gen_discriminator_acc = gan_model.train_discriminator()
-        print(f'Discriminator accuracy (D ACC): {discriminator_acc}')
-        print(
-            f'Generator accuracy in tricking the discriminator: {gen_discriminator_acc}')
+    # set the step
+    epoch = 1
+    if arguments.resume:
+        # go on with the step after the latest checkpoint
+        epoch = gan_model.restore_latest_checkpoint() + 1
+        if epoch > 1:
+            print(f'Resuming training after epoch {epoch - 1}')
+    accuracy_threshold = gan_model.training_parameters.accuracy_threshold
+    stopping_policy = StoppingPolicy(gan_model.training_parameters)
+    epoch_threshold = gan_model.training_parameters.epochs
 
-        # compute performance metrics
-        synthetic_data, mean_RTS_sim, mean_STS_sim, generator_classifier_accuracy \
-            = compute_performance_metrics(gan_model)
+    # the full evaluation runs on the configured cadence, with a cheap classifier probe in between
+    schedule = EvaluationSchedule(gan_model.training_parameters.evaluation_interval_steps,
+                                  gan_model.training_parameters.evaluation_interval_seconds)
+    schedule.record(epoch - 1)
+    probe_enabled = gan_model.training_parameters.probe_size > 0
+
+    evaluation_worker = None
+    checkpoint_writer = None
+    try:
+        # with a positive lag the evaluations run on a worker, and training may go on for up to
+        # max_evaluation_lag steps before the result of an evaluation has to be known
+        max_evaluation_lag = gan_model.training_parameters.max_evaluation_lag
+        evaluation_worker = gan_model.create_evaluation_worker() if max_evaluation_lag > 0 else None
+
+        # checkpoints are captured every checkpoint_interval_steps steps and written, along with the
+        # metrics of the evaluation of their step, once that evaluation is known
+        checkpoint_interval = gan_model.training_parameters.checkpoint_interval_steps
+        checkpoint_writer = gan_model.create_checkpoint_writer(resume=arguments.resume,
+                                                               overwrite=arguments.overwrite_checkpoints) \
+            if checkpoint_interval > 0 else None
+        pending_checkpoints = {}
+
+        epochs = []
+        discriminator_accuracies = []
+        classifier_accuracies = []
+        generator_tricking_accuracies = []
+
+        # the discriminator accuracies and the duration of the evaluated steps, until their evaluation is recorded
+        step_accuracies = {}
+
+        def record_evaluation(evaluation: 'EvaluationResult') -> None:
+            discriminator_acc, gen_discriminator_acc, step_seconds = step_accuracies.pop(evaluation.step)
+
+            # buffer the training results, which are written to the metrics database in batches
+            if gan_model.write_train_results:
+                with phase('write_results'):
+                    gan_model.write_training_results(current_epoch=evaluation.step,
+                                                     discriminator_accuracy=discriminator_acc,
+                                                     generator_discriminator_acc=gen_discriminator_acc,
+                                                     evaluation=evaluation,
+                                                     step_seconds=step_seconds)
+
+            epochs.append(evaluation.step)
+            discriminator_accuracies.append(discriminator_acc)
+            generator_tricking_accuracies.append(gen_discriminator_acc)
+            classifier_accuracies.append(evaluation.classifier_accuracy)
+
+            if evaluation.step in pending_checkpoints:
+                checkpoint_writer.submit(pending_checkpoints.pop(evaluation.step), evaluation_metrics(evaluation))
+
+            # the stopping policies decide on the most recent evaluation
+            stopping_policy.record(evaluation.step, logged_metrics(evaluation, discriminator_acc, gen_discriminator_acc))
+
+        while stopping_policy.stop_decision is None and epoch < epoch_threshold:
+            mark_step(epoch)
+            # make the wrapper green, so that
+            # the user feels like an elite hacker
+            epoch_string = f'------------------------------Epoch: {epoch}------------------------------'
+            with phase('console_output'):
+                print(Fore.GREEN)
+                print(epoch_string)
+
+                print(Fore.MAGENTA)
+
+            # TRAIN DISCRIMINATOR AND GENERATOR AND DISPLAY ACCURACY FOR EACH
+            step_start = time.perf_counter()
+            with phase('train_step'):
+                step_result = gan_model.train_step()
+            step_seconds = time.perf_counter() - step_start
+            if stopping_policy.check_losses(epoch, step_result.discriminator_losses,
+                                            step_result.generator_losses) is not None:
+                # nothing is left to evaluate or to checkpoint once the weights diverged
+                print(Fore.RED)
+                print(f'Non-finite losses at epoch {epoch}: {stopping_policy.stop_decision.detail}')
+                break
+            discriminator_acc = step_result.discriminator_accuracy
+            gen_discriminator_acc = step_result.generator_discriminator_accuracy
+            with phase('console_output'):
+                print(f'Discriminator accuracy (D ACC): {discriminator_acc}')
+                print(
+                    f'Generator accuracy in tricking the discriminator: {gen_discriminator_acc}')
+
+            # the last step is always evaluated, and so is a step whose probe reaches the threshold,
+            # so that the run stops without waiting for the next scheduled evaluation
+            is_last_step = epoch + 1 >= epoch_threshold
+            is_checkpoint_step = checkpoint_writer is not None and (epoch % checkpoint_interval == 0 or is_last_step)
+            evaluate = schedule.is_due(epoch) or is_last_step or is_checkpoint_step
+            if not evaluate and probe_enabled:
+                with phase('probe'):
+                    probe_accuracy = gan_model.probe_classifier_accuracy()
+                with phase('console_output'):
+                    print(f'Classifier accuracy for synthetic data (probe): {probe_accuracy}')
+                evaluate = probe_accuracy >= accuracy_threshold
+
+            if evaluate:
+                schedule.record(epoch)
+                step_accuracies[epoch] = (discriminator_acc, gen_discriminator_acc, step_seconds)
+                if is_checkpoint_step:
+                    # captured before the evaluation draws from the random generators
+                    pending_checkpoints[epoch] = gan_model.capture_checkpoint(epoch)
+                if evaluation_worker is None:
+                    # compute performance metrics, the stopping check uses the most recent evaluation
+                    record_evaluation(compute_performance_metrics(gan_model, epoch))
+                else:
+                    evaluation_worker.submit(gan_model.snapshot_weights(epoch))
+
+            if evaluation_worker is not None:
+                # wait for the evaluations that would otherwise lag more than max_evaluation_lag steps behind
+                for evaluation in evaluation_worker.collect(epoch if is_last_step else epoch - max_evaluation_lag):
+                    print(f'Evaluation of epoch {evaluation.step}:')
+                    print_performance_metrics(evaluation)
+                    record_evaluation(evaluation)
+
+            # continue the aforesaid sorcery
+            with phase('console_output'):
+                print(Fore.GREEN)
+                print('-' * len(epoch_string))
+            epoch += 1
+
+        gan_model.stop_training()
+        stop_decision = stopping_policy.stop_decision or StopDecision(STOP_EPOCH_LIMIT, epoch - 1)
+
+        if evaluation_worker is not None:
+            # the evaluations still running when training stopped belong in the results as well
+            for evaluation in evaluation_worker.collect(epoch):
+                record_evaluation(evaluation)
 
-        # continue the aforesaid sorcery
         print(Fore.GREEN)
-        print('-' * len(epoch_string))
-
-        # write the training results to a csv, note that it does this in
-        # append mode
+        print(f'Training stopped after epoch {stop_decision.step}: {stop_decision.reason}'
+              + (f' ({stop_decision.detail})' if stop_decision.detail else ''))
         if gan_model.write_train_results:
-            gan_model.write_training_results(current_epoch=epoch,
-                                             discriminator_accuracy=discriminator_acc,
-                                             generator_discriminator_acc=gen_discriminator_acc,
-                                             generator_classifier_acc=generator_classifier_accuracy,
-                                             mean_rts_similarity=mean_RTS_sim,
-                                             mean_sts_similarity=mean_STS_sim)
-
-        epochs.append(epoch)
-        discriminator_accuracies.append(discriminator_acc)
-        generator_tricking_accuracies.append(gen_discriminator_acc)
-        classifier_accuracies.append(generator_classifier_accuracy)
-        epoch += 1
-
-    if gan_model.request_save or arguments.save:
+            gan_model.write_stop_reason(stop_decision)
+    finally:
+        # also when training fails, so that no batch, evaluation or checkpoint thread is left
+        # running and the results buffered so far are still written
+        try:
+            gan_model.stop_training()
+            if evaluation_worker is not None:
+                evaluation_worker.close()
+            if checkpoint_writer is not None:
+                checkpoint_writer.close()
+        finally:
+            gan_model.close_training_results()
+
+    if stop_decision.reason == STOP_NON_FINITE_LOSS:
+        print('The diverged models are not saved')
+    elif gan_model.request_save or arguments.save:
         gan_model.save_model_to_directory()
 
     if arguments.show_plot_results:
+        from plotting_module import plot_results
+
         plot_results(epochs,
                      classifier_accuracies,
                      discriminator_accuracies,
@@ -142,21 +309,37 @@ def train_model(arguments: Namespace, gan_model: GanModel):
 
     # end the foolishness
     print(Fore.RESET)
+    return stop_decision
 
 
-def main():
+def run(args: Namespace) -> 'GanModel':
     """
-    Main method.
+    Trains, evaluates or generates, as the command line arguments say.
+
+    :param args: The command line arguments.
+    :return: The GAN model.
     """
-    args = parse_command_line_args()
+    from gan_model import GanModel
 
     # obtain relevant data from the .conf file and create GAN model
-    training_parameters, weights, names, model_data = config_file_parser.ModelConfigParser().parse_config()
+    training_parameters, weights, names, model_data, cache_settings = \
+        config_file_parser.ModelConfigParser().parse_config()
     gan_model = GanModel(training_parameters,
                          weights, names, model_data,
-                         args.config, args.load,
+                         args.config, args.load or args.generate,
                          args.ignore_classifier,
-                         args.ignore_regularization)
+                         args.ignore_regularization,
+                         cache_settings)
+
+    if args.generate:
+        # only the generator is loaded, and the classifier unless --no_classifier is given
+        if not gan_model.pretrained:
+            raise ValueError('Generating needs a pre-trained generator, set exists = True in the MODELS of model.conf')
+        if args.export is not None:
+            export_data_samples(args, gan_model)
+        else:
+            generate_data_samples(args, gan_model)
+        return gan_model
 
     if args.load:
         compute_performance_metrics(gan_model)
@@ -166,6 +349,57 @@ def main():
     if args.save_samples:
         generate_data_samples(args, gan_model)
 
+    if args.export is not None:
+        export_data_samples(args, gan_model)
+    return gan_model
+
+
+
+def main():
+    """
+    Main method.
+    """
+    args = parse_command_line_args()
+
+    if args.profile_startup:
+        # the run is repeated in a child process, whose imports are timed
+        import startup_profiler
+
+        sys.exit(startup_profiler.profile_startup([__file__] + [argument for argument in sys.argv[1:]
+                                                                if argument != '--profile-startup']))
+
+    memory_tracker = None
+    if args.track_memory:
+        from instrumentation_module import MemoryTracker, install
+
+        memory_tracker = install(MemoryTracker())
+
+    phase_timer = None
+    if args.profile or args.trace is not None or args.tensorflow_trace is not None:
+        from instrumentation_module import PhaseTimer, install
+
+        phase_timer = install(PhaseTimer(trace_path=args.trace,
+                                         trace_steps=tuple(args.trace_steps) if args.trace_steps else None,
+                                         tensorflow_log_directory=args.tensorflow_trace))
+
+    gan_model = run(args)
+
+    if phase_timer is not None:
+        from instrumentation_module import uninstall
+
+        # writes the traces as well
+        uninstall(phase_timer)
+        print(phase_timer.format_table())
+        phase_timer.write_report(os.path.join(gan_model.results_directory,
+                                              f'Timing_label_class_{gan_model.class_label}.json'))
+
+    if memory_tracker is not None:
+        from instrumentation_module import uninstall
+
+        uninstall(memory_tracker)
+        print(memory_tracker.format_table())
+        memory_tracker.write_report(os.path.join(gan_model.results_directory,
+                                                 f'Memory_label_class_{gan_model.class_label}.json'))
 
 if __name__ == '__main__':
     # go to the main method
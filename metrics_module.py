@@ -0,0 +1,306 @@
+"""
+Contains the sink of the training results: the metrics of every evaluated step are buffered in
+memory and written in batches to a SQLite database, keyed by the run, the hash of its configuration,
+the class label and the step, so that the runs of a sweep can share one database and be compared
+with a single query. Each run also has a row of its own, with its configuration and why it stopped.
+Usage: python3 metrics_module.py metrics.sqlite [--csv DIRECTORY]
+"""
+
+import argparse as arg_parser
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from argparse import Namespace
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    config_hash TEXT NOT NULL,
+    class_label INTEGER NOT NULL,
+    dataset TEXT,
+    config TEXT,
+    host TEXT,
+    pid INTEGER,
+    started_at REAL,
+    finished_at REAL,
+    stop_reason TEXT,
+    stop_step INTEGER,
+    stop_detail TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    class_label INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    wall_time REAL,
+    discriminator_accuracy REAL,
+    generator_discriminator_accuracy REAL,
+    classifier_accuracy REAL,
+    mean_rts_similarity REAL,
+    mean_sts_similarity REAL,
+    statistical_feature_distance REAL,
+    step_seconds REAL,
+    evaluation_seconds REAL,
+    PRIMARY KEY (run_id, step)
+);
+CREATE INDEX IF NOT EXISTS metrics_by_config ON metrics (config_hash, class_label, step);
+CREATE INDEX IF NOT EXISTS runs_by_config ON runs (config_hash, class_label);
+'''
+
+# the columns of the Results_label_class_<label>.csv files the results used to be written to
+CSV_COLUMNS: Dict[str, str] = {
+    'step': 'Epoch',
+    'discriminator_accuracy': 'Disc_acc',
+    'generator_discriminator_accuracy': 'GenDisc_acc',
+    'classifier_accuracy': 'GenClass_acc',
+    'mean_rts_similarity': 'mean_RTS_sim',
+    'mean_sts_similarity': 'mean_STS_sim'
+}
+
+
+@dataclass(frozen=True)
+class MetricsRow:
+    """
+    The metrics of an evaluated step. The timings are those of the training step and of its evaluation.
+    """
+    step: int
+    discriminator_accuracy: float
+    generator_discriminator_accuracy: float
+    classifier_accuracy: float
+    mean_rts_similarity: float
+    mean_sts_similarity: float
+    statistical_feature_distance: float
+    step_seconds: Optional[float] = None
+    evaluation_seconds: Optional[float] = None
+
+
+def config_hash(*configs: Any) -> str:
+    """
+    Hashes the configuration of a run, so that the runs of the same configuration can be grouped.
+
+    :param configs: Dataclasses (e.g. the training parameters and the weights) or JSON serializable values.
+    :return: A hex digest of 16 characters.
+    """
+    serialized: str = json.dumps([asdict(config) if hasattr(config, '__dataclass_fields__') else config
+                                  for config in configs], sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:16]
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Opens a metrics database, creating it if needed. Several processes may write to it at once.
+
+    :param path: The path of the database.
+    :return: The connection.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection: sqlite3.Connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class MetricsSink:
+    """
+    Buffers the metrics of a run and writes them to a metrics database in batches, of flush_rows
+    rows or every flush_seconds seconds, whichever comes first, and when the sink is closed.
+    """
+
+    def __init__(self,
+                 path: str,
+                 config_hash_value: str,
+                 class_label: int,
+                 dataset: str = '',
+                 config: Optional[dict] = None,
+                 run_id: Optional[str] = None,
+                 flush_rows: int = 100,
+                 flush_seconds: float = 30.0):
+        """
+        :param path: The path of the database.
+        :param config_hash_value: The hash of the configuration of the run, see config_hash.
+        :param class_label: The class label of the run.
+        :param dataset: The dataset of the run.
+        :param config: The configuration of the run, stored as JSON with the run.
+        :param run_id: The ID of the run, a new one by default. The metrics of a run which is already in
+        the database are added to its metrics, and replace those of the same steps.
+        :param flush_rows: The number of buffered rows which are written at once.
+        :param flush_seconds: The number of seconds after which buffered rows are written anyway.
+        """
+        self.path: str = path
+        self.run_id: str = run_id if run_id is not None else uuid.uuid4().hex
+        self.config_hash: str = config_hash_value
+        self.class_label: int = class_label
+        self.flush_rows: int = max(1, flush_rows)
+        self.flush_seconds: float = flush_seconds
+        self.started_at: float = time.time()
+        self._rows: List[tuple] = []
+        self._last_flush: float = time.monotonic()
+        self._connection: Optional[sqlite3.Connection] = connect(path)
+        with self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO runs (run_id, config_hash, class_label, dataset, config, '
+                                     'host, pid, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (self.run_id, self.config_hash, class_label, dataset,
+                                      json.dumps(config, sort_keys=True, default=str) if config is not None else None,
+                                      socket.gethostname(), os.getpid(), self.started_at))
+
+    def record(self, row: MetricsRow) -> None:
+        """
+        Buffers the metrics of a step.
+
+        :param row: The metrics.
+        """
+        self._rows.append((self.run_id, self.config_hash, self.class_label, row.step, time.time() - self.started_at,
+                           row.discriminator_accuracy, row.generator_discriminator_accuracy, row.classifier_accuracy,
+                           row.mean_rts_similarity, row.mean_sts_similarity, row.statistical_feature_distance,
+                           row.step_seconds, row.evaluation_seconds))
+        if len(self._rows) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered rows in a single transaction.
+        """
+        if self._rows and self._connection is not None:
+            with self._connection:
+                self._connection.executemany('INSERT OR REPLACE INTO metrics VALUES '
+                                             '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self._rows)
+            self._rows = []
+        self._last_flush = time.monotonic()
+
+    def record_stop(self, step: int, reason: str, detail: str = '') -> None:
+        """
+        Records why and after which step the run stopped.
+
+        :param step: The last step trained.
+        :param reason: The reason, one of the STOP_ reasons of stopping_module.py.
+        :param detail: What the reason was triggered by.
+        """
+        self.flush()
+        with self._connection:
+            self._connection.execute('UPDATE runs SET finished_at = ?, stop_reason = ?, stop_step = ?, stop_detail = ? '
+                                     'WHERE run_id = ?', (time.time(), reason, step, detail, self.run_id))
+
+    def close(self) -> None:
+        """
+        Writes the buffered rows and closes the database.
+        """
+        if self._connection is not None:
+            self.flush()
+            self._connection.close()
+            self._connection = None
+
+
+def read_metrics(path: str,
+                 config_hash_value: Optional[str] = None,
+                 class_label: Optional[int] = None,
+                 run_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Reads the metrics of a database, ordered by run and step.
+
+    :param path: The path of the database.
+    :param config_hash_value: Only the metrics of the runs of this configuration.
+    :param class_label: Only the metrics of the runs of this class label.
+    :param run_id: Only the metrics of this run.
+    :return: A dictionary per row.
+    """
+    conditions: List[str] = []
+    parameters: List[Any] = []
+    for column, value in (('config_hash', config_hash_value), ('class_label', class_label), ('run_id', run_id)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            parameters.append(value)
+    where: str = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+    connection: sqlite3.Connection = connect(path)
+    connection.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in connection.execute(
+            f'SELECT * FROM metrics{where} ORDER BY run_id, step', parameters)]
+    finally:
+        connection.close()
+
+
+def latest_unfinished_run(path: str, dataset: str, class_label: int) -> Optional[str]:
+    """
+    Finds the run which a resumed run goes on with: the latest run of the same dataset and class
+    label (as the checkpoints are) which did not record why it stopped. Its configuration may differ,
+    e.g. by the number of epochs.
+
+    :param path: The path of the database.
+    :param dataset: The dataset of the run.
+    :param class_label: The class label of the run.
+    :return: The ID of the run, or None.
+    """
+    if not os.path.exists(path):
+        return None
+    connection: sqlite3.Connection = connect(path)
+    try:
+        row: Optional[tuple] = connection.execute(
+            'SELECT run_id FROM runs WHERE dataset = ? AND class_label = ? AND stop_reason IS NULL '
+            'ORDER BY started_at DESC LIMIT 1', (dataset, class_label)).fetchone()
+        return row[0] if row is not None else None
+    finally:
+        connection.close()
+
+
+def read_runs(path: str) -> List[Dict[str, Any]]:
+    """
+    :param path: The path of the database.
+    :return: A dictionary per run, ordered by start time.
+    """
+    connection: sqlite3.Connection = connect(path)
+    connection.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in connection.execute('SELECT * FROM runs ORDER BY started_at')]
+    finally:
+        connection.close()
+
+
+def export_csv(path: str, directory: str) -> List[str]:
+    """
+    Exports the metrics of every run to a CSV file in the format of the former results,
+    <directory>/Results_label_class_<label>_<run_id>.csv.
+
+    :param path: The path of the database.
+    :param directory: The directory of the CSV files.
+    :return: The paths of the CSV files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths: List[str] = []
+    for run in read_runs(path):
+        filename: str = os.path.join(directory, f'Results_label_class_{run["class_label"]}_{run["run_id"]}.csv')
+        with open(filename, mode='w', encoding='utf-8') as f:
+            f.write(','.join(CSV_COLUMNS.values()) + '\n')
+            for row in read_metrics(path, run_id=run['run_id']):
+                f.write(','.join(str(row[column]) for column in CSV_COLUMNS) + '\n')
+        paths.append(filename)
+    return paths
+
+
+def parse_cli_arguments() -> Namespace:
+    """
+    Utility function that parses command line arguments
+    """
+    parser = arg_parser.ArgumentParser(description='Lists the runs of a metrics database')
+    parser.add_argument('database', type=str,
+                        help='The metrics database, e.g. metrics.sqlite')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='Export the metrics of every run to a CSV file in this directory')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cli_args: Namespace = parse_cli_arguments()
+    if cli_args.csv is not None:
+        for csv_path in export_csv(cli_args.database, cli_args.csv):
+            print(csv_path)
+    else:
+        for run_row in read_runs(cli_args.database):
+            print(f'{run_row["run_id"]}  config {run_row["config_hash"]}  class {run_row["class_label"]}  '
+                  f'stopped after {run_row["stop_step"]}: {run_row["stop_reason"]}')
@@ -3,17 +3,23 @@
 Model critique functions.
 
 """
+from __future__ import annotations
+
 import numpy as np
-import tensorflow as tf
-from keras import backend
-from tensorflow_model_remediation.common.types import TensorType
-from tensorflow_model_remediation.min_diff.losses import MMDLoss
-from typing import Optional, Any
+from typing import Optional, Any, TYPE_CHECKING
+
+# tensorflow, keras and tensorflow_model_remediation are only needed by the loss functions, and
+# imported there, so that the NumPy statistical features can be used without them
+if TYPE_CHECKING:
+    from tensorflow_model_remediation.common.types import TensorType
+
+# the statistical features, in the order models.create_statistical_feature_net computes them
+STATISTICAL_FEATURES = ('mean', 'std', 'var', 'max', 'min', 'p2p', 'amp', 'rms', 's2e')
 
 
 def maximal_mean_discrepancy(input_tensor: TensorType,
                              output_tensor: TensorType,
-                             predictions_transform: Any = tf.sigmoid,
+                             predictions_transform: Any = None,
                              sample_weight: Optional[TensorType] = None,
                              kernel='gaussian') -> int:
     """
@@ -28,12 +34,17 @@ def maximal_mean_discrepancy(input_tensor: TensorType,
     :param output_tensor: The predictions, which is a tensor type. (you probably
     want to input a tensor)
     :param predictions_transform: The transformation function, we default to
-    sigmoid.
+    tf.sigmoid.
     :param sample_weight: The sample weight.
     :param kernel: The kernel that is being used.
     :returns: The maximum mean discrepancy.
 
     """
+    import tensorflow as tf
+    from tensorflow_model_remediation.min_diff.losses import MMDLoss
+
+    if predictions_transform is None:
+        predictions_transform = tf.sigmoid
     mmd_loss = MMDLoss(kernel=kernel,
                        predictions_transform=predictions_transform,
                        name='mmd_loss')
@@ -55,6 +66,8 @@ def wasserstein_distance(y_true: TensorType,
     :param y_pred: The values observed as an output.
     :returns: The computed distance between the distributions.
     """
+    from keras import backend
+
     return backend.mean(y_true * y_pred)
 
 
@@ -68,6 +81,8 @@ def euc_dist_loss(actual_output_data: TensorType,
     :param expected_output_data: The expected output data as a Tensor.
     :return: The euclidean distance loss as a Tensor.
     """
+    from keras import backend
+
     return backend.sqrt(
         backend.sum(backend.square(actual_output_data - expected_output_data),
                     axis=-1))
@@ -77,12 +92,65 @@ def compute_statistical_feature_distance(real_features: np.ndarray,
                                          synthetic_features: np.ndarray) -> np.ndarray:
     """
     Utility function that computes the average statistical feature distance during training.
+    Either argument may be a single feature vector, which is broadcast against the other.
 
     :param real_features: A numpy array of real features.
     :param synthetic_features: A numpy array of synthetic features.
     :return: A numpy array the represents the statistical feature distance.
     """
     distance_vector: np.ndarray = np.sqrt(
-        np.sum(np.square(real_features - synthetic_features), axis=1))
+        np.sum(np.square(real_features - synthetic_features), axis=-1))
     SFD: np.ndarray = np.mean(distance_vector)
     return SFD
+
+
+def compute_statistical_features(input_data: np.ndarray, num_features: int = len(STATISTICAL_FEATURES)) -> np.ndarray:
+    """
+    A vectorized NumPy version of the statistical feature net (models.create_statistical_feature_net),
+    which computes the same features (mean, std, var, max, min, p2p, amp, rms and s2e of every
+    channel over time) in float32 without the overhead of a Keras predict.
+
+    :param input_data: Data of the shape (num_segments, seq_length, num_channels).
+    :param num_features: The number of features, which must match STATISTICAL_FEATURES.
+    :return: A numpy array of shape (num_segments, num_features * num_channels), laid out
+    feature by feature like the output of the statistical feature net.
+    """
+    if num_features != len(STATISTICAL_FEATURES):
+        raise ValueError(f'The statistical feature net computes {len(STATISTICAL_FEATURES)} '
+                         f'features, not {num_features}')
+
+    data: np.ndarray = np.asarray(input_data, dtype=np.float32)
+    mean: np.ndarray = np.mean(data, axis=1)
+    variance: np.ndarray = np.mean(np.square(data - mean[:, np.newaxis, :]), axis=1)
+    x_max: np.ndarray = np.max(data, axis=1)
+    x_min: np.ndarray = np.min(data, axis=1)
+
+    features: np.ndarray = np.stack((mean,
+                                     np.sqrt(variance),
+                                     variance,
+                                     x_max,
+                                     x_min,
+                                     x_max - x_min,
+                                     x_max - mean,
+                                     np.sqrt(np.einsum('stc,stc->sc', data, data)),
+                                     data[:, -1, :] - data[:, 0, :]), axis=1)
+    return features.reshape(len(data), -1)
+
+
+def compute_mean_statistical_features(input_data: np.ndarray,
+                                      num_features: int = len(STATISTICAL_FEATURES),
+                                      chunk_size: int = 4096) -> np.ndarray:
+    """
+    Computes the mean statistical feature vector of a (possibly large) dataset, one chunk
+    of segments at a time so that only a chunk is ever converted to float32.
+
+    :param input_data: Data of the shape (num_segments, seq_length, num_channels).
+    :param num_features: The number of features, which must match STATISTICAL_FEATURES.
+    :param chunk_size: The number of segments processed at a time.
+    :return: A numpy array of shape (num_features * num_channels,).
+    """
+    feature_sum: np.ndarray = np.zeros(num_features * input_data.shape[2], dtype=np.float64)
+    for start in range(0, len(input_data), chunk_size):
+        feature_sum += np.sum(compute_statistical_features(input_data[start:start + chunk_size], num_features),
+                              axis=0, dtype=np.float64)
+    return (feature_sum / len(input_data)).astype(np.float32)
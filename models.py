@@ -9,7 +9,7 @@ import numpy as np
 import tensorflow as tf
 from keras import backend as keras_backend
 from keras.engine.keras_tensor import KerasTensor
-from keras.layers import Dense, LSTM, Dropout, Input, Lambda
+from keras.layers import Dense, LSTM, Dropout, Input, Lambda, Embedding, Flatten, RepeatVector, Concatenate
 from keras.models import Model, Functional
 from tensorflow.keras.optimizers import SGD
 from keras.type.types import Layer
@@ -52,6 +52,72 @@ def create_generator(seq_length: int, num_channels: int, latent_dim: int) -> Fun
     return generator
 
 
+def embed_class_label(class_input: KerasTensor, seq_length: int, num_classes: int,
+                      embedding_dim: int) -> KerasTensor:
+    """
+    Embeds an integer class label and repeats the embedding at every time-step, so that it can be
+    concatenated to the per time-step input of a conditional generator or discriminator.
+
+    :param class_input: The class label input of the shape (1,).
+    :param seq_length: The sequence length.
+    :param num_classes: The number of classes.
+    :param embedding_dim: The dimension of the class embedding.
+    :return: The embedding of the shape (seq_length, embedding_dim).
+    """
+    embedding: KerasTensor = Embedding(num_classes, embedding_dim)(class_input)
+    embedding: KerasTensor = Flatten()(embedding)
+    return RepeatVector(seq_length)(embedding)
+
+
+def create_conditional_discriminator(seq_length: int, num_channels: int, num_classes: int,
+                                     embedding_dim: int) -> Functional:
+    """
+    Creates the discriminator architecture of create_discriminator, conditioned on the class label,
+    whose embedding is concatenated to the (dropped out) channels at every time-step.
+
+    :param seq_length: The sequence length.
+    :param num_channels: The number of channels.
+    :param num_classes: The number of classes.
+    :param embedding_dim: The dimension of the class embedding.
+    :return: A keras Functional object that represents the discriminator, whose inputs are the data and the class label.
+    """
+    discriminator_input: KerasTensor = Input(shape=(seq_length, num_channels))
+    class_input: KerasTensor = Input(shape=(1,), dtype='int32')
+    discriminator: KerasTensor = Dropout(.5)(discriminator_input)
+    discriminator: KerasTensor = Concatenate()([discriminator,
+                                                embed_class_label(class_input, seq_length, num_classes,
+                                                                  embedding_dim)])
+    discriminator: KerasTensor = LSTM(100, activation="tanh")(discriminator)
+    discriminator: KerasTensor = Dense(1, activation="sigmoid")(discriminator)
+    discriminator: Functional = Model(inputs=[discriminator_input, class_input], outputs=discriminator, name="D")
+    return discriminator
+
+
+def create_conditional_generator(seq_length: int, num_channels: int, latent_dim: int, num_classes: int,
+                                 embedding_dim: int) -> Functional:
+    """
+    Creates the generator architecture of create_generator, conditioned on the class label,
+    whose embedding is concatenated to the (dropped out) latent input at every time-step.
+
+    :param seq_length: The sequence length.
+    :param num_channels: The number of channels.
+    :param latent_dim: The number of latent dimensions.
+    :param num_classes: The number of classes.
+    :param embedding_dim: The dimension of the class embedding.
+    :return: A keras Functional object that represents the generator, whose inputs are the noise and the class label.
+    """
+    generator_input: KerasTensor = Input(shape=(seq_length, latent_dim))
+    class_input: KerasTensor = Input(shape=(1,), dtype='int32')
+    generator: KerasTensor = Dropout(.5)(generator_input)
+    generator: KerasTensor = Concatenate()([generator,
+                                            embed_class_label(class_input, seq_length, num_classes, embedding_dim)])
+    generator: KerasTensor = LSTM(128, return_sequences=True, activation="tanh")(generator)
+    generator: KerasTensor = Dropout(.5)(generator)
+    generator: KerasTensor = Dense(num_channels, activation="tanh")(generator)
+    generator: Functional = Model(inputs=[generator_input, class_input], outputs=generator)
+    return generator
+
+
 def create_statistical_feature_net(seq_length: int, num_channels: int, num_features: int) -> Functional:
     """
     Creates the full network for computing the statistical feature vector that
@@ -4,20 +4,28 @@ data (currently written for tri-axial data but could be easily modified for
 applications with a different number of sensor channels)
 """
 
-import matplotlib.patches as mpl_patches
-import matplotlib.pyplot as plt
+import os
+
 import matplotlib
-import tkinter
 import numpy as np
 from typing import List
 
-matplotlib.use('tkagg')
+# headless by default (unless MPLBACKEND says otherwise), so that importing this module needs
+# neither a display nor tkinter, which is only loaded once a plot is shown
+HEADLESS_BACKEND = 'agg'
+INTERACTIVE_BACKEND = 'tkagg'
+if 'MPLBACKEND' not in os.environ:
+    matplotlib.use(HEADLESS_BACKEND)
+
+import matplotlib.pyplot as plt
 
 
 def plot_results(epochs: List[int],
                  class_acc: List[float],
                  disc_acc: List[float],
                  gen_acc: List[float]):
+    if 'MPLBACKEND' not in os.environ:
+        plt.switch_backend(INTERACTIVE_BACKEND)
     plt.figure(figsize=(12, 9))
     plt.style.use('fivethirtyeight')
     plt.xticks(fontsize=15)
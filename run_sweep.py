@@ -0,0 +1,283 @@
+"""
+Runs a sweep of experiments over a grid of datasets, class labels, ablations and hyperparameters on a
+pool of local worker processes. Every job runs main.py in its own working directory, with its own
+model.conf and .toml file, and the completed jobs are recorded in a state file, so that an interrupted
+sweep resumes where it stopped when it is run again.
+Usage: python3 run_sweep.py sweep.toml
+
+An example grid, where every key of [hyperparameters] is a TRAINING_PARAMETERS key of model.conf:
+
+    output_directory = "sweep"
+    workers = 2
+
+    [datasets.adlnormal]
+    data_file_path = "CASAS_adlnormal_dataset.h5"
+    classifier_path = "LSTM_adlnormal.h5"
+    labels = [0, 1, 2, 3, 4]
+    ablations = ["CR", "C", "R", "none"]
+
+    [hyperparameters]
+    discriminator_learning_rate = [0.01, 0.001]
+"""
+
+import argparse as arg_parser
+import configparser
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import toml
+
+from train_all_classes import ABLATIONS, METRICS_DATABASE
+
+STATE_FILENAME = 'sweep_state.json'
+SUCCESS = 'success'
+FAILURE = 'failure'
+RUNNING = 'running'
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+@dataclass(frozen=True)
+class SweepJob:
+    """
+    A single experiment of a sweep.
+    """
+    dataset_name: str
+    data_file_path: str
+    classifier_path: str
+    class_label: int
+    ignore_classifier: bool
+    ignore_sfd: bool
+    hyperparameters: Tuple[Tuple[str, str], ...]
+
+    @property
+    def name(self) -> str:
+        """
+        The name of the job, which is also the name of its working directory.
+        """
+        classifier: str = '' if self.ignore_classifier else 'C'
+        regularizer: str = '' if self.ignore_sfd else 'R'
+        name: str = f'{self.dataset_name}_{self.class_label}{classifier}{regularizer}'
+        for key, value in self.hyperparameters:
+            name += f'__{key}-{value}'
+        return name
+
+
+def expand_grid(grid: dict) -> List[SweepJob]:
+    """
+    Expands a sweep grid into the list of its jobs.
+
+    :param grid: The parsed sweep .toml file.
+    :return: The jobs, every dataset, label and ablation combined with every hyperparameter combination.
+    """
+    hyperparameters: dict = grid.get('hyperparameters', {})
+    keys: List[str] = sorted(hyperparameters)
+    value_lists: List[list] = [hyperparameters[key] if isinstance(hyperparameters[key], list)
+                               else [hyperparameters[key]] for key in keys]
+
+    jobs: List[SweepJob] = []
+    for dataset_name, dataset in grid['datasets'].items():
+        for class_label in dataset['labels']:
+            for ablation in dataset.get('ablations', ['CR']):
+                if ablation not in ABLATIONS:
+                    raise ValueError(f'Unknown ablation "{ablation}", expected one of {list(ABLATIONS)}')
+                for values in itertools.product(*value_lists):
+                    jobs.append(SweepJob(dataset_name=dataset_name,
+                                         data_file_path=os.path.abspath(dataset['data_file_path']),
+                                         classifier_path=os.path.abspath(dataset['classifier_path']),
+                                         class_label=int(class_label),
+                                         ignore_classifier=ABLATIONS[ablation][0],
+                                         ignore_sfd=ABLATIONS[ablation][1],
+                                         hyperparameters=tuple(zip(keys, [str(value) for value in values]))))
+    return jobs
+
+
+class SweepState:
+    """
+    The state file of a sweep, mapping the name of every job started to its status.
+    It is rewritten atomically whenever a job starts or finishes.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The path of the state file, which is created if it does not exist.
+        """
+        self.path: str = path
+        self.lock: threading.Lock = threading.Lock()
+        self.jobs: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as state_file:
+                self.jobs = json.load(state_file)['jobs']
+
+    def is_complete(self, job: SweepJob) -> bool:
+        """
+        :param job: A job.
+        :return: Whether the job already ran successfully.
+        """
+        with self.lock:
+            return self.jobs.get(job.name, {}).get('status') == SUCCESS
+
+    def was_started(self, job: SweepJob) -> bool:
+        """
+        :param job: A job.
+        :return: Whether the job was started by an earlier run of the sweep.
+        """
+        with self.lock:
+            return job.name in self.jobs
+
+    def update(self, job: SweepJob, **record) -> None:
+        """
+        Records the status of a job.
+
+        :param job: The job.
+        :param record: The status and any other information about the job.
+        """
+        with self.lock:
+            self.jobs[job.name] = record
+            temporary_path: str = f'{self.path}.tmp'
+            with open(temporary_path, mode='w', encoding='utf-8') as state_file:
+                json.dump({'jobs': self.jobs}, state_file, indent=2)
+            os.replace(temporary_path, self.path)
+
+
+def write_job_files(job: SweepJob, job_directory: str, base_config: configparser.ConfigParser) -> str:
+    """
+    Writes the model.conf and the .toml file of a job to its working directory.
+
+    :param job: The job.
+    :param job_directory: The working directory of the job.
+    :param base_config: The model.conf every job starts from.
+    :return: The name of the .toml file.
+    """
+    model_config: configparser.ConfigParser = configparser.ConfigParser()
+    model_config.read_dict(base_config)
+    for key, value in job.hyperparameters:
+        model_config['TRAINING_PARAMETERS'][key] = value
+    if not model_config.has_section('MODELS'):
+        model_config.add_section('MODELS')
+    model_config['MODELS']['generator_filename'] = f'G_{job.name}.h5'
+    model_config['MODELS']['discriminator_filename'] = f'D_{job.name}.h5'
+    model_config['MODELS']['directory'] = 'models'
+    model_config['MODELS']['exists'] = 'False'
+    # the jobs share the cache of the directory the sweep is run from
+    if not model_config.has_section('CACHE'):
+        model_config.add_section('CACHE')
+    model_config['CACHE']['directory'] = os.path.abspath(model_config['CACHE'].get('directory', '.supergan_cache'))
+    with open(os.path.join(job_directory, 'model.conf'), mode='w', encoding='utf-8') as config_file:
+        model_config.write(config_file)
+
+    toml_filename: str = f'{job.name}.toml'
+    with open(os.path.join(job_directory, toml_filename), mode='w', encoding='utf-8') as toml_file:
+        toml.dump({'data_file_path': job.data_file_path,
+                   'classifier_path': job.classifier_path,
+                   'class_label': job.class_label,
+                   'write_train_results': True,
+                   # the jobs share the metrics database of the sweep
+                   'metrics_database': os.path.join(os.path.dirname(os.path.abspath(job_directory)),
+                                                    METRICS_DATABASE)}, toml_file)
+    return toml_filename
+
+
+def run_job(job: SweepJob, output_directory: str, base_config: configparser.ConfigParser, state: SweepState) -> bool:
+    """
+    Runs main.py for a job in its own working directory, with its output written to stdout.txt and stderr.txt.
+
+    :param job: The job.
+    :param output_directory: The directory holding the working directories of the jobs.
+    :param base_config: The model.conf every job starts from.
+    :param state: The state of the sweep.
+    :return: Whether the job succeeded.
+    """
+    job_directory: str = os.path.join(output_directory, job.name)
+    os.makedirs(job_directory, exist_ok=True)
+    toml_filename: str = write_job_files(job, job_directory, base_config)
+
+    command: List[str] = [sys.executable, MAIN_PATH, toml_filename, '--save']
+    if job.ignore_classifier:
+        command.append('-C')
+    if job.ignore_sfd:
+        command.append('-R')
+    # a job which was interrupted or failed goes on from its latest checkpoint, if it has one
+    if state.was_started(job):
+        command.append('--resume')
+
+    state.update(job, status=RUNNING, directory=job_directory)
+    print(f'RUNNING EXPERIMENT {job.name}')
+    start: float = time.perf_counter()
+    with open(os.path.join(job_directory, 'stdout.txt'), mode='w', encoding='utf-8') as stdout_file, \
+            open(os.path.join(job_directory, 'stderr.txt'), mode='w', encoding='utf-8') as stderr_file:
+        return_code: int = subprocess.call(command, cwd=job_directory, stdout=stdout_file, stderr=stderr_file)
+
+    status: str = SUCCESS if return_code == 0 else FAILURE
+    state.update(job, status=status, directory=job_directory, return_code=return_code,
+                 seconds=time.perf_counter() - start)
+    print(f'EXPERIMENT {job.name} RESULTING STATUS: {status}')
+    return return_code == 0
+
+
+def run_sweep(grid: dict, base_config_path: str = 'model.conf', workers: int = 1) -> Dict[str, int]:
+    """
+    Runs the jobs of a sweep which are not complete yet.
+
+    :param grid: The parsed sweep .toml file.
+    :param base_config_path: The model.conf every job starts from.
+    :param workers: The number of jobs running at the same time.
+    :return: The number of jobs skipped because they were complete, succeeded and failed.
+    """
+    output_directory: str = os.path.abspath(grid.get('output_directory', 'sweep'))
+    os.makedirs(output_directory, exist_ok=True)
+    state: SweepState = SweepState(os.path.join(output_directory, STATE_FILENAME))
+
+    base_config: configparser.ConfigParser = configparser.ConfigParser()
+    if not base_config.read(base_config_path):
+        raise IOError(f'Could not read "{base_config_path}"')
+
+    jobs: List[SweepJob] = expand_grid(grid)
+    pending_jobs: List[SweepJob] = [job for job in jobs if not state.is_complete(job)]
+    print(f'{len(jobs) - len(pending_jobs)} of {len(jobs)} jobs already complete')
+
+    # the jobs are separate processes, the threads only wait for them
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results: List[bool] = list(executor.map(lambda job: run_job(job, output_directory, base_config, state),
+                                                pending_jobs))
+
+    return {'skipped': len(jobs) - len(pending_jobs),
+            'succeeded': sum(results),
+            'failed': len(results) - sum(results)}
+
+
+def parse_cli_arguments() -> Namespace:
+    """
+    Utility function that parses command line arguments
+    """
+    parser = arg_parser.ArgumentParser(description='''
+                                                   Runs a resumable sweep of SuperGAN experiments
+                                                   on a pool of local worker processes
+                                                   ''')
+    parser.add_argument('grid', type=str,
+                        help='The .toml file describing the grid of the sweep')
+    parser.add_argument('-b', '--base-config', type=str, default='model.conf',
+                        help='The model.conf the configuration of every job starts from')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='The number of jobs running at the same time, overrides the grid file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cli_args: Namespace = parse_cli_arguments()
+    sweep_grid: dict = toml.load(cli_args.grid)
+    counts: Dict[str, int] = run_sweep(sweep_grid,
+                                       base_config_path=cli_args.base_config,
+                                       workers=cli_args.workers if cli_args.workers is not None
+                                       else sweep_grid.get('workers', 1))
+    print(f'{counts["succeeded"]} succeeded, {counts["failed"]} failed, {counts["skipped"]} skipped')
+    sys.exit(1 if counts['failed'] > 0 else 0)
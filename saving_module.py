@@ -3,6 +3,7 @@ Contains functions necessary for saving training results and generator weights.
 """
 
 import os
+from typing import Optional
 
 import h5py
 import numpy as np
@@ -24,7 +25,7 @@ def save_generated_data(model: Functional,
     :param accuracy: The classifier accuracy.
     :return: Nothing, since this is a void function.
     """
-    filename = f'G_epoch{epoch}_label_class{class_label}_acc{int(accuracy * 100)}.h5'
+    filename = model_filename('G', epoch, class_label, accuracy)
 
     save_keras_model(model, save_directory, filename)
 
@@ -45,18 +46,33 @@ def save_discriminator_data(model: Functional,
     :param accuracy: The classifier accuracy.
     :return: Nothing, since this is a void function.
     """
-    filename = f'D_epoch{epoch}_label_class{class_label}_acc{int(accuracy * 100)}.h5'
+    filename = model_filename('D', epoch, class_label, accuracy)
 
     save_keras_model(model, save_directory, filename)
 
 
-def save_keras_model(model: Functional, save_directory: str, filename: str) -> None:
+def model_filename(prefix: str, epoch: int, class_label: int, accuracy: float) -> str:
+    """
+    The name of the file of a model (or of anything saved along with it) after a given epoch.
+
+    :param prefix: What the file holds, e.g. G for the generator and D for the discriminator.
+    :param epoch: The current "iteration" that the model corresponds to.
+    :param class_label: The class label that is being used.
+    :param accuracy: The classifier accuracy.
+    :return: The filename.
+    """
+    return f'{prefix}_epoch{epoch}_label_class{class_label}_acc{int(accuracy * 100)}.h5'
+
+
+def save_keras_model(model: Functional, save_directory: str, filename: str, atomic: bool = False) -> None:
     """
     Save a keras model to a given directory
 
     :param model: A keras model to be saved.
     :param save_directory: The directory that all of this data should be saved.
     :param filename: The name of a file.
+    :param atomic: Whether to write a temporary file first and rename it, so that the file is
+    either complete or missing, never partially written.
     :return: Nothing.
     """
     if not os.path.exists(save_directory):
@@ -65,17 +81,22 @@ def save_keras_model(model: Functional, save_directory: str, filename: str) -> N
 
     # Zero: There is a warning here (not an error, saving works) and it is weird,
     # having trouble figuring it out!
-    model.save(filepath)
+    if atomic:
+        temporary_filepath = f'{filepath}.tmp'
+        model.save(temporary_filepath, save_format='h5')
+        os.replace(temporary_filepath, filepath)
+    else:
+        model.save(filepath)
 
 
-def save_data_sample(data: np.ndarray, iteration: int, class_label: int, accuracy: float) -> None:
+def save_data_sample(data: np.ndarray, iteration: int, class_label: int, accuracy: Optional[float]) -> None:
     """
     Saves data samples.
 
     :param data: The data to be saved.
     :param iteration: The iteration of the data save.
     :param class_label: The class label, indicates the filtered value.
-    :param accuracy: The classifier accuracy of the given data.
+    :param accuracy: The classifier accuracy of the given data, None if the classifier was not run.
     :return: Nothing, void function.
     """
     folder_name = 'synthetic_samples'
@@ -90,34 +111,3 @@ def save_data_sample(data: np.ndarray, iteration: int, class_label: int, accurac
         if not os.path.exists('synthetic_samples'):
             os.mkdir('synthetic_samples')
         data_saver.create_dataset('X', data=data)
-
-
-def write_results(epoch: int, class_label: int, discriminator_accuracy: float, generator_discriminator_accuracy: float,
-                  generator_class_accuracy: float, mean_rts_sim: np.ndarray, mean_sts_sim: np.ndarray) -> None:
-    """
-    A function that writes training results.
-
-    :param epoch: The current "iteration" that that the results are being written.
-    :param class_label: The class label that is being used.
-    :param discriminator_accuracy: The accuracy of the discriminator.
-    :param generator_discriminator_accuracy: The accuracy of the generator.
-    :param generator_class_accuracy: The accuracy of the generator class.
-    :param mean_rts_sim: The mean rts similarity, I think this is actually a float but VSCode was complaining
-    so in the future if typing for numpy gets better do change this to a 32-bit numpy float or a 64-bit numpy float.
-    :param mean_sts_sim: The mean sts similarity, I think this is actually a float but VSCode was complaining
-    so in the future if typing for numpy gets better do change this to a 32-bit numpy float or a 64-bit numpy float.
-    :return: Nothing, since this is a void function.
-    """
-    filename = f'Results_label_class_{class_label}.csv'
-
-    # make sure that we aren't appending to the last one
-    if epoch == 1 and os.path.exists(filename):
-        os.remove(filename)
-
-    header = 'Epoch,Disc_acc,GenDisc_acc,GenClass_acc,mean_RTS_sim,mean_STS_sim\n'
-    to_write = f'{epoch},{discriminator_accuracy},{generator_discriminator_accuracy},{generator_class_accuracy},' \
-               f'{mean_rts_sim},{mean_sts_sim}\n'
-    with open(filename, mode='a', encoding='utf-8') as f:
-        if epoch == 1:  # this helps to separate multiple results if the code is run multiple times
-            f.write(header)
-        f.write(to_write)
@@ -0,0 +1,123 @@
+"""
+Reports where the startup time of a script goes: the script is run in a child process with
+python -X importtime, and the time spent importing each module is summarized once it exits,
+by module and by top-level package.
+Usage: python3 startup_profiler.py main.py config.toml -g
+       python3 main.py config.toml -g --profile-startup
+"""
+
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+IMPORT_TIME_PREFIX = 'import time:'
+
+
+@dataclass(frozen=True)
+class ImportTime:
+    """
+    The time spent importing a module: self_seconds excludes the modules it imported, which
+    cumulative_seconds includes. The depth is 0 for the modules imported by the script itself.
+    """
+    module: str
+    self_seconds: float
+    cumulative_seconds: float
+    depth: int
+
+    @property
+    def package(self) -> str:
+        return self.module.split('.')[0]
+
+
+def parse_import_time(line: str) -> Optional[ImportTime]:
+    """
+    Parses a line of the output of python -X importtime, e.g.
+    "import time:       421 |       1735 |   numpy.core".
+
+    :param line: The line.
+    :return: The import time, or None if the line is not an import time (or is the header).
+    """
+    if not line.startswith(IMPORT_TIME_PREFIX):
+        return None
+    fields: List[str] = line[len(IMPORT_TIME_PREFIX):].split('|')
+    if len(fields) != 3 or not fields[0].strip().isdigit():
+        return None
+    name: str = fields[2].rstrip()
+    module: str = name.lstrip()
+    # the name is preceded by a space, and by two more per level of nesting
+    return ImportTime(module=module,
+                      self_seconds=int(fields[0]) / 1e6,
+                      cumulative_seconds=int(fields[1]) / 1e6,
+                      depth=(len(name) - len(module) - 1) // 2)
+
+
+def total_by_package(import_times: List[ImportTime]) -> Dict[str, float]:
+    """
+    :param import_times: The import times of the modules.
+    :return: The time spent importing the modules of each top-level package, slowest first.
+    """
+    totals: Dict[str, float] = {}
+    for import_time in import_times:
+        totals[import_time.package] = totals.get(import_time.package, 0.0) + import_time.self_seconds
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def print_report(import_times: List[ImportTime], elapsed_seconds: float, top: int = 20) -> None:
+    """
+    Prints the slowest top-level imports, packages and modules.
+
+    :param import_times: The import times of the modules.
+    :param elapsed_seconds: The wall-clock time of the whole run.
+    :param top: The number of rows of each table.
+    """
+    total_seconds: float = sum(import_time.self_seconds for import_time in import_times)
+    print(f'\nImported {len(import_times)} modules in {total_seconds:.3f}s '
+          f'of a run of {elapsed_seconds:.3f}s')
+
+    print('\nSlowest imports of the script (cumulative):')
+    script_imports: List[ImportTime] = sorted((import_time for import_time in import_times if import_time.depth == 0),
+                                              key=lambda import_time: import_time.cumulative_seconds, reverse=True)
+    for import_time in script_imports[:top]:
+        print(f'{import_time.cumulative_seconds:10.3f}s  {import_time.module}')
+
+    print('\nSlowest packages (self):')
+    for package, seconds in list(total_by_package(import_times).items())[:top]:
+        print(f'{seconds:10.3f}s  {package}')
+
+    print('\nSlowest modules (self):')
+    for import_time in sorted(import_times, key=lambda import_time: import_time.self_seconds, reverse=True)[:top]:
+        print(f'{import_time.self_seconds:10.3f}s  {import_time.module}')
+
+
+def profile_startup(script_arguments: List[str], top: int = 20) -> int:
+    """
+    Runs a script with python -X importtime and prints a report of its import times. The output of
+    the script is passed through.
+
+    :param script_arguments: The script followed by its arguments.
+    :param top: The number of rows of each table of the report.
+    :return: The exit code of the script.
+    """
+    start: float = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-X', 'importtime'] + script_arguments,
+                               stderr=subprocess.PIPE, text=True)
+    import_times: List[ImportTime] = []
+    for line in process.stderr:
+        import_time: Optional[ImportTime] = parse_import_time(line)
+        if import_time is not None:
+            import_times.append(import_time)
+        elif not line.startswith(IMPORT_TIME_PREFIX):
+            sys.stderr.write(line)
+    return_code: int = process.wait()
+
+    print_report(import_times, time.perf_counter() - start, top)
+    return return_code
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python3 startup_profiler.py script.py [arguments...]')
+        sys.exit(1)
+    sys.exit(profile_startup(sys.argv[1:]))
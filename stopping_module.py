@@ -0,0 +1,156 @@
+"""
+Contains the policies that stop training before the last epoch: the accuracy threshold (on the
+mean classifier accuracy of the last evaluations), patience on a logged metric, a mode collapse
+abort based on the STS similarity and a watchdog of the losses, which stops a run that diverged.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+from data.model_data_storage import TrainingParameters
+from evaluation_module import EvaluationResult
+
+STOP_ACCURACY_THRESHOLD = 'accuracy_threshold'
+STOP_EPOCH_LIMIT = 'epoch_limit'
+STOP_PLATEAU = 'plateau'
+STOP_MODE_COLLAPSE = 'mode_collapse'
+STOP_NON_FINITE_LOSS = 'non_finite_loss'
+
+# the metrics written to the results after every evaluation, and whether higher values are better
+LOGGED_METRICS: Dict[str, bool] = {
+    'classifier_accuracy': True,
+    'mean_rts_similarity': True,
+    'mean_sts_similarity': False,
+    'statistical_feature_distance': False,
+    'discriminator_accuracy': False,
+    'generator_discriminator_accuracy': True
+}
+
+
+@dataclass(frozen=True)
+class StopDecision:
+    """
+    Why training stopped, and after which step.
+    """
+    reason: str
+    step: int
+    detail: str = ''
+
+
+def logged_metrics(evaluation: EvaluationResult,
+                   discriminator_accuracy: float,
+                   generator_discriminator_accuracy: float) -> Dict[str, float]:
+    """
+    :param evaluation: The evaluation of a step.
+    :param discriminator_accuracy: The discriminator accuracy of the step.
+    :param generator_discriminator_accuracy: The accuracy of the generator in tricking the discriminator.
+    :return: The LOGGED_METRICS of the step.
+    """
+    return {'classifier_accuracy': float(evaluation.classifier_accuracy),
+            'mean_rts_similarity': float(np.mean(evaluation.mean_rts_similarity)),
+            'mean_sts_similarity': float(np.mean(evaluation.mean_sts_similarity)),
+            'statistical_feature_distance': float(np.mean(evaluation.statistical_feature_distance)),
+            'discriminator_accuracy': float(discriminator_accuracy),
+            'generator_discriminator_accuracy': float(generator_discriminator_accuracy)}
+
+
+class StoppingPolicy:
+    """
+    Decides when training stops, from the loss vectors of every step and the metrics of every
+    evaluation. Once a policy has decided to stop, the decision is kept in stop_decision.
+    """
+
+    def __init__(self, training_parameters: TrainingParameters):
+        """
+        :param training_parameters: The training parameters, which configure the policies:
+        accuracy_threshold and accuracy_window, patience, patience_metric and patience_min_delta,
+        collapse_sts_threshold and collapse_patience, and nan_check.
+        """
+        if training_parameters.patience_metric not in LOGGED_METRICS:
+            raise ValueError(f'Unknown patience metric "{training_parameters.patience_metric}", '
+                             f'expected one of {list(LOGGED_METRICS)}')
+        self.accuracy_threshold: float = training_parameters.accuracy_threshold
+        self.accuracies: Deque[float] = deque(maxlen=max(1, training_parameters.accuracy_window))
+        self.patience: int = training_parameters.patience
+        self.patience_metric: str = training_parameters.patience_metric
+        self.patience_min_delta: float = training_parameters.patience_min_delta
+        self.collapse_sts_threshold: float = training_parameters.collapse_sts_threshold
+        self.collapse_patience: int = max(1, training_parameters.collapse_patience)
+        self.nan_check: bool = training_parameters.nan_check
+
+        self.best_value: Optional[float] = None
+        self.evaluations_without_improvement: int = 0
+        self.collapsed_evaluations: int = 0
+        self.stop_decision: Optional[StopDecision] = None
+
+    @property
+    def smoothed_accuracy(self) -> float:
+        """
+        The mean classifier accuracy of the last accuracy_window evaluations.
+        """
+        return float(np.mean(self.accuracies)) if self.accuracies else 0.0
+
+    def check_losses(self, step: int, discriminator_losses: List[float],
+                     generator_losses: List[float]) -> Optional[StopDecision]:
+        """
+        Stops training if a loss (or accuracy) of the discriminator or the GCD model is NaN or infinite,
+        after which the weights are lost as well.
+
+        :param step: The step.
+        :param discriminator_losses: The loss vector of the discriminator update.
+        :param generator_losses: The loss vector of the GCD update.
+        :return: The decision to stop, or None.
+        """
+        if not self.nan_check or self.stop_decision is not None:
+            return self.stop_decision
+        for name, losses in (('D', discriminator_losses), ('GCD', generator_losses)):
+            if not np.all(np.isfinite(losses)):
+                self.stop_decision = StopDecision(STOP_NON_FINITE_LOSS, step, f'{name} losses {list(losses)}')
+                break
+        return self.stop_decision
+
+    def record(self, step: int, metrics: Dict[str, float]) -> Optional[StopDecision]:
+        """
+        Records the metrics of an evaluation.
+
+        :param step: The step of the evaluation.
+        :param metrics: The LOGGED_METRICS of the step.
+        :return: The decision to stop, or None.
+        """
+        if self.stop_decision is not None:
+            return self.stop_decision
+
+        # the smoothed threshold waits for a full window of evaluations
+        self.accuracies.append(metrics['classifier_accuracy'])
+        if len(self.accuracies) == self.accuracies.maxlen and self.smoothed_accuracy >= self.accuracy_threshold:
+            self.stop_decision = StopDecision(STOP_ACCURACY_THRESHOLD, step,
+                                              f'mean classifier accuracy {self.smoothed_accuracy} of the last '
+                                              f'{len(self.accuracies)} evaluations')
+            return self.stop_decision
+
+        if self.collapse_sts_threshold > 0:
+            sts_similarity: float = metrics['mean_sts_similarity']
+            self.collapsed_evaluations = self.collapsed_evaluations + 1 \
+                if sts_similarity >= self.collapse_sts_threshold else 0
+            if self.collapsed_evaluations >= self.collapse_patience:
+                self.stop_decision = StopDecision(STOP_MODE_COLLAPSE, step,
+                                                  f'STS similarity {sts_similarity} for '
+                                                  f'{self.collapsed_evaluations} evaluations')
+                return self.stop_decision
+
+        if self.patience > 0:
+            value: float = metrics[self.patience_metric]
+            sign: float = 1.0 if LOGGED_METRICS[self.patience_metric] else -1.0
+            if self.best_value is None or sign * (value - self.best_value) > self.patience_min_delta:
+                self.best_value = value
+                self.evaluations_without_improvement = 0
+            else:
+                self.evaluations_without_improvement += 1
+            if self.evaluations_without_improvement >= self.patience:
+                self.stop_decision = StopDecision(STOP_PLATEAU, step,
+                                                  f'no improvement of {self.patience_metric} on {self.best_value} '
+                                                  f'for {self.evaluations_without_improvement} evaluations')
+        return self.stop_decision
@@ -0,0 +1,100 @@
+"""
+Tests of the matrix based similarity computations against the per-pair cosine similarities they replace.
+Usage: python3 -m unittest test_compute_similarity_metrics
+"""
+
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+import compute_similarity_metrics as similarity
+
+
+def legacy_real_to_syn_similarity(real_input_data: np.ndarray,
+                                  synthetic_input_data: np.ndarray,
+                                  batch_size: int,
+                                  real_synthetic_ratio: int) -> float:
+    """
+    The real to synthetic similarity loop of earlier versions, drawing from the global numpy state.
+    """
+    real_input_data = real_input_data.reshape(len(real_input_data), -1)
+    synthetic_input_data = synthetic_input_data.reshape(len(synthetic_input_data), -1)
+    rts_sims: list = []
+    for i in range(batch_size):
+        indices_to_compare = np.random.choice(len(real_input_data), real_synthetic_ratio, replace=False)
+        for j in indices_to_compare:
+            sim = cosine_similarity(real_input_data[j].reshape(1, -1), synthetic_input_data[i].reshape(1, -1))
+            rts_sims.append(sim[0, 0])
+    return np.mean(np.array(rts_sims))
+
+
+class RealToSynSimilarityTest(unittest.TestCase):
+
+    def setUp(self):
+        generator: np.random.Generator = np.random.default_rng(0)
+        self.real_data: np.ndarray = generator.standard_normal((60, 20, 3), dtype=np.float32)
+        self.synthetic_data: np.ndarray = generator.standard_normal((25, 20, 3), dtype=np.float32)
+
+    def test_legacy_sampling_matches_the_original_loop(self):
+        # a small and a large population, which take different bulk draw paths
+        for num_segments, ratio in ((60, 5), (60, 40)):
+            with self.subTest(num_segments=num_segments, ratio=ratio):
+                real_data: np.ndarray = self.real_data[:num_segments]
+                np.random.seed(3)
+                expected: float = legacy_real_to_syn_similarity(real_data, self.synthetic_data,
+                                                                len(self.synthetic_data), ratio)
+                expected_state = np.random.get_state()[1]
+                np.random.seed(3)
+                actual: float = similarity.compute_real_to_syn_similarity(real_data, self.synthetic_data,
+                                                                          len(self.synthetic_data), ratio,
+                                                                          chunk_size=7, legacy_sampling=True)
+                self.assertAlmostEqual(actual, float(expected), places=5)
+                # the global state is left where the original loop left it
+                np.testing.assert_array_equal(np.random.get_state()[1], expected_state)
+
+    def test_exhaustive_mode_matches_all_pairs(self):
+        expected: float = float(np.mean(cosine_similarity(self.synthetic_data.reshape(25, -1),
+                                                          self.real_data.reshape(60, -1))))
+        actual: float = similarity.compute_real_to_syn_similarity(self.real_data, self.synthetic_data,
+                                                                  len(self.synthetic_data), 5,
+                                                                  mode=similarity.EXHAUSTIVE_MODE, chunk_size=7)
+        self.assertAlmostEqual(actual, expected, places=5)
+
+
+class ExhaustiveRealToRealSimilarityTest(unittest.TestCase):
+
+    def test_all_classes_match_all_pairs(self):
+        generator: np.random.Generator = np.random.default_rng(2)
+        data: np.ndarray = generator.standard_normal((50, 8, 2), dtype=np.float32)
+        # the single segment of class 5 has no pair, so no result
+        labels: np.ndarray = np.append(generator.integers(0, 3, 49), 5)
+        expected: dict = {}
+        for class_label in range(3):
+            similarities: np.ndarray = cosine_similarity(data[labels == class_label].reshape(-1, 16))
+            pairs: np.ndarray = similarities[np.triu_indices(len(similarities), k=1)]
+            expected[class_label] = (float(np.mean(pairs)), float(np.std(pairs)), len(pairs))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path: str = os.path.join(directory, 'data.h5')
+            with h5py.File(path, mode='w') as h5_file:
+                h5_file.create_dataset('X', data=data)
+                h5_file.create_dataset('y', data=labels.reshape(-1, 1))
+            # the second moment matrices, blocks of a single chunk and blocks of two chunks
+            for memory_limit in (2 ** 20, 1, 2 * 16 * 8 * 7):
+                with self.subTest(memory_limit=memory_limit):
+                    results: dict = similarity.compute_all_classes_rtr_similarity(
+                        path, mode=similarity.EXHAUSTIVE_MODE, chunk_size=7, use_cache=False,
+                        memory_limit=memory_limit)
+                    self.assertEqual(sorted(results), [0, 1, 2])
+                    for class_label, (mean, std, num_pairs) in expected.items():
+                        self.assertAlmostEqual(results[class_label]['mean'], mean, places=5)
+                        self.assertAlmostEqual(results[class_label]['std'], std, places=5)
+                        self.assertEqual(results[class_label]['num_pairs'], num_pairs)
+
+
+if __name__ == '__main__':
+    unittest.main()
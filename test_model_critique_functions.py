@@ -0,0 +1,53 @@
+"""
+Tests of the NumPy statistical features against the statistical feature net they replace in the evaluation.
+Usage: python3 -m unittest test_model_critique_functions
+"""
+
+import importlib.util
+import unittest
+
+import numpy as np
+
+import model_critique_functions as critique
+
+HAS_TENSORFLOW = importlib.util.find_spec('tensorflow') is not None
+
+
+class StatisticalFeaturesTest(unittest.TestCase):
+
+    @unittest.skipUnless(HAS_TENSORFLOW, 'the statistical feature net needs tensorflow')
+    def test_features_match_the_statistical_feature_net(self):
+        import models
+
+        seq_length: int = 100
+        num_features: int = len(critique.STATISTICAL_FEATURES)
+        generator: np.random.Generator = np.random.default_rng(0)
+        for num_channels in (1, 3, 6):
+            with self.subTest(num_channels=num_channels):
+                data: np.ndarray = generator.standard_normal((32, seq_length, num_channels), dtype=np.float32)
+                feature_net = models.create_statistical_feature_net(seq_length, num_channels, num_features)
+                expected: np.ndarray = feature_net.predict(data, verbose=0)
+                actual: np.ndarray = critique.compute_statistical_features(data, num_features)
+                self.assertEqual(actual.shape, expected.shape)
+                np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
+
+    def test_unknown_number_of_features(self):
+        with self.assertRaises(ValueError):
+            critique.compute_statistical_features(np.zeros((2, 10, 3), dtype=np.float32), num_features=4)
+
+    def test_distance_to_a_mean_feature_vector(self):
+        generator: np.random.Generator = np.random.default_rng(1)
+        synthetic_features: np.ndarray = generator.standard_normal((16, 27))
+        real_features: np.ndarray = generator.standard_normal(27)
+        expected: float = float(np.mean([np.linalg.norm(real_features - features) for features in synthetic_features]))
+        # a single feature vector is broadcast against every segment, in either argument
+        self.assertAlmostEqual(float(critique.compute_statistical_feature_distance(real_features, synthetic_features)),
+                               expected)
+        self.assertAlmostEqual(float(critique.compute_statistical_feature_distance(synthetic_features, real_features)),
+                               expected)
+        self.assertAlmostEqual(float(critique.compute_statistical_feature_distance(
+            np.repeat(real_features[np.newaxis], len(synthetic_features), axis=0), synthetic_features)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
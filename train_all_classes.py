@@ -0,0 +1,326 @@
+"""
+Trains a GAN for every combination of a list of class labels and ablations of one dataset (or with
+conditional = True in model.conf, one conditional GAN of all the class labels per ablation), loading
+the dataset and the classifier once rather than once per run, either sequentially in this process
+or across a pool of processes. Every run writes its results, its models and its output to its own
+directory, named after the dataset, the class label and the loss functions used (as do_experiments.rb does).
+Usage: python3 train_all_classes.py dataset.h5 classifier.h5 --labels 0 1 --ablations CR C R none
+"""
+
+import argparse as arg_parser
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import h5py
+import numpy as np
+
+import config_file_parser
+import input_module
+from data.model_data_storage import TrainingParameters, Weights, Names, ModelData, CacheSettings
+from input_module import InputModuleConfiguration
+
+# the loss functions used by each ablation, as (ignore_classifier, ignore_sfd)
+ABLATIONS: Dict[str, Tuple[bool, bool]] = {
+    'CR': (False, False),
+    'C': (False, True),
+    'R': (True, False),
+    'none': (True, True)
+}
+
+SUMMARY_FILENAME = 'summary.json'
+METRICS_DATABASE = 'metrics.sqlite'
+
+
+@dataclass(frozen=True)
+class TrainingRun:
+    """
+    A single GAN to train: a class label and the loss functions used. A conditional GAN serves
+    several class labels, and its class label only selects the class of its saved samples.
+    """
+    dataset_name: str
+    class_label: int
+    ignore_classifier: bool
+    ignore_sfd: bool
+    class_labels: Optional[Tuple[int, ...]] = None
+
+    @property
+    def conditional(self) -> bool:
+        return self.class_labels is not None
+
+    @property
+    def name(self) -> str:
+        """
+        The name of the run, which is also the name of its directory.
+        """
+        classifier: str = '' if self.ignore_classifier else 'C'
+        regularizer: str = '' if self.ignore_sfd else 'R'
+        label: str = 'conditional' if self.conditional else str(self.class_label)
+        return f'{self.dataset_name}_{label}{classifier}{regularizer}'
+
+
+def plan_runs(dataset_name: str,
+              labels: List[int],
+              ablations: List[str],
+              conditional: bool = False) -> List[TrainingRun]:
+    """
+    Plans the runs of a dataset: a GAN per class label and ablation, or with a conditional GAN,
+    which serves every class label at once, a single GAN per ablation.
+
+    :param dataset_name: The name of the dataset.
+    :param labels: The class labels.
+    :param ablations: The ablations, keys of ABLATIONS.
+    :param conditional: Whether the GANs are conditional.
+    :return: The runs.
+    """
+    if conditional:
+        return [TrainingRun(dataset_name, labels[0], *ABLATIONS[ablation], class_labels=tuple(labels))
+                for ablation in ablations]
+    return [TrainingRun(dataset_name, label, *ABLATIONS[ablation]) for label in labels for ablation in ablations]
+
+
+@dataclass(frozen=True)
+class TrainingSettings:
+    """
+    What every run shares besides the dataset and the classifier.
+    """
+    data_file_path: str
+    classifier_path: str
+    output_directory: str
+    training_parameters: TrainingParameters
+    weights: Weights
+    names: Names
+    cache_settings: CacheSettings
+    overwrite_checkpoints: bool = False
+
+
+class TrainingResources:
+    """
+    The dataset and the classifier, loaded once per process. The GCD model trains the classifier,
+    so every run gets a fresh copy of it, rebuilt from its architecture and weights.
+    """
+
+    def __init__(self, data_file_path: str, classifier_path: str):
+        """
+        :param data_file_path: The path of the .h5 dataset.
+        :param classifier_path: The path of the pre-trained classifier.
+        """
+        from keras.models import load_model
+
+        self.input_data, self.output_data, self.num_classes = input_module.load_labelled_data(data_file_path)
+        classifier = load_model(classifier_path, compile=False)
+        self.classifier_architecture: str = classifier.to_json()
+        self.classifier_weights: List[np.ndarray] = classifier.get_weights()
+
+    def create_classifier(self):
+        """
+        :return: A copy of the classifier, as a Keras Functional object.
+        """
+        from keras.models import model_from_json
+
+        classifier = model_from_json(self.classifier_architecture)
+        classifier.set_weights(self.classifier_weights)
+        return classifier
+
+
+def select_classes(input_data: np.ndarray,
+                   output_data: np.ndarray,
+                   class_labels: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Selects the rows of several classes, which are not copied if they are every class of the data.
+
+    :param input_data: The input data.
+    :param output_data: The class labels of the input data.
+    :param class_labels: The class labels to select.
+    :return: The input data and the class labels of the selected rows.
+    """
+    output_data = output_data.reshape(-1)
+    selected: np.ndarray = np.isin(output_data, class_labels)
+    if np.all(selected):
+        return input_data, output_data
+    return input_data[selected], output_data[selected]
+
+
+def run_training(run: TrainingRun, settings: TrainingSettings, resources: TrainingResources) -> dict:
+    """
+    Trains and saves the GAN of a run, writing its results and output to the directory of the run.
+
+    :param run: The run.
+    :param settings: The settings shared by the runs.
+    :param resources: The dataset and classifier of this process.
+    :return: A summary of the run.
+    """
+    from keras import backend as keras_backend
+    import main
+    from gan_model import GanModel
+
+    run_directory: str = os.path.join(settings.output_directory, run.name)
+    os.makedirs(run_directory, exist_ok=True)
+
+    input_config: InputModuleConfiguration = InputModuleConfiguration()
+    input_config.data_file_path = settings.data_file_path
+    input_config.classifier_path = settings.classifier_path
+    input_config.class_label = run.class_label
+    input_config.write_train_results = True
+    input_config.results_directory = run_directory
+    # the runs share a metrics database, so that they can be compared with a single query
+    input_config.metrics_database = os.path.abspath(os.path.join(settings.output_directory, METRICS_DATABASE))
+    input_config.save_directory = run_directory
+    input_config.checkpoint_directory = os.path.join(run_directory, 'checkpoints')
+    model_data: ModelData = ModelData(discriminator_filename=f'D_{run.name}.h5',
+                                      generator_filename=f'G_{run.name}.h5',
+                                      directory=run_directory,
+                                      exists=False)
+
+    summary: dict = {'name': run.name,
+                     'class_label': run.class_label,
+                     'class_labels': list(run.class_labels) if run.conditional else [run.class_label],
+                     'ignore_classifier': run.ignore_classifier,
+                     'ignore_sfd': run.ignore_sfd,
+                     'directory': run_directory}
+    start: float = time.perf_counter()
+
+    # the models of the previous runs are not needed anymore
+    keras_backend.clear_session()
+    with open(os.path.join(run_directory, 'stdout.txt'), mode='w', encoding='utf-8') as output_file, \
+            contextlib.redirect_stdout(output_file):
+        try:
+            # a conditional GAN is trained on every class it serves, the class label only selects its samples
+            if run.conditional:
+                input_data, class_labels = select_classes(resources.input_data, resources.output_data,
+                                                          run.class_labels)
+            else:
+                input_data, class_labels = input_module.select_class(resources.input_data, resources.output_data,
+                                                                     run.class_label)
+            gan_model: GanModel = GanModel(settings.training_parameters,
+                                           settings.weights,
+                                           settings.names,
+                                           model_data,
+                                           input_config,
+                                           ignore_classifier=run.ignore_classifier,
+                                           ignore_sfd=run.ignore_sfd,
+                                           cache_settings=settings.cache_settings,
+                                           input_data=input_data,
+                                           num_classes=resources.num_classes,
+                                           classifier=resources.create_classifier(),
+                                           class_labels=class_labels)
+            stop_decision = main.train_model(Namespace(save=True, show_plot_results=False, resume=False,
+                                                       overwrite_checkpoints=settings.overwrite_checkpoints),
+                                             gan_model)
+            summary['status'] = 'success'
+            summary['stop_reason'] = stop_decision.reason
+        except Exception as error:
+            summary['status'] = 'failure'
+            summary['error'] = repr(error)
+
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+# the resources of a worker process of the pool, loaded once by the pool initializer
+_worker_resources: Optional[TrainingResources] = None
+
+
+def _initialize_worker(data_file_path: str, classifier_path: str) -> None:
+    global _worker_resources
+    _worker_resources = TrainingResources(data_file_path, classifier_path)
+
+
+def _run_in_worker(run: TrainingRun, settings: TrainingSettings) -> dict:
+    return run_training(run, settings, _worker_resources)
+
+
+def train_all_classes(runs: List[TrainingRun], settings: TrainingSettings, processes: int = 1) -> List[dict]:
+    """
+    Trains the GANs of the given runs and writes a summary of them to the output directory.
+
+    :param runs: The runs.
+    :param settings: The settings shared by the runs.
+    :param processes: The number of processes training at the same time, 1 trains the runs in this process.
+    Every process loads the dataset and the classifier once.
+    :return: The summaries of the runs.
+    """
+    os.makedirs(settings.output_directory, exist_ok=True)
+    summaries: List[dict] = []
+    if processes <= 1:
+        resources: TrainingResources = TrainingResources(settings.data_file_path, settings.classifier_path)
+        for run in runs:
+            print(f'RUNNING EXPERIMENT {run.name}')
+            summaries.append(run_training(run, settings, resources))
+            print(f'RESULTING STATUS: {summaries[-1]["status"]}')
+    else:
+        # tensorflow is not fork safe, so the workers are spawned
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_initialize_worker,
+                                 initargs=(settings.data_file_path, settings.classifier_path)) as executor:
+            for summary in executor.map(_run_in_worker, runs, [settings] * len(runs)):
+                print(f'EXPERIMENT {summary["name"]} RESULTING STATUS: {summary["status"]}')
+                summaries.append(summary)
+
+    with open(os.path.join(settings.output_directory, SUMMARY_FILENAME), mode='w', encoding='utf-8') as summary_file:
+        json.dump(summaries, summary_file, indent=2)
+    return summaries
+
+
+def read_class_labels(data_file_path: str) -> List[int]:
+    """
+    Reads the class labels present in a dataset.
+
+    :param data_file_path: The path of the .h5 dataset.
+    :return: A sorted list of class labels.
+    """
+    with h5py.File(data_file_path, mode='r') as h5_file:
+        return [int(label) for label in np.unique(np.asarray(h5_file['y']))]
+
+
+def parse_cli_arguments() -> Namespace:
+    """
+    Utility function that parses command line arguments
+    """
+    parser = arg_parser.ArgumentParser(description='''
+                                                   Trains a GAN for each class label and ablation of a dataset,
+                                                   with the hyperparameters of model.conf
+                                                   ''')
+    parser.add_argument('dataset', type=str,
+                        help='The .h5 dataset to train on')
+    parser.add_argument('classifier', type=str,
+                        help='The pre-trained classifier of the dataset')
+    parser.add_argument('-l', '--labels', type=int, nargs='+', default=None,
+                        help='The class labels to train a GAN for, by default every class of the dataset')
+    parser.add_argument('-a', '--ablations', type=str, nargs='+', default=['CR'], choices=list(ABLATIONS),
+                        help='The loss functions used: CR both, C the classifier only, '
+                             'R the SFD regularization only, none neither')
+    parser.add_argument('-o', '--output-directory', type=str, default='runs',
+                        help='The directory the runs write to, one sub-directory per run')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='The number of runs trained at the same time')
+    parser.add_argument('--overwrite-checkpoints', action='store_true',
+                        help='Remove the checkpoints of an earlier run in the output directory instead of '
+                             'failing the run')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    cli_args: Namespace = parse_cli_arguments()
+    training_parameters, weights, names, _, cache_settings = config_file_parser.ModelConfigParser().parse_config()
+    dataset_name: str = os.path.splitext(os.path.basename(cli_args.dataset))[0]
+    labels: List[int] = cli_args.labels if cli_args.labels is not None else read_class_labels(cli_args.dataset)
+    training_runs: List[TrainingRun] = plan_runs(dataset_name, labels, cli_args.ablations,
+                                                 conditional=training_parameters.conditional)
+    train_all_classes(training_runs,
+                      TrainingSettings(data_file_path=cli_args.dataset,
+                                       classifier_path=cli_args.classifier,
+                                       output_directory=cli_args.output_directory,
+                                       training_parameters=training_parameters,
+                                       weights=weights,
+                                       names=names,
+                                       cache_settings=cache_settings,
+                                       overwrite_checkpoints=cli_args.overwrite_checkpoints),
+                      processes=cli_args.processes)
@@ -4,12 +4,13 @@ Usage: python3 train_simple_lstm.py dataset_name.h5 classifier_name.h5
 """
 
 import sys
-import h5py
 import numpy as np
 from keras.models import Sequential
 from keras.layers import Dense, LSTM
 from sklearn.model_selection import train_test_split
 
+from input_module import load_all_data
+
 
 def create_classifier_model(number_of_classes: int):
     """
@@ -48,21 +49,19 @@ if __name__ == '__main__':
         print("Usage: python3 train_simple_lstm.py dataset_name.h5 classifier_name.h5")
         exit(1)
 
-    # Load dataset
-    dataset = h5py.File(sys.argv[1], 'r')
-    x = dataset['X']
-    y = dataset['y_onehot']
+    # Load dataset, a class sorted file (see convert_dataset.py) is read sequentially
+    x, y = load_all_data(sys.argv[1])
 
     # Split dataset into 30% testing, 70% training
     x_train, x_test, y_train, y_test = train_test_split(
-        np.asarray(x),
-        np.asarray(y),
+        x,
+        y,
         test_size=0.3
     )
 
     # Train model on training data, validate on testing data
     num_classes = y.shape[1]
-    model = create_model(num_classes)
+    model = create_classifier_model(num_classes)
     fitted = model.fit(
         x_train, y_train,
         epochs=300, batch_size=100,
@@ -2,16 +2,55 @@
 Functions for training generator and assessing data. In particular, contains functions for
 training generator and discriminator, generating synthetic data, and computing the similarity metrics
 """
-from typing import Tuple
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
 
 import numpy as np
+import tensorflow as tf
+from keras import backend as keras_backend
 from keras.engine.functional import Functional
-from keras.utils.np_utils import to_categorical
 from sklearn.metrics.pairwise import cosine_similarity
 from tensorflow import Tensor
+
+from batch_module import NoiseGenerator, TrainingBatch
+from data.model_data_storage import Weights
+from instrumentation_module import phase
 from compute_similarity_metrics import \
     compute_syn_to_syn_similarity, \
-    compute_real_to_syn_similarity
+    compute_real_to_syn_similarity, \
+    RealSimilarityEngine, \
+    SAMPLED_MODE
+
+
+LEGACY_TRAIN_STEP = 'legacy'
+COMPILED_TRAIN_STEP = 'compiled'
+TRAIN_STEPS = (LEGACY_TRAIN_STEP, COMPILED_TRAIN_STEP)
+
+
+@dataclass(frozen=True)
+class TrainingStepResult:
+    """
+    The losses and accuracies of one discriminator update followed by one generator update.
+    The loss vectors are laid out like the output of train_on_batch, i.e.
+    discriminator_losses = [loss, accuracy] and
+    generator_losses = [loss, D loss, C loss, SFN loss, D accuracy, C accuracy].
+    """
+    discriminator_losses: List[float]
+    generator_losses: List[float]
+
+    @property
+    def discriminator_accuracy(self) -> float:
+        """
+        The accuracy of the discriminator during its "turn" for training.
+        """
+        return self.discriminator_losses[1]
+
+    @property
+    def generator_discriminator_accuracy(self) -> float:
+        """
+        The accuracy of the generator in tricking the discriminator.
+        """
+        return self.generator_losses[4]
 
 
 def null_loss(_actual_output_data: Tensor,
@@ -39,24 +78,49 @@ def euc_dist_loss(actual_output_data: Tensor,
                           axis=-1))
 
 
+_noise_generator: Optional[np.random.Generator] = None
+
+
+def _default_noise_generator() -> np.random.Generator:
+    """
+    :return: The generator of the noise drawn without a noise generator, which is seeded by the
+    global numpy state when it is first used, so that np.random.seed still makes the noise reproducible.
+    """
+    global _noise_generator
+    if _noise_generator is None:
+        _noise_generator = np.random.default_rng(np.random.randint(0, 2 ** 31))
+    return _noise_generator
+
+
 def generate_input_noise(batch_size: int, latent_dim: int,
-                         time_steps: int) -> np.ndarray:
+                         time_steps: int,
+                         noise_generator: Optional[NoiseGenerator] = None) -> np.ndarray:
     """
     Function that generates random input by sampling from a normal distribution, note that the input
-    varies at each time-step.
+    varies at each time-step. The noise is float32, which is what the generator consumes.
 
     :param batch_size: The size of the batch.
     :param latent_dim: The latent dimension.
     :param time_steps: The time-steps.
+    :param noise_generator: A noise generator of the shape (batch_size, time_steps, latent_dim), which
+    reuses its buffers; by default a new array is drawn from a generator seeded by the global numpy state.
     :return: Input noise.
+    :raises ValueError: If the shape of the noise generator is not (batch_size, time_steps, latent_dim).
     """
-    return np.reshape(
-        np.array(np.random.normal(0, 1, latent_dim * time_steps * batch_size)),
-        (batch_size, time_steps, latent_dim))
+    shape: Tuple[int, int, int] = (batch_size, time_steps, latent_dim)
+    with phase('noise_generation'):
+        if noise_generator is not None:
+            if noise_generator.shape != shape:
+                raise ValueError(f'The noise generator is of the shape {noise_generator.shape}, '
+                                 f'expected {shape}')
+            return noise_generator.next()
+        return _default_noise_generator().standard_normal(shape, dtype=np.float32)
 
 
 def generate_synthetic_data(size: int, generator: Functional, latent_dim: int,
-                            time_steps: int) -> np.ndarray:
+                            time_steps: int,
+                            noise_generator: Optional[NoiseGenerator] = None,
+                            classes: Optional[np.ndarray] = None) -> np.ndarray:
     """
     A utility function for generating a synthetic data set.
 
@@ -64,88 +128,189 @@ def generate_synthetic_data(size: int, generator: Functional, latent_dim: int,
     :param generator: The generator model.
     :param latent_dim: The latent dimensions.
     :param time_steps: The time-steps.
+    :param noise_generator: An optional noise generator of the shape (size, time_steps, latent_dim).
+    :param classes: The class labels of the shape (size, 1) to generate data for, if the generator is conditional.
     :return: Synthetic data as a numpy array.
     """
-    noise: np.ndarray = generate_input_noise(size, latent_dim, time_steps)
-    synthetic_data: np.ndarray = generator.predict(noise)
+    noise: np.ndarray = generate_input_noise(size, latent_dim, time_steps, noise_generator)
+    with phase('generator.predict'):
+        synthetic_data: np.ndarray = generator.predict(noise if classes is None else [noise, classes])
     return synthetic_data
 
 
-def train_generator(batch_size: int,
-                    input_data: np.ndarray,
-                    class_label: int,
+def create_graph_synthetic_data_function(generator: Functional,
+                                         latent_dim: int,
+                                         time_steps: int,
+                                         noise_generator: tf.random.Generator) -> Callable:
+    """
+    Builds a tf.function that samples the noise on-graph and runs the generator on it,
+    so that generating synthetic data needs no noise from the host.
+
+    :param generator: The generator model.
+    :param latent_dim: The latent dimensions.
+    :param time_steps: The time-steps.
+    :param noise_generator: The tf.random generator the noise is drawn from.
+    :return: A function taking the size of the synthetic data, and the class labels of the shape
+    (size, 1) if the generator is conditional, and returning the synthetic data as a tensor.
+    """
+    @tf.function
+    def generate(size: Tensor, classes: Optional[Tensor] = None) -> Tensor:
+        noise = noise_generator.normal(shape=tf.stack([size, time_steps, latent_dim]))
+        return generator(noise if classes is None else [noise, classes], training=False)
+
+    return generate
+
+
+def train_generator(batch: TrainingBatch,
+                    class_labels: np.ndarray,
                     actual_features: np.ndarray,
-                    num_labels: int,
-                    model: Functional,
-                    latent_dim: int) -> list:
+                    model: Functional) -> list:
     """
     A utility function for training the generator based on both the discriminator
     and the classifier output.
 
-    :param batch_size: The size of the batch.
-    :param input_data: The input data as a numpy array.
-    :param class_label: The class label.
+    :param batch: The training batch, which provides the noise and the real/synthetic labels.
+    :param class_labels: The one-hot class labels of the batch, which are the generator classes of
+    the batch for a conditional generator.
     :param actual_features: The actual features denoted as a numpy array.
-    :param num_labels: The number of labels.
     :param model: The model, which is a functional object, and is either a discriminator or a classifier.
-    :param latent_dim: The latent dimension.
     :return: The loss as a list.
     """
-
-    noise: np.ndarray = generate_input_noise(batch_size, latent_dim,
-                                             input_data.shape[1])
-
-    # labels related to whether data is real or synthetic
-    real_synthetic_labels: np.ndarray = np.ones([batch_size, 1])
-
-    # labels related to the class of the data
-    class_labels: int = to_categorical([class_label] * batch_size,
-                                       num_classes=num_labels)
-    loss: list = model.train_on_batch(noise,
-                                      [real_synthetic_labels, class_labels,
-                                       actual_features])
+    generator_input = batch.generator_noise if batch.generator_classes is None \
+        else [batch.generator_noise, batch.generator_classes]
+    with phase('GCD.train_on_batch'):
+        loss: list = model.train_on_batch(generator_input,
+                                          [batch.generator_labels, class_labels,
+                                           actual_features])
 
     return loss
 
 
-def train_discriminator(batch_size: int,
-                        input_data: np.ndarray,
+def train_discriminator(batch: TrainingBatch,
                         generator_model: Functional,
-                        discriminator_model: Functional,
-                        latent_dim: int) -> list:
+                        discriminator_model: Functional) -> list:
     """
     A function for training the discriminator based on the generator input.
 
-    :param batch_size: The batch size as an integer.
-    :param input_data: The input data as a numpy array.
+    :param batch: The training batch, whose discriminator input already holds the real data.
     :param generator_model: The generator model as a keras Functional object.
     :param discriminator_model: The discriminator model as a keras Functional object.
-    :param latent_dim: The latent dimension fo the discriminator.
     :return: The loss as a list.
     """
+    # generates the synthetic data right after the real data
+    with phase('generator.predict'):
+        if batch.discriminator_classes is None:
+            batch.discriminator_input[batch.batch_size:] = generator_model.predict_on_batch(batch.discriminator_noise)
+            discriminator_input = batch.discriminator_input
+        else:
+            batch.discriminator_input[batch.batch_size:] = generator_model.predict_on_batch(
+                [batch.discriminator_noise, batch.synthetic_classes])
+            discriminator_input = [batch.discriminator_input, batch.discriminator_classes]
 
-    # generates the synthetic data
-    synthetic_data: np.ndarray = generate_synthetic_data(batch_size,
-                                                         generator_model,
-                                                         latent_dim,
-                                                         input_data.shape[1])
+    # trains the discriminator and returns the loss
+    with phase('D.train_on_batch'):
+        loss: list = discriminator_model.train_on_batch(discriminator_input,
+                                                        batch.discriminator_labels)
+    return loss
 
-    # selects a random batch of real data
-    indices_toKeep: np.ndarray = np.random.choice(input_data.shape[0],
-                                                  batch_size,
-                                                  replace=False)
-    real_data: np.ndarray = input_data[indices_toKeep]
 
-    # makes the full input and labels and
-    # feeds the aforementioned into the network
-    full_input: np.ndarray = np.concatenate((real_data, synthetic_data))
-    real_synthetic_label: np.ndarray = np.ones((2 * batch_size, 1))
-    real_synthetic_label[batch_size:, :] = 0
+def create_compiled_train_step(generator: Functional,
+                                discriminator_model: Functional,
+                                discriminator_variables: List[tf.Variable],
+                                gcd_model: Functional,
+                                weights: Weights,
+                                ignore_classifier: bool = False,
+                                ignore_sfd: bool = False,
+                                jit_compile: bool = False,
+                                noise_generator: Optional[tf.random.Generator] = None) -> Callable:
+    """
+    Builds a single tf.function that does what train_discriminator followed by train_generator
+    do, i.e. one discriminator update on a batch of real and generated data and one update of
+    the GCD model, entirely in graph. The optimizers of the compiled Keras models are reused, so
+    the legacy and the compiled step can be swapped for one another.
 
-    # trains the discriminator and returns the loss
-    loss: list = discriminator_model.train_on_batch(full_input,
-                                                    real_synthetic_label)
-    return loss
+    :param generator: The generator model.
+    :param discriminator_model: The compiled discriminator model.
+    :param discriminator_variables: The trainable variables of the discriminator, captured before
+    the discriminator was frozen for the GCD model.
+    :param gcd_model: The compiled GCD model, whose outputs are (D, C, SFN).
+    :param weights: The weights of the D, C and SFN losses.
+    :param ignore_classifier: Whether the classifier loss is ignored.
+    :param ignore_sfd: Whether the SFD loss is ignored.
+    :param jit_compile: Whether to compile the step with XLA.
+    :param noise_generator: A tf.random generator, with which the step samples the noise itself
+    whenever it is called with None for the discriminator and the generator noise.
+    :return: A function taking (real_data, discriminator_noise, generator_noise, class_labels,
+    actual_features), and for a conditional GAN the discriminator_classes and generator_classes of
+    the batch as well, and returning a TrainingStepResult-like pair of loss vectors as tensors.
+    """
+    conditional: bool = isinstance(generator.input, list)
+    latent_dim: int = (generator.input_shape[0] if conditional else generator.input_shape)[-1]
+    binary_crossentropy = tf.keras.losses.BinaryCrossentropy()
+    categorical_crossentropy = tf.keras.losses.CategoricalCrossentropy()
+    discriminator_loss_weight = float(weights.discriminator_loss_weight)
+    classifier_loss_weight = float(weights.classifier_loss_weight)
+    sfd_loss_weight = float(weights.sfd_loss_weight)
+
+    def apply_gradients(optimizer, loss: Tensor, variables: List[tf.Variable], tape: tf.GradientTape) -> None:
+        gradients = tape.gradient(loss, variables)
+        # variables that do not contribute to the loss (e.g. an ignored classifier) have no gradient
+        optimizer.apply_gradients([(gradient, variable) for gradient, variable in zip(gradients, variables)
+                                   if gradient is not None])
+
+    @tf.function(jit_compile=jit_compile)
+    def train_step(real_data: Tensor,
+                   discriminator_noise: Tensor,
+                   generator_noise: Tensor,
+                   class_labels: Tensor,
+                   actual_features: Tensor,
+                   discriminator_classes: Optional[Tensor] = None,
+                   generator_classes: Optional[Tensor] = None) -> Tuple[Tensor, Tensor]:
+        real_data = tf.cast(real_data, tf.float32)
+        batch_size = tf.shape(real_data)[0]
+        if discriminator_noise is None:
+            noise_shape = tf.stack([batch_size, tf.shape(real_data)[1], latent_dim])
+            discriminator_noise = noise_generator.normal(shape=noise_shape)
+            generator_noise = noise_generator.normal(shape=noise_shape)
+
+        # discriminator update on real data labelled 1 and synthetic data labelled 0
+        if conditional:
+            synthetic_data = generator([discriminator_noise, discriminator_classes[batch_size:]], training=False)
+        else:
+            synthetic_data = generator(discriminator_noise, training=False)
+        full_input = tf.concat([real_data, synthetic_data], axis=0)
+        if conditional:
+            full_input = [full_input, discriminator_classes]
+        real_synthetic_labels = tf.concat([tf.ones((batch_size, 1)), tf.zeros((batch_size, 1))], axis=0)
+        with tf.GradientTape() as discriminator_tape:
+            predictions = discriminator_model(full_input, training=True)
+            discriminator_loss = binary_crossentropy(real_synthetic_labels, predictions)
+        apply_gradients(discriminator_model.optimizer, discriminator_loss, discriminator_variables,
+                        discriminator_tape)
+        discriminator_accuracy = tf.reduce_mean(tf.keras.metrics.binary_accuracy(real_synthetic_labels, predictions))
+
+        # generator update, trying to get the synthetic data labelled 1 by the discriminator
+        generator_noise = tf.cast(generator_noise, tf.float32)
+        tricked_labels = tf.ones((tf.shape(generator_noise)[0], 1))
+        gcd_input = [generator_noise, generator_classes] if conditional else generator_noise
+        with tf.GradientTape() as generator_tape:
+            discriminator_output, classifier_output, feature_output = gcd_model(gcd_input, training=True)
+            d_loss = binary_crossentropy(tricked_labels, discriminator_output)
+            c_loss = tf.constant(0.0) if ignore_classifier \
+                else categorical_crossentropy(class_labels, classifier_output)
+            sfn_loss = tf.constant(0.0) if ignore_sfd \
+                else tf.reduce_mean(euc_dist_loss(tf.cast(actual_features, tf.float32), feature_output))
+            generator_loss = discriminator_loss_weight * d_loss \
+                + classifier_loss_weight * c_loss \
+                + sfd_loss_weight * sfn_loss
+        apply_gradients(gcd_model.optimizer, generator_loss, gcd_model.trainable_variables, generator_tape)
+        generator_accuracy = tf.reduce_mean(tf.keras.metrics.binary_accuracy(tricked_labels, discriminator_output))
+        classifier_accuracy = tf.reduce_mean(tf.keras.metrics.categorical_accuracy(class_labels, classifier_output))
+
+        return tf.stack([discriminator_loss, discriminator_accuracy]), \
+            tf.stack([generator_loss, d_loss, c_loss, sfn_loss, generator_accuracy, classifier_accuracy])
+
+    return train_step
 
 
 def train_tstr_classifier(synthetic_data: np.ndarray,
@@ -168,7 +333,11 @@ def compute_similarity_metrics(synthetic_input_data: np.ndarray,
                                real_input_data: np.ndarray,
                                batch_size: int,
                                real_synthetic_ratio: int,
-                               synthetic_synthetic_ratio: int) -> \
+                               synthetic_synthetic_ratio: int,
+                               rts_mode: str = SAMPLED_MODE,
+                               sts_mode: str = SAMPLED_MODE,
+                               rts_legacy_sampling: bool = False,
+                               similarity_engine: Optional[RealSimilarityEngine] = None) -> \
         Tuple[np.ndarray, np.ndarray]:
     """
     Function for computing the mean rts and sts similarity, which is in turn
@@ -179,16 +348,35 @@ def compute_similarity_metrics(synthetic_input_data: np.ndarray,
     :param batch_size: The batch size.
     :param real_synthetic_ratio: The real-to-synthetic ratio.
     :param synthetic_synthetic_ratio: The synthetic-to-synthetic ratio.
+    :param rts_mode: Either "sampled" or "exhaustive", how the rts similarity is computed.
+    :param sts_mode: Either "sampled" or "exhaustive", how the sts similarity is computed.
+    :param rts_legacy_sampling: Draw the real segments of the sampled rts similarity one synthetic
+    segment at a time, like earlier versions, so seeded runs reproduce their results.
+    :param similarity_engine: An engine built over real_input_data, which saves
+    normalizing the real data again on every call.
     :return: The similarity metrics as a tuple of numpy arrays containing
     the mean rts similarity and the mean sts similarity in the following form
     (numpy array, numpy array)
     """
-    return compute_real_to_syn_similarity(real_input_data,
-                                          synthetic_input_data,
-                                          batch_size,
-                                          real_synthetic_ratio), \
-        compute_syn_to_syn_similarity(synthetic_input_data,
-                                      synthetic_synthetic_ratio,
-                                      batch_size,
-                                      real_input_data.shape[1],
-                                      real_input_data.shape[2])
+    with phase('rts_similarity'):
+        if similarity_engine is None:
+            mean_rts_similarity = compute_real_to_syn_similarity(real_input_data,
+                                                                 synthetic_input_data,
+                                                                 batch_size,
+                                                                 real_synthetic_ratio,
+                                                                 mode=rts_mode,
+                                                                 legacy_sampling=rts_legacy_sampling)
+        else:
+            mean_rts_similarity = similarity_engine.real_to_syn_similarity(synthetic_input_data[:batch_size],
+                                                                           real_synthetic_ratio,
+                                                                           mode=rts_mode,
+                                                                           legacy_sampling=rts_legacy_sampling)
+
+    with phase('sts_similarity'):
+        mean_sts_similarity = compute_syn_to_syn_similarity(synthetic_input_data,
+                                                            synthetic_synthetic_ratio,
+                                                            batch_size,
+                                                            real_input_data.shape[1],
+                                                            real_input_data.shape[2],
+                                                            mode=sts_mode)
+    return mean_rts_similarity, mean_sts_similarity